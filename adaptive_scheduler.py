@@ -0,0 +1,175 @@
+import math
+import random
+
+import numpy
+
+# --------------------------- Configuration ---------------------------
+
+# Defaults for the adaptive trial ordering (see AdaptiveScheduler)
+default_max_consecutive = 2  # Max trials in a row from the same condition
+default_target_sd = 0.3  # Posterior SD at which a staircase is considered converged
+default_min_trials = 8  # Never stop a staircase before this many trials
+
+# Psychometric defaults used by psychopy's QuestHandler
+quest_beta = 3.5
+quest_delta = 0.01
+quest_gamma = 0.5
+
+# --------------------------- Functions ---------------------------
+
+
+def _binary_entropy(p):
+    """
+    Returns the entropy (in bits) of a Bernoulli variable with probability p.
+    Works element-wise on NumPy arrays.
+    """
+    p = numpy.clip(p, 1e-12, 1 - 1e-12)
+    return -(p * numpy.log2(p) + (1 - p) * numpy.log2(1 - p))
+
+
+def _quest_threshold_offset(p_threshold, beta, delta, gamma):
+    """
+    Returns the Weibull x offset at which Quest's psychometric function equals p_threshold.
+    """
+    inner = (1 - (p_threshold - delta * gamma) / (1 - delta)) / (1 - gamma)
+    return math.log10(-math.log(inner)) / beta
+
+
+def expected_information_gain(quest_handler, intensity=None):
+    """
+    Returns the expected information gain (in bits) about the threshold of a
+    QuestHandler if the next trial is presented at the given intensity.
+    Defaults to the intensity the handler would present next.
+    Returns None if the handler does not expose its Quest posterior.
+    """
+    quest = getattr(quest_handler, '_quest', None)
+    if quest is None:
+        return None
+
+    pdf = numpy.asarray(quest.pdf, dtype=float)
+    pdf = pdf / pdf.sum()
+    thresholds = quest.tGuess + numpy.asarray(quest.x, dtype=float)
+
+    if intensity is None:
+        intensity = getattr(quest_handler, '_nextIntensity', None)
+    if intensity is None:
+        intensity = float(numpy.dot(pdf, thresholds))  # Posterior mean
+
+    beta = getattr(quest, 'beta', quest_beta)
+    delta = getattr(quest, 'delta', quest_delta)
+    gamma = getattr(quest, 'gamma', quest_gamma)
+    x_threshold = _quest_threshold_offset(quest.pThreshold, beta, delta, gamma)
+
+    # Probability of a positive response for every candidate threshold
+    x = numpy.clip(beta * (intensity - thresholds + x_threshold), -20, 20)
+    p_yes = delta * gamma + (1 - delta) * (1 - (1 - gamma) * numpy.exp(-10.0 ** x))
+
+    # Mutual information between the response and the threshold
+    p_yes_marginal = float(numpy.dot(pdf, p_yes))
+    return float(_binary_entropy(p_yes_marginal) - numpy.dot(pdf, _binary_entropy(p_yes)))
+
+
+class AdaptiveScheduler:
+    """
+    Picks the staircase for the next trial by expected information gain from the
+    current Quest posteriors, instead of a fixed shuffled order.
+    A staircase is retired once it has run trials_per_staircase trials, or earlier
+    when its posterior SD falls below target_sd (after at least min_trials trials).
+    At most max_consecutive trials in a row come from the same condition, unless
+    no other condition is left.
+    """
+
+    def __init__(self, quest_dict, trials_per_staircase, max_consecutive=default_max_consecutive,
+                 target_sd=default_target_sd, min_trials=default_min_trials, seed=None):
+        self.quest_dict = quest_dict
+        self.trials_per_staircase = trials_per_staircase
+        self.max_consecutive = max_consecutive
+        self.target_sd = target_sd
+        self.min_trials = min_trials
+        self.rng = random.Random(seed)
+        self.trial_counts = {key: 0 for key in quest_dict}
+        self.stopped_early = {}  # quest_key -> posterior SD at the time it was retired
+        self.last_condition = None
+        self.run_length = 0
+
+    def is_finished(self, quest_key):
+        """
+        Returns True when the staircase should receive no more trials.
+        """
+        count = self.trial_counts[quest_key]
+        if count >= self.trials_per_staircase:
+            return True
+        if self.target_sd is None or count < self.min_trials:
+            return False
+        try:
+            sd = self.quest_dict[quest_key].sd()
+        except Exception as e:
+            print(f"Error retrieving Quest SD for {quest_key}: {e}")
+            return False
+        if sd < self.target_sd:
+            if quest_key not in self.stopped_early:
+                self.stopped_early[quest_key] = sd
+                print(f"Staircase {quest_key} converged after {count} trials (SD = {sd:.3f}).")
+            return True
+        return False
+
+    def score(self, quest_key):
+        """
+        Returns the priority of a staircase: its expected information gain, or its
+        posterior SD if the gain cannot be computed.
+        """
+        quest_handler = self.quest_dict[quest_key]
+        try:
+            gain = expected_information_gain(quest_handler)
+            if gain is not None:
+                return gain
+            return quest_handler.sd()
+        except Exception as e:
+            print(f"Error scoring staircase {quest_key}: {e}")
+            return 0.0
+
+    def next_key(self, condition_of):
+        """
+        Returns the quest key for the next trial, or None once every staircase is finished.
+        condition_of maps a quest key to its condition number.
+        """
+        active = [key for key in self.quest_dict if not self.is_finished(key)]
+        if not active:
+            return None
+
+        # Enforce the maximum run length of a single condition
+        eligible = active
+        if self.max_consecutive and self.run_length >= self.max_consecutive:
+            eligible = [key for key in active if condition_of[key] != self.last_condition] or active
+
+        # Shuffle first so that ties are broken randomly
+        self.rng.shuffle(eligible)
+        quest_key = max(eligible, key=self.score)
+
+        condition = condition_of[quest_key]
+        if condition == self.last_condition:
+            self.run_length += 1
+        else:
+            self.last_condition = condition
+            self.run_length = 1
+        self.trial_counts[quest_key] += 1
+        return quest_key
+
+    def iter_trials(self, trial_templates):
+        """
+        Yields trial dictionaries in adaptive order.
+        trial_templates maps each quest key to the trial dictionary used for that staircase.
+        Responses must be added to the QuestHandlers before the next trial is requested.
+        """
+        condition_of = {key: trial['Condition'] for key, trial in trial_templates.items()}
+        while True:
+            quest_key = self.next_key(condition_of)
+            if quest_key is None:
+                return
+            yield dict(trial_templates[quest_key])
+
+    def total_trials(self):
+        """
+        Returns the number of trials scheduled so far.
+        """
+        return sum(self.trial_counts.values())
@@ -0,0 +1,342 @@
+"""
+Builds one consolidated cohort dataset from many participant session files.
+
+Trial files (participant_<name>_<timestamp>.csv, written by initialize_csv) and
+tap files (<name>_tap_timestamps_force_data.csv, written by send_taps) are
+indexed once; a manifest keyed by file mtime/size keeps a parsed copy of every
+file so that re-runs only read new or changed files. Files are parsed in
+parallel with a process pool and the result is written as a columnar NumPy
+.npz archive with one row per trial and per-tap force features joined on
+(participant, session, trial). A tap belongs to the participant's last session
+that started (by the trial file's timestamp) before the tap's timestamp.
+
+    python aggregate_sessions.py --data-dir data --tap-dir "C:/.../data" --output cohort.npz
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+# --------------------------- Configuration ---------------------------
+
+trial_file_pattern = "participant_*.csv"
+tap_file_pattern = "*_tap_timestamps_force_data.csv"
+trial_file_regex = re.compile(r"participant_(?P<name>.*)_(?P<timestamp>\d{8}-\d{6})\.csv$")
+tap_file_suffix = "_tap_timestamps_force_data.csv"
+
+cache_directory_name = ".cohort_cache"
+manifest_version = 2
+
+# Per-tap features added to every trial row (for both the fixed and the variable tap)
+tap_features = ['timestamp', 'intensity', 'peak', 'mean', 'samples']
+
+# --------------------------- Parsing ---------------------------
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return numpy.nan
+
+
+def _to_int(text, default=0):
+    value = _to_float(text)
+    return default if numpy.isnan(value) else int(value)
+
+
+def _parse_force_list(text):
+    """
+    Parses a force window written by csv.writer (e.g. "[12.0, 15.0]") into an array.
+    """
+    text = (text or '').strip().strip('[]')
+    if not text:
+        return numpy.empty(0)
+    return numpy.array([_to_float(value) for value in text.split(',')])
+
+
+def parse_trial_file(path):
+    """
+    Reads one session's trial CSV into a dictionary of column lists.
+    """
+    match = trial_file_regex.search(os.path.basename(path))
+    session_timestamp = match.group('timestamp') if match else ''
+    columns = {name: [] for name in ['participant', 'session_timestamp', 'condition', 'overall_trial',
+                                     'specific_trial', 'probe_level', 'reference_level', 'response',
+                                     'trial_duration']}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            columns['participant'].append(row.get('SubjectID', ''))
+            columns['session_timestamp'].append(session_timestamp)
+            condition = (row.get('Condition') or '').replace('Condition', '').strip()
+            columns['condition'].append(int(condition) if condition.isdigit() else -1)
+            columns['overall_trial'].append(_to_int(row.get('OverallTrial')))
+            columns['specific_trial'].append(_to_int(row.get('SpecificTrial')))
+            columns['probe_level'].append(_to_float(row.get('ProbeLevel')))
+            columns['reference_level'].append(_to_float(row.get('ReferenceLevel')))
+            columns['response'].append(row.get('Response', ''))
+            columns['trial_duration'].append(_to_float(row.get('TrialDuration')))
+    return columns
+
+
+def parse_tap_file(path):
+    """
+    Reads one participant's tap CSV into a dictionary of column lists with per-tap
+    force features. Handles both the 'Force Data' (full window) and 'MaxForce'
+    layouts. The file is appended to across sessions; consolidate() assigns
+    each tap to its session by its timestamp.
+    """
+    participant = os.path.basename(path)[:-len(tap_file_suffix)]
+    columns = {name: [] for name in ['participant', 'trial', 'tap_type'] + tap_features}
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return columns
+        if 'Tap Type' not in header and 'TapType' not in header:
+            # Early files were written without a header
+            rows = [header] + list(reader)
+            header = ['Trial Number', 'Condition', 'Tap Type', 'Intensity', 'Timestamp', 'Force Data']
+        else:
+            rows = list(reader)
+        index = {name: position for position, name in enumerate(header)}
+
+        for row_number, row in enumerate(rows):
+            if 'Trial Number' in index:
+                trial = _to_int(row[index['Trial Number']])
+            else:
+                trial = row_number // 2 + 1  # Fixed and variable rows come in pairs
+
+            if 'Force Data' in index:
+                forces = _parse_force_list(row[index['Force Data']])
+            else:
+                forces = numpy.array([_to_float(row[index['MaxForce']])])
+            valid = forces[~numpy.isnan(forces)]
+
+            columns['participant'].append(participant)
+            columns['trial'].append(trial)
+            columns['tap_type'].append(row[index.get('Tap Type', index.get('TapType'))])
+            columns['timestamp'].append(_to_float(row[index['Timestamp']]))
+            columns['intensity'].append(_to_float(row[index['Intensity']]))
+            columns['peak'].append(float(valid.max()) if valid.size else numpy.nan)
+            columns['mean'].append(float(valid.mean()) if valid.size else numpy.nan)
+            columns['samples'].append(int(valid.size))
+    return columns
+
+
+def parse_session_file(job):
+    """
+    Worker entry point: parses one file and stores it in the cache.
+    job is a (kind, path, cache_path) tuple. Returns (path, cache_path, error).
+    """
+    kind, path, cache_path = job
+    try:
+        columns = parse_trial_file(path) if kind == 'trials' else parse_tap_file(path)
+        numpy.savez(cache_path, **{name: numpy.asarray(values) for name, values in columns.items()})
+        return path, cache_path, None
+    except Exception as e:
+        return path, cache_path, str(e)
+
+
+# --------------------------- Manifest ---------------------------
+
+
+def load_manifest(cache_directory):
+    """
+    Loads the cache manifest, or returns an empty one.
+    """
+    manifest_path = os.path.join(cache_directory, 'manifest.json')
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') == manifest_version:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'version': manifest_version, 'files': {}}
+
+
+def save_manifest(cache_directory, manifest):
+    """
+    Writes the manifest atomically.
+    """
+    manifest_path = os.path.join(cache_directory, 'manifest.json')
+    temporary_path = manifest_path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temporary_path, manifest_path)
+
+
+def index_sessions(data_dirs, tap_dirs):
+    """
+    Returns a sorted list of (kind, path) for every session file found.
+    """
+    found = set()
+    for directory in data_dirs:
+        for path in glob.glob(os.path.join(directory, trial_file_pattern)):
+            found.add(('trials', os.path.abspath(path)))
+    for directory in tap_dirs:
+        for path in glob.glob(os.path.join(directory, tap_file_pattern)):
+            found.add(('taps', os.path.abspath(path)))
+    return sorted(found)
+
+
+def update_cache(files, cache_directory, workers=None, prune=True):
+    """
+    Parses new or changed files in parallel and, with prune, drops cache entries of
+    files not listed. workers=1 parses in the calling process.
+    Returns the up-to-date manifest.
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+    manifest = load_manifest(cache_directory)
+    known = manifest['files']
+
+    jobs = []
+    current = set()
+    for kind, path in files:
+        current.add(path)
+        stat = os.stat(path)
+        entry = known.get(path)
+        if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size \
+                and os.path.isfile(entry['cache']):
+            continue
+        cache_name = f"{kind}_{hashlib.sha1(path.encode()).hexdigest()[:16]}.npz"
+        cache_path = os.path.join(cache_directory, cache_name)
+        known[path] = {'kind': kind, 'mtime': stat.st_mtime, 'size': stat.st_size, 'cache': cache_path}
+        jobs.append((kind, path, cache_path))
+
+    for path in list(known) if prune else ():
+        if path not in current:
+            try:
+                os.remove(known[path]['cache'])
+            except OSError:
+                pass
+            del known[path]
+
+    print(f"Indexed {len(files)} files, {len(jobs)} new or changed.")
+    if jobs:
+        if workers == 1:
+            results = [parse_session_file(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(parse_session_file, jobs, chunksize=8))
+        for path, cache_path, error in results:
+            if error:
+                print(f"Failed to parse {path}: {error}")
+                del known[path]
+
+    save_manifest(cache_directory, manifest)
+    return manifest
+
+
+# --------------------------- Consolidation ---------------------------
+
+
+def _session_start(session_timestamp):
+    """
+    Returns the epoch time of a trial file's local YYYYmmdd-HHMMSS timestamp (-inf if it has none).
+    """
+    try:
+        return time.mktime(time.strptime(session_timestamp, "%Y%m%d-%H%M%S"))
+    except ValueError:
+        return -numpy.inf
+
+
+def _concatenate(cache_paths):
+    """
+    Concatenates cached column archives into one dictionary of arrays.
+    """
+    parts = []
+    for cache_path in cache_paths:
+        with numpy.load(cache_path, allow_pickle=False) as archive:
+            part = {name: archive[name] for name in archive.files}
+        if part and next(iter(part.values())).size:
+            parts.append(part)
+    if not parts:
+        return {}
+    return {name: numpy.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def consolidate(manifest):
+    """
+    Joins every trial with its fixed and variable tap features.
+    Returns a dictionary of equal-length column arrays.
+    """
+    entries = sorted(manifest['files'].items())
+    trials = _concatenate([entry['cache'] for path, entry in entries if entry['kind'] == 'trials'])
+    taps = _concatenate([entry['cache'] for path, entry in entries if entry['kind'] == 'taps'])
+    if not trials:
+        return {}
+
+    # Number the sessions of each participant in chronological order
+    participants = trials['participant'].astype(str)
+    session_keys = numpy.char.add(numpy.char.add(participants, '|'), trials['session_timestamp'].astype(str))
+    session_index = numpy.zeros(participants.size, dtype=int)
+    session_starts = {}  # Participant -> start times of their sessions, in session_index order
+    for participant in numpy.unique(participants):
+        mask = participants == participant
+        unique_sessions, inverse = numpy.unique(session_keys[mask], return_inverse=True)
+        session_index[mask] = inverse
+        session_starts[participant] = numpy.array([_session_start(key.split('|')[-1]) for key in unique_sessions])
+    trials['session_index'] = session_index
+
+    row_count = participants.size
+    for tap_type in ('Fixed', 'Variable'):
+        for feature in tap_features:
+            trials[f"{tap_type.lower()}_{feature}"] = numpy.full(row_count, numpy.nan)
+
+    if taps:
+        lookup = {(participant, int(session), int(trial)): row for row, (participant, session, trial)
+                  in enumerate(zip(participants, session_index, trials['overall_trial']))}
+        for tap_row in range(taps['trial'].size):
+            participant = str(taps['participant'][tap_row])
+            starts = session_starts.get(participant)
+            if starts is None or numpy.isnan(taps['timestamp'][tap_row]):
+                continue
+            session = int(numpy.searchsorted(starts, taps['timestamp'][tap_row], side='right')) - 1
+            row = lookup.get((participant, session, int(taps['trial'][tap_row])))
+            tap_type = str(taps['tap_type'][tap_row]).lower()
+            if row is None or tap_type not in ('fixed', 'variable'):
+                continue
+            for feature in tap_features:
+                trials[f"{tap_type}_{feature}"][row] = taps[feature][tap_row]
+    return trials
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate participant session files into one dataset.")
+    parser.add_argument('--data-dir', action='append', default=[],
+                        help="Directory with participant_*.csv trial files (repeatable)")
+    parser.add_argument('--tap-dir', action='append', default=[],
+                        help="Directory with *_tap_timestamps_force_data.csv files (repeatable)")
+    parser.add_argument('--output', default='cohort.npz', help="Output .npz file")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    data_dirs = args.data_dir or [os.path.join(os.getcwd(), "data")]
+    tap_dirs = args.tap_dir or data_dirs
+    cache_directory = os.path.join(os.path.dirname(os.path.abspath(args.output)), cache_directory_name)
+
+    manifest = update_cache(index_sessions(data_dirs, tap_dirs), cache_directory, workers=args.workers)
+    dataset = consolidate(manifest)
+    if not dataset:
+        print("No trial files found.")
+        return 1
+
+    numpy.savez_compressed(args.output, **dataset)
+    print(f"Wrote {dataset['participant'].size} trials from "
+          f"{numpy.unique(dataset['participant']).size} participants to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
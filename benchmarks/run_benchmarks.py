@@ -0,0 +1,367 @@
+"""
+Session-level performance benchmarks for the experiment's hot paths.
+
+Runs against the simulated Arduino (simulated_serial.py), stores the results as
+JSON and compares them against a saved baseline:
+
+    python benchmarks/run_benchmarks.py                   # run and compare
+    python benchmarks/run_benchmarks.py --save-baseline   # record a new baseline
+
+Exits with status 1 if any metric is worse than the baseline by more than the
+tolerance. Benchmarks that need the force_experiment package (pygame, psychopy)
+are skipped when it cannot be imported.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+
+from experiment_config import load_config  # noqa: E402
+from force_stream import ChannelLayout, StreamDecoder, decode_samples, parse_stream_line  # noqa: E402
+from simulated_serial import SimulatedSerial  # noqa: E402
+
+# --------------------------- Configuration ---------------------------
+
+default_baseline = os.path.join(repo_root, 'benchmarks', 'baseline.json')
+default_output = os.path.join(repo_root, 'benchmarks', 'results.json')
+default_tolerance = 0.2  # Allowed relative regression before failing
+
+parse_line_count = 200000  # Lines per parsing benchmark
+read_chunk_bytes = 4096  # Bytes per read() for the bulk decoder
+window_duration = 0.5  # Seconds per acquisition window
+trial_conditions = [1, 2, 3, 4, 5, 6, 7]  # Condition 8 waits for the participant
+
+# --------------------------- Helpers ---------------------------
+
+
+def metric(value, unit, higher_is_better):
+    """
+    Returns one benchmark result entry.
+    """
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def generate_lines(count, line_format):
+    """
+    Returns count encoded lines as the simulated Arduino would send them.
+    """
+    device = SimulatedSerial(realtime=False, line_format=line_format, seed=0)
+    return [device.readline() for _ in range(count)]
+
+
+def import_experiment():
+    """
+    Imports the force_experiment package headless. Returns it, or None if it cannot be imported.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    try:
+        import force_experiment
+        import force_experiment.session  # The package itself imports its modules on first use
+        return force_experiment
+    except Exception as e:
+        print(f"Skipping experiment benchmarks: cannot import force_experiment ({e})")
+        return None
+
+
+def make_session(experiment, directory, device=None, tap_strategy='trace'):
+    """
+    Returns a session that writes its files to directory and talks to a simulated device.
+    """
+    config = load_config().replace('paths', data_directory=directory, tap_directory=directory)
+    config = config.replace('run', tap_strategy=tap_strategy)
+    session = experiment.ExperimentSession(config, 'bench')
+    if device is not None:
+        session.attach_serial(device)
+    return session
+
+
+@contextlib.contextmanager
+def skipped_sleeps():
+    """
+    Replaces time.sleep with a recorder so that only processing time is measured.
+    Yields a list that collects the requested sleep durations.
+    """
+    requested = []
+    real_sleep = time.sleep
+    time.sleep = lambda seconds: requested.append(seconds) or real_sleep(0)
+    try:
+        yield requested
+    finally:
+        time.sleep = real_sleep
+
+
+# --------------------------- Benchmarks ---------------------------
+
+
+def bench_parsing():
+    """
+    Force-line parsing throughput: the legacy per-line regex path from
+    read_highest_force_data versus parse_stream_line.
+    """
+    results = {}
+    for line_format in ('legacy', 'sequenced'):
+        lines = generate_lines(parse_line_count, line_format)
+
+        start = time.perf_counter()
+        values = []
+        for raw in lines:
+            force_data = raw.decode('utf-8').strip()
+            force_value_str = re.findall(r"[-+]?\d*\.\d+|\d+", force_data)
+            if force_value_str:
+                values.append(float(force_value_str[0]))
+        elapsed = time.perf_counter() - start
+        results[f'parse_regex_{line_format}'] = metric(len(lines) / elapsed, 'lines/s', True)
+
+        start = time.perf_counter()
+        values = []
+        for raw in lines:
+            kind, value = parse_stream_line(raw.decode('utf-8').strip())
+            if kind == 'sample':
+                values.append(value[1])
+            elif kind == 'force':
+                values.append(value)
+        elapsed = time.perf_counter() - start
+        results[f'parse_stream_line_{line_format}'] = metric(len(lines) / elapsed, 'lines/s', True)
+    return results
+
+
+def bench_bulk_decoding():
+    """
+    Throughput of StreamDecoder on every line format, fed in read-sized chunks,
+    against the per-line regex path from read_highest_force_data.
+    """
+    results = {}
+    for line_format in ('sequenced', 'legacy', 'bare'):
+        lines = generate_lines(parse_line_count, line_format)
+        data = b''.join(lines)
+
+        start = time.perf_counter()
+        values = []
+        for raw in lines:
+            force_value_str = re.findall(r"[-+]?\d*\.\d+|\d+", raw.decode('utf-8').strip())
+            if force_value_str:
+                values.append(float(force_value_str[0]))
+        regex_elapsed = time.perf_counter() - start
+
+        decoder = StreamDecoder()
+        start = time.perf_counter()
+        decoded = [decoder.feed(data[offset:offset + read_chunk_bytes])
+                   for offset in range(0, len(data), read_chunk_bytes)]
+        decoded.append(decoder.flush())
+        elapsed = time.perf_counter() - start
+        count = sum(len(forces) + len(samples.get('force', ((), ()))[1]) for samples, forces, lines in decoded)
+        if count != len(values) or decoder.malformed:
+            raise RuntimeError(f"Bulk decoder disagrees with the regex path on the {line_format} format")
+        results[f'parse_bulk_{line_format}'] = metric(len(lines) / elapsed, 'lines/s', True)
+        results[f'parse_bulk_speedup_{line_format}'] = metric(regex_elapsed / elapsed, 'x', True)
+    return results
+
+
+def bench_channel_decoding():
+    """
+    Demultiplexing throughput of three interleaved sensor channels with decode_samples.
+    """
+    layout = ChannelLayout(('force', 'hand_force', 'carriage_accel'))
+    device = SimulatedSerial(realtime=False, seed=0)
+    device.write(f"CHANNELS {layout.mask}\n".encode())
+    lines = [device.readline().decode('utf-8').strip() for _ in range(parse_line_count)]
+    lines = [line for line in lines if line.startswith('F,')]
+
+    start = time.perf_counter()
+    decoded, malformed = decode_samples(lines, layout)
+    elapsed = time.perf_counter() - start
+    return {'decode_channels': metric(len(lines) / elapsed, 'lines/s', True)}
+
+
+def bench_window_retention(experiment, directory):
+    """
+    Samples per second retained by read_force_window and read_highest_force
+    from a real-time 1 kHz stream.
+    """
+    results = {}
+    device = SimulatedSerial(realtime=True, seed=0)
+    session = make_session(experiment, directory, device)
+    device.reset_input_buffer()
+    window = session.read_force_window(window_duration)
+    results['window_samples_per_s'] = metric(len(window or []) / window_duration, 'samples/s', True)
+    if window is not None:
+        window.release()
+
+    device = SimulatedSerial(realtime=True, seed=0)
+    session = make_session(experiment, directory, device)
+    device.reset_input_buffer()
+    lines_before = device.lines_read
+    session.read_highest_force(duration=window_duration)
+    results['highest_samples_per_s'] = metric((device.lines_read - lines_before) / window_duration,
+                                              'samples/s', True)
+    return results
+
+
+def bench_trial_overhead(experiment, directory):
+    """
+    Per-trial processing overhead of control_motors (including the taps) with
+    the protocol's sleeps skipped. Taps are not measured, so that the real-time
+    force windows do not count as overhead.
+    """
+    session = make_session(experiment, directory, SimulatedSerial(realtime=True, seed=0), tap_strategy='none')
+    durations = []
+    with skipped_sleeps() as requested:
+        for condition in trial_conditions:
+            start = time.perf_counter()
+            session.control_motors(1.5, 1, 4, condition)
+            durations.append(time.perf_counter() - start)
+
+    return {
+        'trial_overhead_ms': metric(1000 * sum(durations) / len(durations), 'ms', False),
+        'trial_nominal_sleep_ms': metric(1000 * sum(requested) / len(durations), 'ms', False),
+    }
+
+
+def bench_csv_write(experiment, directory):
+    """
+    Cost of writing one trial: the trial row with flush, plus the tap rows.
+    """
+    previous_cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        csv_file, csv_writer = experiment.initialize_csv('bench', make_session(experiment, directory).config.paths)
+        trial_count = 320
+        start = time.perf_counter()
+        for trial in range(1, trial_count + 1):
+            csv_writer.writerow({'SubjectID': 'bench', 'Condition': 'Condition 1', 'OverallTrial': trial,
+                                 'SpecificTrial': trial, 'ProbeLevel': 4, 'ReferenceLevel': 4.25,
+                                 'Response': 'Second', 'TrialDuration': 5.123})
+            csv_file.flush()
+        trial_row_ms = 1000 * (time.perf_counter() - start) / trial_count
+        csv_file.close()
+
+        tap_csv = os.path.join(directory, 'bench_taps.csv')
+        window = [float(value) for value in range(int(window_duration * 1000))]
+        start = time.perf_counter()
+        for trial in range(1, trial_count + 1):
+            experiment.write_tap_rows(tap_csv, [[trial, 1, 'Fixed', 4, time.time(), window],
+                                                [trial, 1, 'Variable', 4, time.time(), window]])
+        tap_rows_ms = 1000 * (time.perf_counter() - start) / trial_count
+    finally:
+        os.chdir(previous_cwd)
+
+    return {
+        'csv_trial_row_ms': metric(trial_row_ms, 'ms', False),
+        'csv_tap_rows_ms': metric(tap_rows_ms, 'ms', False),
+    }
+
+
+def bench_startup():
+    """
+    Wall time to import the experiment session in a fresh interpreter (headless).
+    """
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', PYGAME_HIDE_SUPPORT_PROMPT='1')
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', 'import force_experiment.session'], cwd=repo_root, env=env,
+                               capture_output=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        print("Skipping startup benchmark: force_experiment failed to import.")
+        return {}
+    return {'startup_s': metric(elapsed, 's', False)}
+
+
+# --------------------------- Baseline comparison ---------------------------
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results against a baseline.
+    Returns a list of (name, baseline value, current value, relative change) regressions.
+    """
+    regressions = []
+    for name, entry in results.items():
+        reference = baseline.get('results', {}).get(name)
+        if not reference or not reference['value']:
+            continue
+        change = (entry['value'] - reference['value']) / reference['value']
+        worse = -change if entry['higher_is_better'] else change
+        status = "REGRESSION" if worse > tolerance else "ok"
+        print(f"  {name:32s} {reference['value']:14.3f} -> {entry['value']:14.3f} {entry['unit']:10s} "
+              f"({change:+.1%}) {status}")
+        if worse > tolerance:
+            regressions.append((name, reference['value'], entry['value'], change))
+    return regressions
+
+
+def run_all():
+    """
+    Runs every benchmark and returns the results dictionary.
+    """
+    results = {}
+    results.update(bench_parsing())
+    results.update(bench_bulk_decoding())
+    results.update(bench_channel_decoding())
+
+    experiment = import_experiment()
+    if experiment is not None:
+        with tempfile.TemporaryDirectory() as directory:
+            results.update(bench_window_retention(experiment, directory))
+            results.update(bench_trial_overhead(experiment, directory))
+            results.update(bench_csv_write(experiment, directory))
+        results.update(bench_startup())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the performance benchmarks.")
+    parser.add_argument('--output', default=default_output, help="Where to write the results JSON")
+    parser.add_argument('--baseline', default=default_baseline, help="Baseline JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=default_tolerance,
+                        help="Allowed relative regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': run_all(),
+    }
+
+    for name, entry in report['results'].items():
+        print(f"{name:32s} {entry['value']:14.3f} {entry['unit']}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print("No baseline found; run with --save-baseline to create one.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print(f"Comparison against {args.baseline}:")
+    regressions = compare(report['results'], baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}.")
+        return 1
+    print("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+Soak test: many sessions back to back against the simulated Arduino.
+
+Drives the full trial loop (ExperimentSession.run) with the simulated device
+(simulated_serial.py) and a simulated participant who answers through the
+Pygame event queue. Sleeps and wall-clock reads run on a virtual clock: a
+sleep, including the simulated port's wait for its next block of samples,
+moves the clock to its deadline in one step. Every force sample is still
+generated, read and parsed, and a session of 16 trials (about 75 s of session
+time) takes under two seconds, so the run below covers close to three hours
+of sessions in about two minutes. After every session it samples the
+resident memory, the open file descriptors and the per-trial processing
+latency (real time, excluding the protocol's sleeps):
+
+    python benchmarks/soak.py --sessions 8 --trials-per-set 20
+
+The first session is a warm-up. Exits with status 1 if memory, descriptors or
+the trial latency percentiles grew beyond the thresholds after it. With
+--trace-allocations it also lists the allocation sites that grew most
+(tracemalloc slows every allocation, so the latencies are then mostly its
+own overhead).
+"""
+import argparse
+import contextlib
+import gc
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from experiment_config import load_config  # noqa: E402
+from simulated_serial import SimulatedSerial  # noqa: E402
+
+# --------------------------- Configuration ---------------------------
+
+default_rss_growth_mb = 20.0  # Allowed resident memory growth after the warm-up session
+default_fd_growth = 0  # Allowed growth in open file descriptors
+default_latency_drift = 1.5  # Allowed ratio of the last to the first p95 trial latency
+tracemalloc_frames = 5
+top_allocations = 10
+
+# --------------------------- Helpers ---------------------------
+
+
+class VirtualClock:
+    """
+    Replaces time.time and time.sleep: sleeping advances the clock to the
+    sleeper's deadline in one step. The simulated device runs in real-time
+    mode on the same clock, so it produces exactly the samples a real session
+    of that length would.
+    """
+
+    def __init__(self):
+        self.now = time.time()
+        self.lock = threading.Lock()
+        self.slept = 0.0
+
+    def time(self):
+        with self.lock:
+            return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += max(0.0, seconds)
+            self.slept += max(0.0, seconds)
+
+    @contextlib.contextmanager
+    def installed(self):
+        real_time, real_sleep = time.time, time.sleep
+        time.time, time.sleep = self.time, self.sleep
+        try:
+            yield self
+        finally:
+            time.time, time.sleep = real_time, real_sleep
+
+
+@contextlib.contextmanager
+def simulated_participant(session_module, seed=0):
+    """
+    Answers every response prompt by posting the key press to the Pygame queue
+    before the real response function reads it.
+    """
+    import pygame
+
+    rng = random.Random(seed)
+    get_foot_response, wait_for_up_arrow = session_module.get_foot_response, session_module.wait_for_up_arrow
+
+    def answer_foot():
+        key = pygame.K_RIGHT if rng.random() < 0.5 else pygame.K_LEFT
+        pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=key))
+        return get_foot_response()
+
+    def answer_up(session):
+        pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_UP))
+        return wait_for_up_arrow(session)
+
+    session_module.get_foot_response, session_module.wait_for_up_arrow = answer_foot, answer_up
+    try:
+        yield
+    finally:
+        session_module.get_foot_response, session_module.wait_for_up_arrow = get_foot_response, wait_for_up_arrow
+
+
+def resident_memory_mb():
+    """
+    Returns the resident set size in MB (peak RSS where the current one is not available).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def open_descriptors():
+    """
+    Returns the number of open file descriptors, or None where it cannot be counted.
+    """
+    for directory in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(directory):
+            return len(os.listdir(directory))
+    return None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))] if ordered else 0.0
+
+
+def run_session(experiment, config, index, seed):
+    """
+    Runs one complete session and returns the real processing time of each trial in seconds.
+    """
+    latencies = []
+    session = experiment.ExperimentSession(config, f"soak{index:02d}")
+    run_trial = session.run_trial
+
+    def timed_run_trial(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return run_trial(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    session.run_trial = timed_run_trial
+    session.attach_serial(SimulatedSerial(realtime=True, seed=seed))
+    if config.capture.enabled:
+        session.start_capture()
+    try:
+        session.open_csv()
+        session.open_store()
+        session.run()
+    finally:
+        session.close()
+    return latencies
+
+
+def sample(session_index, latencies, clock):
+    return {'session': session_index, 'rss_mb': resident_memory_mb(), 'fds': open_descriptors(),
+            'p50_ms': 1000 * percentile(latencies, 0.5), 'p95_ms': 1000 * percentile(latencies, 0.95),
+            'p99_ms': 1000 * percentile(latencies, 0.99), 'trials': len(latencies),
+            'virtual_hours': clock.slept / 3600}
+
+
+# --------------------------- Soak run ---------------------------
+
+
+def soak(sessions, trials_per_set, rss_growth_mb, fd_growth, latency_drift, quiet=True, trace_allocations=False):
+    """
+    Runs the sessions and checks the samples against the thresholds.
+    Returns (samples, failures).
+    """
+    from force_experiment import session as session_module
+    from force_experiment.responses import close_display, initialize_display
+    import force_experiment as experiment
+
+    directory = tempfile.mkdtemp(prefix='soak_')
+    config = load_config().replace('paths', data_directory=directory, tap_directory=directory)
+    config = config.replace('protocol', trials_per_set=trials_per_set)
+    config = config.replace('capture', directory=os.path.join(directory, 'captures'), compact=False)
+    config = config.replace('monitor', enabled=False).replace('realtime', enabled=False)
+    config = config.replace('report', enabled=False)
+
+    if trace_allocations:
+        tracemalloc.start(tracemalloc_frames)
+    initialize_display()
+    samples = []
+    baseline_snapshot = None
+    clock = VirtualClock()
+    try:
+        with clock.installed(), simulated_participant(session_module):
+            for index in range(sessions):
+                output = io.StringIO() if quiet else sys.stdout
+                with contextlib.redirect_stdout(output):
+                    latencies = run_session(experiment, config, index, seed=index)
+                gc.collect()  # Finished sessions are not growth
+                entry = sample(index, latencies, clock)
+                samples.append(entry)
+                print(f"Session {index + 1}/{sessions}: {entry['trials']} trials, RSS {entry['rss_mb']:.1f} MB, "
+                      f"{entry['fds']} fds, trial latency p50 {entry['p50_ms']:.1f} ms, p95 {entry['p95_ms']:.1f} ms, "
+                      f"p99 {entry['p99_ms']:.1f} ms ({entry['virtual_hours']:.2f} h of session time so far)")
+                if index == 0 and trace_allocations:
+                    baseline_snapshot = tracemalloc.take_snapshot()
+    finally:
+        close_display()
+
+    failures = []
+    if len(samples) > 1:
+        first, last = samples[1] if len(samples) > 2 else samples[0], samples[-1]
+        if last['rss_mb'] - first['rss_mb'] > rss_growth_mb:
+            failures.append(f"RSS grew by {last['rss_mb'] - first['rss_mb']:.1f} MB (limit {rss_growth_mb} MB)")
+        if first['fds'] is not None and last['fds'] - first['fds'] > fd_growth:
+            failures.append(f"Open file descriptors grew from {first['fds']} to {last['fds']}")
+        if first['p95_ms'] and last['p95_ms'] / first['p95_ms'] > latency_drift:
+            failures.append(f"p95 trial latency drifted from {first['p95_ms']:.1f} ms to {last['p95_ms']:.1f} ms "
+                            f"(limit {latency_drift}x)")
+
+    if baseline_snapshot is not None:
+        print(f"\nTop {top_allocations} allocation sites by growth since the warm-up session:")
+        for stat in tracemalloc.take_snapshot().compare_to(baseline_snapshot, 'lineno')[:top_allocations]:
+            print(f"  {stat}")
+    tracemalloc.stop()
+    return samples, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak-test the trial loop against the simulated Arduino.")
+    parser.add_argument('--sessions', type=int, default=8, help="Sessions run back to back (the first is a warm-up)")
+    parser.add_argument('--trials-per-set', type=int, default=20, help="Override [protocol] trials_per_set")
+    parser.add_argument('--max-rss-growth', type=float, default=default_rss_growth_mb, help="MB")
+    parser.add_argument('--max-fd-growth', type=int, default=default_fd_growth)
+    parser.add_argument('--max-latency-drift', type=float, default=default_latency_drift,
+                        help="Allowed ratio of the last to the first p95 trial latency")
+    parser.add_argument('--verbose', action='store_true', help="Show the sessions' own output")
+    parser.add_argument('--trace-allocations', action='store_true',
+                        help="List the allocation sites that grew most (slows the trials down)")
+    args = parser.parse_args()
+
+    samples, failures = soak(args.sessions, args.trials_per_set, args.max_rss_growth, args.max_fd_growth,
+                             args.max_latency_drift, quiet=not args.verbose, trace_allocations=args.trace_allocations)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print(f"\nNo growth or drift beyond the thresholds over {len(samples)} sessions.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import time
+
+from force_stream import StreamDecoder, parse_stream_line
+
+# --------------------------- Configuration ---------------------------
+
+# Must match the firmware (sketch_forcesensor.ino)
+iteration_step = 0.00247551686615886833514689880305  # cm per step
+servo_neutral_position = 30  # Neutral servo angle in degrees
+servo_degrees_per_level = 10  # Servo degrees per intensity level
+queue_size = 24  # Max entries in one uploaded timeline
+
+# Stepper directions as used by the firmware
+direction_out = 0  # LOW: away from the resting position
+direction_back = 1  # HIGH: back to the resting position
+
+# Default trial timing (seconds), matching ExperimentSession.control_motors()
+tap_hold = 0.2  # Servo hold time per tap (moveServo's delay(200))
+pre_tap_delay = 0.5  # Pause between the end of the move and the first tap
+inter_tap_delay = 1.0  # Pause between the two taps
+pre_return_delay = 1.0  # Pause between the second tap and the return move
+
+# --------------------------- Functions ---------------------------
+
+
+class TrialTimeline:
+    """
+    A trial's stimulus sequence (moves, waits and taps) that is uploaded to the
+    Arduino as one batch and executed on-device with microsecond timing.
+    Each entry records a label so that completion timestamps can be matched up.
+    """
+
+    def __init__(self):
+        self.entries = []  # (op, args) tuples in firmware order
+        self.labels = []  # One label per entry
+        self.profiles = {}  # Slot -> MotionProfile used by 'P' entries
+
+    def move(self, distance, speed, direction, label='move', profile=None):
+        """
+        Appends a stepper move of distance (cm) at speed (cm/s).
+        With a MotionProfile (see motion_profile.py) the move accelerates and
+        decelerates along the profile uploaded to the Arduino.
+        """
+        steps = int(distance / iteration_step)
+        if profile is not None:
+            self.entries.append(('P', (steps, direction, profile.slot)))
+            self.profiles[profile.slot] = profile
+        else:
+            # moveStepper holds STEP high and low for iteration_step / speed each
+            step_period_us = 2 * int(iteration_step / speed * 1000000)
+            self.entries.append(('M', (steps, direction, step_period_us)))
+        self.labels.append(label)
+        return self
+
+    def wait(self, seconds, label='wait'):
+        """
+        Appends a pause of the given duration in seconds.
+        """
+        self.entries.append(('W', (int(round(seconds * 1000000)),)))
+        self.labels.append(label)
+        return self
+
+    def tap(self, intensity, hold=tap_hold, label='tap', table=None):
+        """
+        Appends a servo tap: move to the intensity angle, hold, and return to neutral.
+        With an IntensityTable (see servo_intensity.py) the servo moves to the
+        table's pulse width instead, which resolves fractional intensities.
+        The tap's onset is the entry labelled with label.
+        """
+        if table is not None:
+            self.entries.append(('U', (table.pulse_width(intensity),)))
+        else:
+            angle = servo_neutral_position + int(round(intensity * servo_degrees_per_level))
+            self.entries.append(('S', (angle,)))
+        self.labels.append(label)
+        self.wait(hold, label=f"{label}_hold")
+        self.entries.append(('N', ()))
+        self.labels.append(f"{label}_release")
+        return self
+
+    def encode(self):
+        """
+        Returns the QLOAD command line for this timeline.
+        """
+        if len(self.entries) > queue_size:
+            raise ValueError(f"Timeline has {len(self.entries)} entries; the firmware queue holds {queue_size}.")
+        fields = [",".join([op] + [str(arg) for arg in args]) for op, args in self.entries]
+        return f"QLOAD {';'.join(fields)}\n"
+
+
+def _profile(planner, speed):
+    return planner.profile_for(speed) if planner is not None and planner.has_profile(speed) else None
+
+
+def build_trial_timeline(condition, distance, speed, fixed_intensity=4, variable_intensity=4, planner=None,
+                         intensity_table=None):
+    """
+    Builds the timeline of one trial for conditions 1 to 8.
+    For Condition 8 only the outward move and the taps are included; the return
+    waits for the participant and is built with build_return_timeline().
+    Moves use the planner's uploaded motion profiles where available, and taps
+    the pulse widths of intensity_table if given.
+    """
+    timeline = TrialTimeline()
+    if condition in range(1, 7):
+        timeline.move(distance, speed, direction_out, label='move_out', profile=_profile(planner, speed))
+        timeline.wait(pre_tap_delay)
+    elif condition == 8:
+        timeline.move(3, 1, direction_out, label='move_out', profile=_profile(planner, 1))
+        timeline.wait(pre_tap_delay)
+
+    timeline.tap(fixed_intensity, label='tap_fixed', table=intensity_table)
+    timeline.wait(inter_tap_delay)
+    timeline.tap(variable_intensity, label='tap_variable', table=intensity_table)
+
+    if condition in range(1, 7):
+        timeline.wait(pre_return_delay)
+        timeline.move(distance, speed, direction_back, label='move_return', profile=_profile(planner, speed))
+    return timeline
+
+
+def build_return_timeline(distance=3, speed=2, planner=None):
+    """
+    Builds the timeline that moves the hand back to the wall (Condition 8).
+    """
+    return TrialTimeline().move(distance, speed, direction_back, label='move_return',
+                                profile=_profile(planner, speed))
+
+
+def _read_lines(ser, decoder, on_samples):
+    """
+    Reads one line from the port through decoder (a StreamDecoder) and returns its
+    text lines; force samples go to on_samples(samples, forces) if given.
+    """
+    samples, forces, lines = decoder.feed(ser.readline())
+    if on_samples is not None and (samples or len(forces)):
+        on_samples(samples, forces)
+    return lines
+
+
+def upload_timeline(ser, timeline, timeout=1.0, decoder=None, on_samples=None):
+    """
+    Sends a timeline to the Arduino and waits for the QACK acknowledgement.
+    Returns True if the firmware accepted every entry.
+    """
+    decoder = decoder if decoder is not None else StreamDecoder()
+    ser.write(timeline.encode().encode())
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        for line in _read_lines(ser, decoder, on_samples):
+            if not line.startswith("QACK"):
+                continue
+            try:
+                loaded = int(line.split()[1])
+            except (IndexError, ValueError):
+                loaded = -1
+            if loaded != len(timeline.entries):
+                print(f"Arduino rejected timeline (loaded {loaded} of {len(timeline.entries)} entries).")
+                return False
+            return True
+    print("No acknowledgement received for timeline upload.")
+    return False
+
+
+def run_timeline(ser, timeline, timeout=None, decoder=None, on_samples=None):
+    """
+    Starts the uploaded timeline and collects the per-entry completion timestamps.
+    Returns a dictionary mapping each entry label to its host time (seconds since
+    the epoch, reconstructed from the firmware's microsecond clock), or None on timeout.
+    Force samples streamed meanwhile are decoded by decoder (a StreamDecoder) and passed
+    to on_samples(samples, forces). Motion state tags are returned in the 'states' entry as
+    (host time, name, value, micros) tuples; other lines, including garbled queue reports,
+    are returned in the 'other_lines' entry.
+    """
+    if timeout is None:
+        timeout = timeline_duration(timeline) + 2.0
+    decoder = decoder if decoder is not None else StreamDecoder()
+
+    ser.write(b'QRUN\n')
+    run_start = time.time()
+    events = {'states': [], 'other_lines': []}
+    while time.time() - run_start < timeout:
+        for line in _read_lines(ser, decoder, on_samples):
+            parts = line.split()
+            if parts[0] == "QDONE" and len(parts) == 3:
+                try:
+                    index, elapsed_us = int(parts[1]), int(parts[2])
+                except ValueError:
+                    index = -1
+                if 0 <= index < len(timeline.labels):
+                    events[timeline.labels[index]] = run_start + elapsed_us / 1000000
+                else:
+                    events['other_lines'].append(line)  # Corrupted on the line
+            elif parts[0] == "QEND":
+                return events
+            else:
+                kind, value = parse_stream_line(line)
+                if kind == 'state':
+                    events['states'].append((time.time(),) + value)
+                else:
+                    events['other_lines'].append(line)
+    print("Timed out waiting for the timeline to finish.")
+    return None
+
+
+def timeline_duration(timeline):
+    """
+    Returns the nominal duration of a timeline in seconds.
+    """
+    total_us = 0
+    for op, args in timeline.entries:
+        if op == 'M':
+            total_us += args[0] * args[2]
+        elif op == 'P':
+            total_us += timeline.profiles[args[2]].duration(args[0]) * 1000000
+        elif op == 'W':
+            total_us += args[0]
+    return total_us / 1000000
+
+
+def execute_timeline(ser, timeline, decoder=None, on_samples=None):
+    """
+    Uploads and runs a timeline in one call, decoding the force stream with decoder.
+    Returns the event timestamps from run_timeline(), or None on failure.
+    """
+    decoder = decoder if decoder is not None else StreamDecoder()
+    if not upload_timeline(ser, timeline, decoder=decoder, on_samples=on_samples):
+        return None
+    return run_timeline(ser, timeline, decoder=decoder, on_samples=on_samples)
@@ -0,0 +1,329 @@
+"""
+Experiment definition loaded from a TOML (or YAML) file.
+
+The file is read once, validated against the schemas below and compiled into
+immutable parameter objects with __slots__, which are passed to the functions
+that need them:
+
+    config = load_config()           # $EXPERIMENT_CONFIG or experiment.toml next to this file
+    config.serial.port, config.protocol.speeds, config.quest.start_val, ...
+
+Missing sections or keys take the defaults below; unknown keys and invalid
+values raise ConfigError.
+"""
+import os
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+# --------------------------- Configuration ---------------------------
+
+config_environment_variable = 'EXPERIMENT_CONFIG'
+default_config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'experiment.toml')
+
+# Choices of the [run] section (see force_experiment/tap_strategies.py)
+tap_strategy_names = ('none', 'peak', 'trace', 'ack', 'channels')
+
+# Sensor channels of the firmware (see sensor_channels in force_stream.py)
+sensor_channel_names = ('force', 'hand_force', 'carriage_accel')
+trial_orders = ('blocked', 'shuffled')
+
+# --------------------------- Functions ---------------------------
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _positive(value):
+    return _number(value) and value > 0
+
+
+def _positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def _positive_list(length):
+    return lambda value: isinstance(value, (list, tuple)) and len(value) == length and all(map(_positive, value))
+
+
+class ConfigSection:
+    """
+    Base class of the compiled, read-only config sections.
+    Subclasses list their fields in schema as name -> (default, check, description).
+    """
+
+    __slots__ = ()
+    schema = {}
+
+    def __init__(self, values, section):
+        unknown = set(values) - set(self.schema)
+        if unknown:
+            raise ConfigError(f"Unknown key(s) in [{section}]: {', '.join(sorted(unknown))}")
+        for name, (default, check, description) in self.schema.items():
+            value = values.get(name, default)
+            if isinstance(value, list):
+                value = tuple(value)
+            if not check(value):
+                raise ConfigError(f"Invalid [{section}] {name} = {value!r}: expected {description}")
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class SerialConfig(ConfigSection):
+    __slots__ = ('port', 'baud_rate', 'timeout')
+    schema = {
+        'port': ('COM3', lambda value: isinstance(value, str) and value != '', "a port name"),
+        'baud_rate': (250000, _positive_int, "a positive integer (must match SERIAL_BAUD in the sketch)"),
+        'timeout': (1.0, _positive, "a positive number of seconds"),
+    }
+
+
+class ProtocolConfig(ConfigSection):
+    __slots__ = ('distances', 'speeds', 'total_conditions', 'total_sets_per_condition', 'trials_per_set',
+                 'fixed_intensity', 'force_window_duration', 'peak_window_duration')
+    schema = {
+        'distances': ((0.5, 1.5, 3.0), _positive_list(3), "three positive distances in cm (conditions 1-6)"),
+        'speeds': ((1, 3), _positive_list(2), "two positive speeds in cm/s (slow, fast)"),
+        'total_conditions': (8, lambda value: value == 8, "8 (conditions are defined by the firmware)"),
+        'total_sets_per_condition': (2, _positive_int, "a positive integer"),
+        'trials_per_set': (20, _positive_int, "a positive integer"),
+        'fixed_intensity': (4, _positive, "a positive intensity"),
+        'force_window_duration': (1.1, _positive, "a positive number of seconds"),
+        'peak_window_duration': (0.5, _positive, "a positive number of seconds"),
+    }
+
+    @property
+    def total_trials(self):
+        return self.total_conditions * self.total_sets_per_condition * self.trials_per_set
+
+
+class QuestConfig(ConfigSection):
+    __slots__ = ('start_val', 'start_val_sd', 'p_threshold', 'n_trials', 'min_val', 'max_val')
+    schema = {
+        'start_val': (4, _number, "a number"),
+        'start_val_sd': (0.5, _positive, "a positive number"),
+        'p_threshold': (0.75, lambda value: _number(value) and 0 < value < 1, "a probability between 0 and 1"),
+        'n_trials': (20, _positive_int, "a positive integer"),
+        'min_val': (1, _number, "a number"),
+        'max_val': (7, _number, "a number"),
+    }
+
+    def __init__(self, values, section):
+        super().__init__(values, section)
+        if not self.min_val <= self.start_val <= self.max_val:
+            raise ConfigError(f"Invalid [{section}]: start_val must lie between min_val and max_val")
+
+
+class PathsConfig(ConfigSection):
+    __slots__ = ('data_directory', 'tap_directory', 'trial_database')
+    schema = {
+        'data_directory': ('data', lambda value: isinstance(value, str), "a directory (relative to the working directory)"),
+        'tap_directory': ('C:\\Users\\WahrPsyLab\\Desktop\\Mission Sensation\\data',
+                          lambda value: isinstance(value, str), "a directory for the tap force files"),
+        'trial_database': ('trials.sqlite', lambda value: isinstance(value, str),
+                           "a SQLite file in data_directory, or \"\" for CSV files only"),
+    }
+
+
+class RunConfig(ConfigSection):
+    __slots__ = ('tap_strategy', 'trial_order', 'schedule_file', 'use_command_queue', 'use_adaptive_scheduler',
+                 'max_consecutive_condition', 'target_posterior_sd', 'pipeline_trials')
+    schema = {
+        'tap_strategy': ('trace', lambda value: value in tap_strategy_names,
+                         f"one of {', '.join(tap_strategy_names)}"),
+        'trial_order': ('blocked', lambda value: value in trial_orders, f"one of {', '.join(trial_orders)}"),
+        'schedule_file': ('', lambda value: isinstance(value, str), "a schedule path or \"\" (see schedule_compiler.py)"),
+        'use_command_queue': (False, lambda value: isinstance(value, bool), "true or false"),
+        'use_adaptive_scheduler': (False, lambda value: isinstance(value, bool), "true or false"),
+        'max_consecutive_condition': (2, _positive_int, "a positive integer"),
+        'target_posterior_sd': (0.3, _positive, "a positive number"),
+        'pipeline_trials': (False, lambda value: isinstance(value, bool), "true or false"),
+    }
+
+
+class MonitorConfig(ConfigSection):
+    __slots__ = ('enabled', 'host', 'port', 'booth')
+    schema = {
+        'enabled': (False, lambda value: isinstance(value, bool), "true or false"),
+        'host': ('127.0.0.1', lambda value: isinstance(value, str) and value != '', "a host name or address"),
+        'port': (8765, lambda value: isinstance(value, int) and 0 <= value < 65536, "a TCP port (0 picks a free one)"),
+        'booth': ('', lambda value: isinstance(value, str), "a booth name shown on the dashboard"),
+    }
+
+
+class MotionConfig(ConfigSection):
+    __slots__ = ('use_profiles', 'acceleration', 'start_speed')
+    schema = {
+        'use_profiles': (False, lambda value: isinstance(value, bool), "true or false"),
+        'acceleration': (20.0, _positive, "a positive acceleration in cm/s^2"),
+        'start_speed': (1.0, _positive, "a positive speed in cm/s"),
+    }
+
+
+def _calibration(value):
+    """
+    Checks a list of [intensity, pulse us] points in increasing intensity.
+    """
+    if not isinstance(value, tuple):
+        return False
+    if not all(isinstance(point, (list, tuple)) and len(point) == 2 and all(map(_number, point))
+               for point in value):
+        return False
+    intensities = [point[0] for point in value]
+    return all(a < b for a, b in zip(intensities, intensities[1:])) and all(
+        544 <= point[1] <= 2400 for point in value)
+
+
+class ServoConfig(ConfigSection):
+    __slots__ = ('fine_intensity', 'calibration')
+    schema = {
+        'fine_intensity': (False, lambda value: isinstance(value, bool), "true or false"),
+        'calibration': ((), _calibration,
+                        "a list of [intensity, pulse us] points in increasing intensity (pulses 544 to 2400)"),
+    }
+
+
+class SensorsConfig(ConfigSection):
+    __slots__ = ('channels',)
+    schema = {
+        'channels': (('force',), lambda value: isinstance(value, tuple) and 'force' in value
+                     and set(value) <= set(sensor_channel_names) and len(set(value)) == len(value),
+                     f"a list of distinct channels including \"force\" (from {', '.join(sensor_channel_names)})"),
+    }
+
+
+class CaptureConfig(ConfigSection):
+    __slots__ = ('enabled', 'directory', 'rotate_bytes', 'flush_interval', 'timestamp_resolution', 'compact')
+    schema = {
+        'enabled': (False, lambda value: isinstance(value, bool), "true or false"),
+        'directory': ('captures', lambda value: isinstance(value, str) and value != '', "a directory"),
+        'rotate_bytes': (64 * 2 ** 20, _positive_int, "a positive number of compressed bytes per file"),
+        'flush_interval': (1.0, _positive, "a positive number of seconds"),
+        'timestamp_resolution': (0.005, lambda value: _number(value) and value >= 0, "a number of seconds (0 stamps every read)"),
+        'compact': (False, lambda value: isinstance(value, bool), "true or false"),
+    }
+
+
+class RealtimeConfig(ConfigSection):
+    __slots__ = ('enabled', 'cpu', 'priority', 'probe_duration')
+    schema = {
+        'enabled': (False, lambda value: isinstance(value, bool), "true or false"),
+        'cpu': (-1, lambda value: isinstance(value, int) and not isinstance(value, bool),
+                "a CPU index (negative counts from the last core)"),
+        'priority': (10, lambda value: isinstance(value, int) and 0 <= value <= 99,
+                     "a SCHED_FIFO priority from 1 to 99, or 0 to leave the scheduling alone"),
+        'probe_duration': (1.0, lambda value: _number(value) and value >= 0,
+                           "a number of seconds (0 skips the jitter measurement)"),
+    }
+
+
+class AcquisitionConfig(ConfigSection):
+    __slots__ = ('enabled', 'capacity', 'name', 'poll_interval')
+    schema = {
+        'enabled': (False, lambda value: isinstance(value, bool), "true or false"),
+        'capacity': (2 ** 18, _positive_int, "a positive number of samples kept per channel"),
+        'name': ('', lambda value: isinstance(value, str), "a shared memory name, or \"\" for force_ring_<pid>"),
+        'poll_interval': (0.001, _positive, "a positive number of seconds"),
+    }
+
+
+class ReportConfig(ConfigSection):
+    __slots__ = ('enabled', 'directory', 'function')
+    schema = {
+        'enabled': (False, lambda value: isinstance(value, bool), "true or false"),
+        'directory': ('reports', lambda value: isinstance(value, str) and value != '',
+                      "a directory (relative to data_directory)"),
+        'function': ('weibull', lambda value: value in ('weibull', 'logistic'), "weibull or logistic"),
+    }
+
+
+class ExperimentConfig:
+    """
+    The complete, validated experiment definition.
+    """
+
+    __slots__ = ('source', 'serial', 'protocol', 'quest', 'paths', 'run', 'motion', 'servo', 'monitor', 'sensors',
+                 'capture', 'realtime', 'acquisition', 'report')
+    sections = {'serial': SerialConfig, 'protocol': ProtocolConfig, 'quest': QuestConfig, 'paths': PathsConfig,
+                'run': RunConfig, 'motion': MotionConfig, 'servo': ServoConfig, 'monitor': MonitorConfig,
+                'sensors': SensorsConfig, 'capture': CaptureConfig, 'realtime': RealtimeConfig,
+                'acquisition': AcquisitionConfig, 'report': ReportConfig}
+
+    def __init__(self, values=None, source=None):
+        values = values or {}
+        unknown = set(values) - set(self.sections)
+        if unknown:
+            raise ConfigError(f"Unknown section(s): {', '.join(sorted(unknown))}")
+        object.__setattr__(self, 'source', source)
+        for name, section_class in self.sections.items():
+            section_values = values.get(name, {})
+            if not isinstance(section_values, dict):
+                raise ConfigError(f"[{name}] must be a table")
+            object.__setattr__(self, name, section_class(section_values, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ExperimentConfig is read-only")
+
+    def to_dict(self):
+        return {name: getattr(self, name).to_dict() for name in self.sections}
+
+    def replace(self, section, **values):
+        """
+        Returns a validated copy with some values of one section replaced.
+        """
+        updated = self.to_dict()
+        updated[section].update(values)
+        return ExperimentConfig(updated, source=self.source)
+
+
+def read_config_file(path):
+    """
+    Reads a TOML or YAML file into a dictionary.
+    """
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ConfigError("Reading YAML configs requires PyYAML (pip install pyyaml)")
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    if tomllib is None:
+        raise ConfigError("Reading TOML configs requires Python 3.11 or tomli (pip install tomli)")
+    with open(path, 'rb') as f:
+        try:
+            return tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ConfigError(f"Cannot parse {path}: {e}")
+
+
+def load_config(path=None):
+    """
+    Loads and validates the experiment config.
+    path defaults to $EXPERIMENT_CONFIG, then experiment.toml; if no file exists
+    the built-in defaults are used.
+    """
+    path = path or os.environ.get(config_environment_variable) or default_config_path
+    if not os.path.isfile(path):
+        if path != default_config_path:
+            raise ConfigError(f"Config file not found: {path}")
+        return ExperimentConfig()
+    return ExperimentConfig(read_config_file(path), source=path)
@@ -0,0 +1,466 @@
+import json
+import os
+import threading
+from multiprocessing import shared_memory
+
+import numpy
+
+from force_stream import sensor_channels, uniform_time_base
+
+# --------------------------- Configuration ---------------------------
+
+default_capacity = 2 ** 16  # Samples kept (about 65 s at 1 kHz)
+
+# Shared-memory rings (SharedChannelBuffers): a header of int64 words, the channel
+# names, one block of index words per channel and then the channels' sample arrays
+default_shared_capacity = 2 ** 18  # Samples kept per channel (about 4.4 minutes at 1 kHz)
+shared_magic = 0x474E5246  # "FRNG"
+shared_header_words = 8  # magic, capacity, channel count, creator pid, reserved
+shared_names_bytes = 256  # JSON list of channel names
+shared_channel_words = 8  # head, tail, reserved (one cache line per channel)
+
+# --------------------------- Functions ---------------------------
+
+
+class ForceWindow:
+    """
+    Read-only view of a span of samples in a ForceRingBuffer.
+
+    values is a non-writable NumPy array that shares memory with the ring buffer
+    (a single copy is made only when the span wraps around the end of the
+    buffer), and sequence_numbers the samples' firmware sequence numbers (-1 for
+    unnumbered streams). While a window is pinned the writer will not overwrite
+    its samples; every consumer that keeps the window calls retain() and
+    release() when done.
+    """
+
+    __slots__ = ('buffer', 'start', 'stop', 'values', 'sequence_numbers', 'references')
+
+    def __init__(self, buffer, start, stop, values, sequence_numbers=None):
+        self.buffer = buffer
+        self.start = start  # Absolute sample index of the first sample
+        self.stop = stop  # Absolute sample index after the last sample
+        self.values = values
+        self.sequence_numbers = sequence_numbers
+        self.references = 1
+
+    def retain(self):
+        """
+        Adds a reference for another consumer. Returns the window.
+        """
+        with self.buffer.lock:
+            if self.references <= 0:
+                raise RuntimeError("Cannot retain a released force window")
+            self.references += 1
+        return self
+
+    def release(self):
+        """
+        Drops one reference; the samples may be overwritten once none are left.
+        """
+        with self.buffer.lock:
+            if self.references <= 0:
+                return
+            self.references -= 1
+            if self.references == 0 and self.stop > self.start:
+                self.buffer._unpin(self.start)
+
+    def memoryview(self):
+        return memoryview(self.values)
+
+    def tolist(self):
+        return self.values.tolist()
+
+    def uniform(self):
+        """
+        Returns the values gap-filled on the uniform sample grid (see force_stream.uniform_time_base):
+        one entry per expected sample, NaN where a sample was lost. Unnumbered windows are returned as they are.
+        """
+        if self.sequence_numbers is None or not len(self.values) or self.sequence_numbers[0] < 0:
+            return self.values
+        return uniform_time_base(self.sequence_numbers, self.values, step=self.buffer.step)[1]
+
+    def intact(self):
+        """
+        True if none of the window's samples have been overwritten (always, while a ForceRingBuffer window is pinned).
+        """
+        return self.buffer.intact(self)
+
+    def snapshot(self):
+        """
+        Returns a copy of uniform() as a list, or None if samples were overwritten before
+        the copy was finished (checked afterwards, as the writer of a shared ring never waits).
+        """
+        values = self.uniform().tolist()
+        return values if self.intact() else None
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ForceRingBuffer:
+    """
+    Fixed-size ring buffer of force samples written by the acquisition thread.
+
+    Samples are addressed by absolute index (total samples written so far);
+    mark() returns the current index and window(start) hands out a pinned,
+    read-only ForceWindow over the samples written since. If the writer would
+    overwrite a pinned sample, the new sample is dropped and counted in overruns
+    instead. step is the channel's rate divider (see force_stream.sensor_channels).
+    """
+
+    pins_windows = True  # Pinned windows keep their samples until released
+
+    def __init__(self, capacity=default_capacity, dtype=numpy.float64, step=1):
+        self.capacity = capacity
+        self.step = step
+        self.data = numpy.zeros(capacity, dtype=dtype)
+        self.sequence = numpy.full(capacity, -1, dtype=numpy.int64)  # -1: unnumbered sample
+        self.lock = threading.Lock()
+        self.written = 0  # Absolute index of the next sample
+        self.pins = {}  # Start index -> number of pinned windows starting there
+        self.overruns = 0
+
+    def mark(self):
+        return self.written
+
+    def _oldest_pin(self):
+        return min(self.pins) if self.pins else None
+
+    def append(self, value, sequence_number=-1):
+        """
+        Writes one sample. Returns False if it was dropped to protect a pinned window.
+        """
+        with self.lock:
+            oldest = self._oldest_pin()
+            if oldest is not None and self.written - oldest >= self.capacity:
+                self.overruns += 1
+                return False
+            self.data[self.written % self.capacity] = value
+            self.sequence[self.written % self.capacity] = sequence_number
+            self.written += 1
+        return True
+
+    def extend(self, values, sequence_numbers=None):
+        """
+        Writes a block of samples (and their sequence numbers, if numbered) with at most
+        two slice copies each. Returns the number written; the rest is dropped to protect
+        pinned windows.
+        """
+        values = numpy.asarray(values, dtype=self.data.dtype)
+        if sequence_numbers is None:
+            sequence_numbers = numpy.full(len(values), -1, dtype=numpy.int64)
+        with self.lock:
+            oldest = self._oldest_pin()
+            if oldest is not None:
+                room = max(0, self.capacity - (self.written - oldest))
+                self.overruns += max(0, len(values) - room)
+                values, sequence_numbers = values[:room], sequence_numbers[:room]
+            count = len(values)
+            if count > self.capacity:  # Nothing pinned: only the newest samples survive
+                self.written += count - self.capacity
+                values, sequence_numbers = values[-self.capacity:], sequence_numbers[-self.capacity:]
+            first = self.written % self.capacity
+            head = min(len(values), self.capacity - first)
+            for array, block in ((self.data, values), (self.sequence, sequence_numbers)):
+                array[first:first + head] = block[:head]
+                array[:len(block) - head] = block[head:]
+            self.written += len(values)
+        return count
+
+    def window(self, start, stop=None):
+        """
+        Returns a pinned ForceWindow over samples [start, stop) (stop defaults to now).
+        Samples that have already been overwritten are skipped; empty windows pin nothing.
+        """
+        with self.lock:
+            stop = self.written if stop is None else min(stop, self.written)
+            start = min(max(start, stop - self.capacity, 0), stop)
+            values, sequence_numbers = self._span(self.data, start, stop), self._span(self.sequence, start, stop)
+            values.flags.writeable = False
+            sequence_numbers.flags.writeable = False
+            if stop > start:
+                self.pins[start] = self.pins.get(start, 0) + 1
+            return ForceWindow(self, start, stop, values, sequence_numbers)
+
+    def _span(self, array, start, stop):
+        first, last = start % self.capacity, stop % self.capacity
+        if stop - start == 0:
+            return array[0:0]
+        if first < last or last == 0:
+            return array[first:last or self.capacity]
+        return numpy.concatenate((array[first:], array[:last]))
+
+    def intact(self, window):
+        return True  # The writer drops samples rather than overwrite a pinned window
+
+    def _unpin(self, start):
+        """
+        Must be called with the lock held.
+        """
+        count = self.pins.get(start, 0) - 1
+        if count > 0:
+            self.pins[start] = count
+        else:
+            self.pins.pop(start, None)
+
+
+class ChannelBuffers:
+    """
+    One ForceRingBuffer per sensor channel, filled from demultiplexed sample blocks
+    (see force_stream.decode_samples). Windows can be taken from any channel subset.
+    """
+
+    def __init__(self, channels, capacity=default_capacity):
+        self.buffers = {name: ForceRingBuffer(capacity, step=sensor_channels.get(name, 1)) for name in channels}
+
+    def __getitem__(self, name):
+        return self.buffers[name]
+
+    def mark(self, channels=None):
+        return {name: self.buffers[name].mark() for name in channels or self.buffers}
+
+    def extend(self, decoded):
+        """
+        Appends the values of a decode_samples() result to each channel's buffer.
+        """
+        for name, (sequence_numbers, values) in decoded.items():
+            if name in self.buffers:
+                self.buffers[name].extend(values, sequence_numbers)
+
+    def windows(self, marks):
+        """
+        Returns pinned ForceWindows {channel: window} from the given marks to now.
+        """
+        return {name: self.buffers[name].window(start) for name, start in marks.items()}
+
+    @property
+    def overruns(self):
+        return sum(buffer.overruns for buffer in self.buffers.values())
+
+
+def _attach_shared_memory(name):
+    """
+    Attaches to an existing shared memory block without registering it with the
+    resource tracker, which would unlink it when this process exits (Python < 3.13).
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name)
+        if os.name == 'posix':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+
+class SharedForceRing:
+    """
+    One channel's ring of samples in a SharedChannelBuffers block.
+
+    Written by one process (the acquisition process) and read by any number of
+    others without locks: the writer publishes the tail (oldest kept sample)
+    before overwriting slots and the head (next sample) after filling them, both
+    as aligned 64-bit stores. Windows are read-only ForceWindows viewing the
+    shared memory directly; the writer never waits for them, so a window stays
+    intact for capacity samples after it was taken (see intact()). Consumers
+    that keep a window past the tap copy it (ForceWindow.snapshot()) instead of
+    retaining it.
+    """
+
+    pins_windows = False
+
+    def __init__(self, indices, sequence_numbers, times, values, step=1):
+        self.indices = indices  # [head, tail]
+        self.step = step
+        self.sequence = sequence_numbers
+        self.times = times
+        self.data = values
+        self.capacity = values.size
+        self.lock = threading.Lock()  # Only guards the reference counts of windows
+        self.overruns = 0  # The writer never drops samples for readers
+
+    @property
+    def head(self):
+        return int(self.indices[0])
+
+    @property
+    def tail(self):
+        return int(self.indices[1])
+
+    def mark(self):
+        return self.head
+
+    def extend(self, values, sequence_numbers, host_time):
+        """
+        Writes a block of samples received at host_time (writer process only).
+        """
+        values = numpy.asarray(values, dtype=self.data.dtype)[-self.capacity:]
+        sequence_numbers = numpy.asarray(sequence_numbers, dtype=numpy.int64)[-self.capacity:]
+        count = len(values)
+        head = self.head
+        self.indices[1] = max(self.tail, head + count - self.capacity)  # Before the slots are reused
+        first = head % self.capacity
+        split = min(count, self.capacity - first)
+        for array, block in ((self.data, values), (self.sequence, sequence_numbers)):
+            array[first:first + split] = block[:split]
+            array[:count - split] = block[split:]
+        self.times[first:first + split] = host_time
+        self.times[:count - split] = host_time
+        self.indices[0] = head + count  # Publish
+        return count
+
+    def _span(self, array, start, stop):
+        first, last = start % self.capacity, stop % self.capacity
+        if stop - start == 0:
+            return array[0:0]
+        if first < last or last == 0:
+            return array[first:last or self.capacity]
+        return numpy.concatenate((array[first:], array[:last]))
+
+    def window(self, start, stop=None):
+        """
+        Returns a read-only ForceWindow over samples [start, stop) (stop defaults to now).
+        Samples that have already been overwritten are skipped.
+        """
+        stop = self.head if stop is None else min(stop, self.head)
+        start = min(max(start, self.tail), stop)
+        values, sequence_numbers = self._span(self.data, start, stop), self._span(self.sequence, start, stop)
+        values.flags.writeable = False
+        return ForceWindow(self, start, stop, values, sequence_numbers)
+
+    def sequence_numbers(self, start, stop):
+        """
+        Returns a copy of the sequence numbers of samples [start, stop).
+        """
+        start = min(max(start, self.tail), stop)
+        return numpy.array(self._span(self.sequence, start, stop))
+
+    def intact(self, window):
+        """
+        True if none of the window's samples have been overwritten since it was taken.
+        """
+        return window.start >= self.tail
+
+    def _unpin(self, start):
+        pass  # Windows do not hold back the writer
+
+
+class SharedChannelBuffers:
+    """
+    ChannelBuffers in a named multiprocessing.shared_memory block: one
+    SharedForceRing per sensor channel. The acquisition process creates the block
+    and fills it; the session and any other local tool attach to it by name.
+    """
+
+    def __init__(self, block, owner=False, readonly=False):
+        self.block = block
+        self.owner = owner
+        header = numpy.ndarray(shared_header_words, dtype=numpy.int64, buffer=block.buf)
+        if header[0] != shared_magic:
+            raise ValueError(f"Shared memory block '{block.name}' is not a force ring")
+        capacity, channel_count = int(header[1]), int(header[2])
+        offset = shared_header_words * 8
+        self.names = json.loads(bytes(block.buf[offset:offset + shared_names_bytes]).rstrip(b'\0'))
+        offset += shared_names_bytes
+        self.buffers = {}
+        arrays_offset = offset + channel_count * shared_channel_words * 8
+        for index, name in enumerate(self.names):
+            indices = numpy.ndarray(2, dtype=numpy.int64, buffer=block.buf,
+                                    offset=offset + index * shared_channel_words * 8)
+            arrays = [numpy.ndarray(capacity, dtype=dtype, buffer=block.buf,
+                                    offset=arrays_offset + (3 * index + position) * capacity * 8)
+                      for position, dtype in enumerate((numpy.int64, numpy.float64, numpy.float64))]
+            if readonly:
+                for array in arrays:
+                    array.flags.writeable = False
+            self.buffers[name] = SharedForceRing(indices, *arrays, step=sensor_channels.get(name, 1))
+        self.creator_pid = int(header[3])
+
+    @classmethod
+    def create(cls, channels, capacity=default_shared_capacity, name=None):
+        """
+        Creates the block for the given channels. A block left behind under the same
+        name (e.g. by a crashed session) is replaced.
+        """
+        channels = list(channels)
+        names = json.dumps(channels).encode()
+        if len(names) > shared_names_bytes:
+            raise ValueError("Too many channel names for a shared force ring")
+        size = (shared_header_words * 8 + shared_names_bytes + len(channels) * shared_channel_words * 8
+                + 3 * len(channels) * capacity * 8)
+        try:
+            block = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            block = shared_memory.SharedMemory(name, create=True, size=size)
+        offset = shared_header_words * 8
+        block.buf[offset:offset + len(names)] = names
+        header = numpy.ndarray(shared_header_words, dtype=numpy.int64, buffer=block.buf)
+        header[1], header[2], header[3] = capacity, len(channels), os.getpid()
+        header[0] = shared_magic
+        return cls(block, owner=True)
+
+    @classmethod
+    def attach(cls, name, readonly=True, tracked=False):
+        """
+        Attaches to the block of a running session. Processes started by the creator
+        share its resource tracker and attach with tracked=True.
+        """
+        return cls(shared_memory.SharedMemory(name) if tracked else _attach_shared_memory(name), readonly=readonly)
+
+    @property
+    def name(self):
+        return self.block.name
+
+    def __getitem__(self, name):
+        return self.buffers[name]
+
+    def mark(self, channels=None):
+        return {name: self.buffers[name].mark() for name in channels or self.buffers}
+
+    def extend(self, decoded, host_time):
+        """
+        Appends the values of a decode_samples() result to each channel's ring (writer only).
+        """
+        for name, (sequence_numbers, values) in decoded.items():
+            if name in self.buffers and len(values):
+                self.buffers[name].extend(values, sequence_numbers, host_time)
+
+    def windows(self, marks):
+        """
+        Returns read-only ForceWindows {channel: window} from the given marks to now.
+        """
+        return {name: self.buffers[name].window(start) for name, start in marks.items()}
+
+    @property
+    def overruns(self):
+        return 0
+
+    def close(self):
+        """
+        Detaches from the block (and removes it, if this process created it). The memory
+        stays mapped while windows taken from it are still referenced.
+        """
+        self.buffers = {}
+        try:
+            self.block.close()
+        except BufferError:
+            pass
+        if self.owner:
+            try:
+                self.block.unlink()
+            except FileNotFoundError:
+                pass
+            self.owner = False
@@ -0,0 +1,45 @@
+"""
+Experiment runner for the tap intensity discrimination experiment.
+
+One engine (ExperimentSession) drives every variant of the experiment. The
+variants differ only in how taps are measured, which is a pluggable strategy
+selected by [run] tap_strategy in the experiment config:
+
+    none     - send the taps only
+    peak     - store the highest force after each tap (MaxForce)
+    trace    - store every force sample after each tap (Force Data)
+    ack      - read and print the Arduino's reply to each tap
+    channels - store every sample of each [sensors] channel after each tap
+
+    python -m force_experiment [--config experiment.toml] [--taps peak] [--order shuffled]
+"""
+import importlib
+
+# Public names and the modules that define them. They are imported on first use,
+# so the offline tools (trial_store, archive, replay, report) run without the
+# session's dependencies (PsychoPy, pygame, pyserial).
+_exports = {
+    'ForceArchive': 'archive', 'compact_capture': 'archive',
+    'SessionMonitor': 'monitor',
+    'ExperimentSession': 'session', 'build_trials': 'session', 'condition_parameters': 'session',
+    'initialize_quest_handlers': 'session',
+    'get_tap_csv_filename': 'storage', 'initialize_csv': 'storage', 'write_tap_rows': 'storage',
+    'AckOnly': 'tap_strategies', 'ChannelTraces': 'tap_strategies', 'FullTrace': 'tap_strategies',
+    'NoMeasurement': 'tap_strategies', 'PeakInWindow': 'tap_strategies', 'TapStrategy': 'tap_strategies',
+    'make_tap_strategy': 'tap_strategies', 'tap_strategies': 'tap_strategies',
+    'TrialStore': 'trial_store', 'export_csv': 'trial_store', 'find_trials': 'trial_store',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{_exports[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
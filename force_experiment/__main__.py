@@ -0,0 +1,67 @@
+import argparse
+import sys
+
+from experiment_config import ConfigError, load_config, tap_strategy_names, trial_orders
+from .monitor import SessionMonitor
+from .responses import close_display, initialize_display
+from .session import ExperimentSession
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m force_experiment', description="Run an experiment session.")
+    parser.add_argument('--config', default=None, help="Experiment config (default: $EXPERIMENT_CONFIG or experiment.toml)")
+    parser.add_argument('--participant', default=None, help="Participant name (prompted if omitted)")
+    parser.add_argument('--taps', choices=tap_strategy_names, default=None, help="Override [run] tap_strategy")
+    parser.add_argument('--order', choices=trial_orders, default=None, help="Override [run] trial_order")
+    parser.add_argument('--port', default=None, help="Override [serial] port")
+    parser.add_argument('--monitor-port', type=int, default=None, help="Serve live metrics on this port")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    try:
+        config = load_config(args.config)
+        overrides = {'tap_strategy': args.taps, 'trial_order': args.order}
+        config = config.replace('run', **{name: value for name, value in overrides.items() if value})
+        if args.port:
+            config = config.replace('serial', port=args.port)
+        if args.monitor_port is not None:
+            config = config.replace('monitor', enabled=True, port=args.monitor_port)
+    except ConfigError as e:
+        print(f"Invalid experiment config: {e}")
+        return 2
+
+    participant_name = args.participant
+    if participant_name is None:
+        participant_name = input("Please enter the participant's name: ").strip()
+    if not participant_name:
+        participant_name = "unknown_participant"
+        print("No name entered. Using 'unknown_participant' as the name.")
+
+    session = ExperimentSession(config, participant_name)
+    print(f"Tap measurement: {session.tap_strategy.name}, trial order: {config.run.trial_order}")
+    if config.monitor.enabled:
+        session.monitor = SessionMonitor(config.monitor.host, config.monitor.port, config.monitor.booth)
+        session.monitor.start()
+    initialize_display()
+    try:
+        session.initialize_serial()
+        session.open_csv()
+        session.open_store()
+        session.enter_realtime()
+        session.run()
+    except KeyboardInterrupt:
+        print("\nExperiment interrupted by user.")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    finally:
+        session.close()
+        close_display()
+        if session.monitor is not None:
+            session.monitor.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
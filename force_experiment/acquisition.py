@@ -0,0 +1,260 @@
+"""
+Acquisition process: the serial port and the force stream in a process of their own.
+
+With [acquisition] enabled the session starts a separate process that owns the
+serial port. It reads the stream in chunks, decodes them with a StreamDecoder
+(force_stream.py) and writes the samples into a SharedChannelBuffers ring in shared memory (force_buffer.py),
+so reading samples no longer competes for the GIL with Pygame's event loop,
+the CSV writes and the trial loop. The session takes its force windows
+straight from the shared memory, without copies.
+
+Commands go to the process through a pipe, and every line that is not a
+sample (acknowledgements, STATE tags, replies) comes back through it, so the
+session's serial code talks to an AcquisitionPort as if it were the port.
+
+Other local tools can attach to a running session's ring read-only:
+
+    python -m force_experiment.acquisition watch force_ring_12345
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import numpy
+
+from force_buffer import SharedChannelBuffers, default_shared_capacity
+from force_stream import ChannelLayout, StreamDecoder
+from .capture import CaptureWriter, CapturingSerial
+
+# --------------------------- Configuration ---------------------------
+
+default_poll_interval = 0.001  # Seconds the process sleeps when no bytes are waiting
+start_timeout = 30.0  # Seconds to wait for the process to open the port
+stop_timeout = 5.0
+watch_interval = 1.0
+
+# --------------------------- Acquisition process ---------------------------
+
+
+def acquire(open_port, ring_name, channels, connection, poll_interval=default_poll_interval, capture=None):
+    """
+    Entry point of the acquisition process. open_port is a picklable callable that
+    opens the port (e.g. functools.partial(serial.Serial, ...)); capture is None or
+    (base path, rotate bytes, flush interval, timestamp resolution) to tee the port
+    into a raw capture. Runs until the session sends 'stop' or goes away.
+    """
+    layout = ChannelLayout(channels)
+    buffers = SharedChannelBuffers.attach(ring_name, readonly=False, tracked=True)
+    writer = None
+    try:
+        port = open_port()
+        if capture is not None:
+            base_path, rotate_bytes, flush_interval, timestamp_resolution = capture
+            writer = CaptureWriter(base_path, rotate_bytes, flush_interval).start()
+            port = CapturingSerial(port, writer, timestamp_resolution)
+    except Exception as e:
+        connection.send(('error', str(e)))
+        buffers.close()
+        return
+    connection.send(('ready', os.getpid()))
+
+    stats = {'lines': 0, 'samples': 0, 'malformed': 0}
+    decoder = StreamDecoder(layout)
+    legacy_sequence = 0  # Unnumbered force lines are numbered consecutively
+    running = True
+    try:
+        while running:
+            while connection.poll():
+                command, payload = connection.recv()
+                if command == 'write':
+                    port.write(payload)
+                elif command == 'stop':
+                    running = False
+                    break
+
+            waiting = port.in_waiting
+            if not waiting:
+                time.sleep(poll_interval)
+                continue
+            samples, legacy_values, lines = decoder.feed(port.read(waiting))
+            now = time.time()
+            for line in lines:
+                connection.send(('line', (now, line)))
+            if samples:
+                buffers.extend(samples, now)
+                stats['samples'] += max(len(sequence_numbers) for sequence_numbers, values in samples.values())
+            if len(legacy_values):
+                sequence_numbers = numpy.arange(legacy_sequence, legacy_sequence + len(legacy_values))
+                buffers.extend({'force': (sequence_numbers, legacy_values)}, now)
+                legacy_sequence += len(legacy_values)
+                stats['samples'] += len(legacy_values)
+            stats['lines'], stats['malformed'] = decoder.lines, decoder.malformed
+    except (EOFError, OSError) as e:
+        print(f"Acquisition stopped: {e}")
+    finally:
+        try:
+            port.close()
+        except Exception:
+            pass
+        if writer is not None:
+            writer.close()
+            stats['bytes_captured'] = writer.bytes_captured
+        try:
+            connection.send(('stats', stats))
+        except (EOFError, OSError):
+            pass
+        buffers.close()
+
+
+# --------------------------- Session side ---------------------------
+
+
+class AcquisitionPort:
+    """
+    The session's stand-in for the serial port while an acquisition process owns it:
+    write() sends a command through the process and readline() returns the next line
+    that is not a sample. The samples themselves are in buffers (SharedChannelBuffers).
+    """
+
+    def __init__(self, open_port, channels, capacity=default_shared_capacity, name=None,
+                 poll_interval=default_poll_interval, capture=None, timeout=1.0):
+        self.buffers = SharedChannelBuffers.create(channels, capacity, name or f"force_ring_{os.getpid()}")
+        self.capture = capture
+        self.timeout = timeout
+        context = multiprocessing.get_context('spawn')  # No copy of the display, threads or open files
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=acquire, name='force-acquisition', daemon=True,
+                                       args=(open_port, self.buffers.name, list(channels), child_connection,
+                                             poll_interval, capture))
+        self._child_connection = child_connection
+        self.send_lock = threading.Lock()  # The trial loop and the motion worker both send commands
+        self.receive_lock = threading.Lock()
+        self.is_open = False
+        self.last_line_time = None  # Host time the last line returned by readline() was received
+        self.stats = {}
+
+    def start(self, timeout=start_timeout):
+        """
+        Starts the process and waits until it has opened the port. Returns the AcquisitionPort.
+        """
+        self.process.start()
+        self._child_connection.close()
+        try:
+            message, payload = self.connection.recv() if self.connection.poll(timeout) else ('error', "no reply")
+        except (EOFError, OSError):
+            message, payload = 'error', "the process exited"
+        if message != 'ready':
+            self.close()
+            raise OSError(f"Acquisition process failed to open the port: {payload}")
+        self.is_open = True
+        return self
+
+    def next_line(self, timeout):
+        """
+        Returns the next (host time, line) that is not a sample, or None after timeout seconds.
+        """
+        deadline = time.time() + timeout
+        with self.receive_lock:
+            while True:
+                try:
+                    if not self.connection.poll(max(0.0, deadline - time.time())):
+                        return None
+                    message, payload = self.connection.recv()
+                except (EOFError, OSError):
+                    self.is_open = False
+                    return None
+                if message == 'line':
+                    return payload
+                if message == 'stats':
+                    self.stats = payload
+                    self.is_open = False
+                    return None
+
+    # ---- pyserial compatible interface ----
+
+    def readline(self):
+        received = self.next_line(self.timeout if self.timeout is not None else 1e9)
+        if received is None:
+            return b''
+        self.last_line_time, line = received
+        return line.encode() + b'\n'
+
+    def write(self, data):
+        with self.send_lock:
+            self.connection.send(('write', bytes(data)))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        while self.next_line(0) is not None:
+            pass
+
+    def close(self):
+        """
+        Stops the process and removes the shared ring. The process's statistics
+        (lines, samples, malformed, bytes_captured) are left in stats.
+        """
+        if self.process.is_alive():
+            try:
+                with self.send_lock:
+                    self.connection.send(('stop', None))
+                deadline = time.time() + stop_timeout
+                while self.is_open and time.time() < deadline:
+                    self.next_line(deadline - time.time())
+            except (EOFError, OSError):
+                pass
+            self.process.join(stop_timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.is_open = False
+        self.connection.close()
+        self.buffers.close()
+
+
+# --------------------------- Tools ---------------------------
+
+
+def watch(name, interval=watch_interval):
+    """
+    Attaches to a running session's ring read-only and prints each channel's
+    sample rate and latest value every interval seconds.
+    """
+    buffers = SharedChannelBuffers.attach(name)
+    print(f"Attached to '{name}' (created by process {buffers.creator_pid}): {', '.join(buffers.names)}")
+    previous = buffers.mark()
+    try:
+        while True:
+            time.sleep(interval)
+            current = buffers.mark()
+            fields = []
+            for channel, head in current.items():
+                ring = buffers[channel]
+                latest = ring.data[(head - 1) % ring.capacity] if head else float('nan')
+                fields.append(f"{channel} {(head - previous[channel]) / interval:.0f} Hz, last {latest:g}")
+            print("; ".join(fields))
+            previous = current
+    except KeyboardInterrupt:
+        pass
+    finally:
+        buffers.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the shared force ring of a running session.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    watch_parser = subparsers.add_parser('watch', help="Print live sample rates and values")
+    watch_parser.add_argument('name', help="Shared memory name printed by the session")
+    watch_parser.add_argument('--interval', type=float, default=watch_interval)
+    args = parser.parse_args()
+
+    watch(args.name, args.interval)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""
+Chunked, compressed archive of a session's raw force recording.
+
+A compactor reads a raw serial capture (see capture.py) after the session and
+rewrites every sensor channel's samples into chunks of chunk_samples samples.
+Each chunk holds the sequence numbers and values as deltas, compressed with
+the fastest codec available (zstandard, then lz4, then zlib). An index at the
+end of the file lists every chunk's sequence range, host time range and file
+offset, plus the tap commands of the session. Any tap window can be read back
+by decompressing only the chunks it overlaps:
+
+    archive = ForceArchive('captures/p01_20250101_120000.farc')
+    for tap in archive.taps:
+        seqs, times, forces = archive.window(tap['time'], 1.1)
+
+Sessions compact themselves in a background process when they close (see
+[capture] compact); older captures can be compacted in bulk:
+
+    python -m force_experiment.archive compact captures/p01_20250101_120000 --workers 4
+"""
+import argparse
+import json
+import os
+import re
+import struct
+import subprocess
+import sys
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from force_stream import ChannelLayout, decode_samples, parse_stream_line, sample_prefix, sensor_channels
+from servo_intensity import parse_tap_command
+from .capture import capture_files, direction_rx, direction_tx, read_capture
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# --------------------------- Configuration ---------------------------
+
+archive_magic = b'FARC'
+archive_version = 1
+archive_suffix = '.farc'
+chunk_samples = 4096  # Samples per compressed chunk (about 4 s at 1 kHz)
+footer = struct.Struct('<QI')  # Index offset and length, at the very end of the file
+chunk_header = struct.Struct('<IB')  # Sample count, value encoding (0 integer deltas, 1 float64)
+
+channels_command_pattern = re.compile(r"^CHANNELS (\d+)$")
+
+# --------------------------- Functions ---------------------------
+
+
+def _codecs():
+    codecs = {'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress)}
+    if lz4 is not None:
+        codecs['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+    if zstandard is not None:
+        codecs['zstd'] = (zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress)
+    return codecs
+
+
+def default_codec():
+    codecs = _codecs()
+    return next(name for name in ('zstd', 'lz4', 'zlib') if name in codecs)
+
+
+def encode_chunk(seqs, values):
+    """
+    Packs one chunk: sequence numbers and values as first-order deltas.
+    Integral values (raw ADC counts) are stored as int32 deltas, anything else as float64.
+    """
+    seq_deltas = numpy.diff(seqs, prepend=0).astype(numpy.int64)
+    if numpy.all(numpy.mod(values, 1) == 0):
+        encoding, value_bytes = 0, numpy.diff(values.astype(numpy.int64), prepend=0).astype(numpy.int32).tobytes()
+    else:
+        encoding, value_bytes = 1, values.astype(numpy.float64).tobytes()
+    return chunk_header.pack(len(seqs), encoding) + seq_deltas.tobytes() + value_bytes
+
+
+def decode_chunk(data):
+    count, encoding = chunk_header.unpack_from(data)
+    offset = chunk_header.size
+    seqs = numpy.cumsum(numpy.frombuffer(data, numpy.int64, count, offset))
+    offset += 8 * count
+    if encoding == 0:
+        values = numpy.cumsum(numpy.frombuffer(data, numpy.int32, count, offset).astype(numpy.int64)).astype(float)
+    else:
+        values = numpy.frombuffer(data, numpy.float64, count, offset).copy()
+    return seqs, values
+
+
+class ArchiveWriter:
+    """
+    Writes channel samples into compressed chunks and the index on close().
+    """
+
+    def __init__(self, path, codec=None, source=None, sample_rate=None):
+        self.path = path
+        self.codec = codec or default_codec()
+        self.compress = _codecs()[self.codec][0]
+        self.file = open(path + '.tmp', 'wb')
+        self.file.write(archive_magic + bytes([archive_version]))
+        self.index = {'version': archive_version, 'codec': self.codec, 'source': source,
+                      'sample_rate': sample_rate, 'chunk_samples': chunk_samples, 'channels': {}, 'taps': []}
+        self.pending = {}  # Channel -> lists of (seqs, values, times) arrays not yet written
+        self.raw_bytes = 0
+
+    def add_samples(self, channel, seqs, values, times):
+        pending = self.pending.setdefault(channel, [])
+        pending.append((numpy.asarray(seqs, dtype=numpy.int64), numpy.asarray(values, dtype=float),
+                        numpy.asarray(times, dtype=float)))
+        if sum(len(block[0]) for block in pending) >= chunk_samples:
+            self._write_chunks(channel, final=False)
+
+    def add_tap(self, time, tap_digit, condition, fixed_intensity, variable_intensity):
+        self.index['taps'].append({'time': time, 'type': 'Fixed' if tap_digit == '0' else 'Variable',
+                                   'condition': condition, 'fixed': fixed_intensity, 'variable': variable_intensity})
+
+    def _write_chunks(self, channel, final):
+        blocks = self.pending.pop(channel, [])
+        if not blocks:
+            return
+        seqs, values, times = (numpy.concatenate(parts) for parts in zip(*blocks))
+        chunks = self.index['channels'].setdefault(channel, [])
+        start = 0
+        while len(seqs) - start >= chunk_samples or (final and start < len(seqs)):
+            stop = min(start + chunk_samples, len(seqs))
+            raw = encode_chunk(seqs[start:stop], values[start:stop])
+            data = self.compress(raw)
+            chunks.append({'first_seq': int(seqs[start]), 'last_seq': int(seqs[stop - 1]), 'count': stop - start,
+                           'first_time': float(times[start]), 'last_time': float(times[stop - 1]),
+                           'offset': self.file.tell(), 'length': len(data)})
+            self.file.write(data)
+            self.raw_bytes += len(raw)
+            start = stop
+        if start < len(seqs):
+            self.pending[channel] = [(seqs[start:], values[start:], times[start:])]
+
+    def close(self):
+        for channel in list(self.pending):
+            self._write_chunks(channel, final=True)
+        index = json.dumps(self.index).encode()
+        offset = self.file.tell()
+        self.file.write(index)
+        self.file.write(footer.pack(offset, len(index)))
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+class ForceArchive:
+    """
+    Random access to an archive written by ArchiveWriter.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(archive_magic)) != archive_magic:
+                raise ValueError(f"{path} is not a force archive")
+            f.seek(-footer.size, os.SEEK_END)
+            offset, length = footer.unpack(f.read(footer.size))
+            f.seek(offset)
+            self.index = json.loads(f.read(length))
+        self.decompress = _codecs()[self.index['codec']][1] if self.index['codec'] in _codecs() else None
+        if self.decompress is None:
+            raise ValueError(f"{path} needs the {self.index['codec']} codec, which is not installed")
+
+    @property
+    def channels(self):
+        return list(self.index['channels'])
+
+    @property
+    def taps(self):
+        return self.index['taps']
+
+    def _read_chunks(self, chunks):
+        """
+        Decompresses the given chunks. Returns (seqs, times, values) arrays; sample
+        times are interpolated by sequence number within each chunk.
+        """
+        parts = []
+        with open(self.path, 'rb') as f:
+            for chunk in chunks:
+                f.seek(chunk['offset'])
+                seqs, values = decode_chunk(self.decompress(f.read(chunk['length'])))
+                span = max(chunk['last_seq'] - chunk['first_seq'], 1)
+                times = chunk['first_time'] + (seqs - chunk['first_seq']) * (
+                    (chunk['last_time'] - chunk['first_time']) / span)
+                parts.append((seqs, times, values))
+        if not parts:
+            return numpy.empty(0, dtype=numpy.int64), numpy.empty(0), numpy.empty(0)
+        return tuple(numpy.concatenate(arrays) for arrays in zip(*parts))
+
+    def samples(self, channel='force', start_seq=None, stop_seq=None):
+        """
+        Returns (seqs, times, values) of the samples with start_seq <= seq < stop_seq.
+        """
+        start_seq = -numpy.inf if start_seq is None else start_seq
+        stop_seq = numpy.inf if stop_seq is None else stop_seq
+        chunks = [chunk for chunk in self.index['channels'].get(channel, [])
+                  if chunk['last_seq'] >= start_seq and chunk['first_seq'] < stop_seq]
+        seqs, times, values = self._read_chunks(chunks)
+        keep = (seqs >= start_seq) & (seqs < stop_seq)
+        return seqs[keep], times[keep], values[keep]
+
+    def window(self, start_time, duration, channel='force'):
+        """
+        Returns (seqs, times, values) of the samples recorded in [start_time, start_time + duration).
+        """
+        stop_time = start_time + duration
+        chunks = [chunk for chunk in self.index['channels'].get(channel, [])
+                  if chunk['last_time'] >= start_time and chunk['first_time'] < stop_time]
+        seqs, times, values = self._read_chunks(chunks)
+        keep = (times >= start_time) & (times < stop_time)
+        return seqs[keep], times[keep], values[keep]
+
+    def compressed_bytes(self):
+        return sum(chunk['length'] for chunks in self.index['channels'].values() for chunk in chunks)
+
+
+def compact_capture(capture, archive_path=None, codec=None):
+    """
+    Rewrites the sensor samples of a raw capture into a force archive.
+    Lines without sequence numbers (older firmware) are numbered in arrival order.
+    Returns a summary dictionary.
+    """
+    if archive_path is None:
+        files = capture_files(capture)
+        archive_path = re.sub(r"\.\d{4}\.cap\.gz$", '', files[0]) + archive_suffix
+    writer = ArchiveWriter(archive_path, codec, source=os.path.basename(str(capture)))
+    layout = ChannelLayout()
+    partial = b''
+    legacy_seq = 0
+    capture_bytes = 0
+    for timestamp, direction, payload in read_capture(capture):
+        if direction == direction_tx:
+            for command in payload.decode('utf-8', errors='replace').split('\n'):
+                command = command.strip()
+                tap = parse_tap_command(command)
+                if tap is not None:
+                    writer.add_tap(timestamp, *tap)
+                match = channels_command_pattern.match(command)
+                if match:
+                    mask = int(match.group(1))
+                    layout = ChannelLayout([name for index, name in enumerate(sensor_channels) if mask >> index & 1])
+            continue
+        if direction != direction_rx:
+            continue
+        capture_bytes += len(payload)
+        lines = (partial + payload).split(b'\n')
+        partial = lines.pop()
+        sample_lines, legacy_values = [], []
+        for raw in lines:
+            line = raw.decode('utf-8', errors='replace').strip()
+            if line.startswith(sample_prefix):
+                sample_lines.append(line)
+            elif line:
+                kind, value = parse_stream_line(line)
+                if kind == 'force':
+                    legacy_values.append(value)
+        if sample_lines:
+            decoded, malformed = decode_samples(sample_lines, layout)
+            for channel, (seqs, values) in decoded.items():
+                if len(seqs):
+                    writer.add_samples(channel, seqs, values, numpy.full(len(seqs), timestamp))
+        if legacy_values:
+            seqs = numpy.arange(legacy_seq, legacy_seq + len(legacy_values))
+            legacy_seq += len(legacy_values)
+            writer.add_samples('force', seqs, legacy_values, numpy.full(len(seqs), timestamp))
+    writer.close()
+    archive_bytes = os.path.getsize(archive_path)
+    return {'capture': str(capture), 'archive': archive_path, 'codec': writer.codec, 'raw_bytes': writer.raw_bytes,
+            'capture_bytes': capture_bytes, 'archive_bytes': archive_bytes}
+
+
+def start_background_compaction(capture):
+    """
+    Compacts a capture in a separate, low-priority process that outlives the caller.
+    The compactor runs in a session of its own (Ctrl+C in the experiment's terminal
+    does not reach it) and a daemon thread reaps it if it finishes while the caller
+    is still running. Returns the subprocess.Popen of the compactor.
+    """
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-m', 'force_experiment.archive', 'compact', os.path.abspath(capture)]
+    if hasattr(os, 'nice'):
+        process = subprocess.Popen(command, cwd=package_root, stdin=subprocess.DEVNULL, start_new_session=True,
+                                   preexec_fn=lambda: os.nice(10))
+    else:
+        process = subprocess.Popen(command, cwd=package_root, stdin=subprocess.DEVNULL,
+                                   creationflags=getattr(subprocess, 'BELOW_NORMAL_PRIORITY_CLASS', 0) |
+                                   getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0))
+    threading.Thread(target=_reap_compaction, args=(process, capture), name='compaction-reaper', daemon=True).start()
+    return process
+
+
+def _reap_compaction(process, capture):
+    if process.wait() != 0:
+        print(f"Capture compaction of {capture} failed (exit code {process.returncode}).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact raw captures into force archives, or inspect archives.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compact_parser = subparsers.add_parser('compact', help="Compact captures (files, directories or base names)")
+    compact_parser.add_argument('captures', nargs='+')
+    compact_parser.add_argument('--codec', choices=['zstd', 'lz4', 'zlib'], default=None)
+    compact_parser.add_argument('--workers', type=int, default=1, help="Captures compacted in parallel")
+    info_parser = subparsers.add_parser('info', help="Summarize an archive")
+    info_parser.add_argument('archive')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        archive = ForceArchive(args.archive)
+        print(f"{args.archive}: codec {archive.index['codec']}, {len(archive.taps)} taps")
+        for channel, chunks in archive.index['channels'].items():
+            print(f"  {channel}: {sum(chunk['count'] for chunk in chunks)} samples in {len(chunks)} chunks")
+        return 0
+
+    if args.codec is not None and args.codec not in _codecs():
+        print(f"The {args.codec} codec is not installed.")
+        return 2
+    jobs = [(capture, None, args.codec) for capture in args.captures]
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        summaries = list(pool.map(compact_capture, *zip(*jobs)))
+    for summary in summaries:
+        ratio = summary['capture_bytes'] / max(summary['archive_bytes'], 1)
+        print(f"{summary['capture']} -> {summary['archive']} ({summary['codec']}, "
+              f"{summary['archive_bytes']} bytes, {ratio:.1f}x smaller than the text stream)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Raw serial capture files.
+
+A capture holds every chunk of bytes exchanged with the Arduino as records of
+(host time, direction, payload): direction_rx for bytes read from the port,
+direction_tx for commands written to it. Records are packed as
+
+    <float64 host time><uint8 direction><uint32 length><payload>
+
+and files are gzip streams, so they can be appended to one compressed member
+at a time. A session's capture may be rotated over several files named
+<base>.<NNNN>.cap.gz, which are read back in order.
+
+During a session CapturingSerial tees the serial port into a CaptureWriter.
+The tee only appends to an in-memory list; a background thread compresses and
+appends everything collected once per flush_interval, so the live path never
+waits on the disk. Enable it with [capture] in the experiment config; replay
+captures with python -m force_experiment.replay.
+"""
+import glob
+import gzip
+import os
+import struct
+import threading
+import time
+
+# --------------------------- Configuration ---------------------------
+
+record_header = struct.Struct('<dBI')
+direction_rx = 0  # Bytes received from the Arduino
+direction_tx = 1  # Bytes sent to the Arduino
+capture_suffix = '.cap.gz'
+
+# --------------------------- Functions ---------------------------
+
+
+class CaptureWriter:
+    """
+    Appends capture records to rotating, compressed files from a background thread.
+    Each flush writes one gzip member with a single sequential write; a new file
+    is started once the current one holds rotate_bytes compressed bytes.
+    """
+
+    def __init__(self, base_path, rotate_bytes=64 * 2 ** 20, flush_interval=1.0):
+        self.base_path = base_path
+        self.rotate_bytes = rotate_bytes
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.records = []  # Encoded records waiting for the next flush
+        self.file = None
+        self.file_index = len(glob.glob(glob.escape(base_path) + '.*' + capture_suffix))
+        self.bytes_captured = 0
+        self.bytes_written = 0
+        self.thread = threading.Thread(target=self._run, name='capture-writer', daemon=True)
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.base_path) or '.', exist_ok=True)
+        self.thread.start()
+        return self
+
+    def record(self, timestamp, direction, payload):
+        record = encode_record(timestamp, direction, payload)
+        with self.lock:
+            self.records.append(record)
+
+    def close(self):
+        """
+        Stops the background thread after writing everything recorded so far.
+        """
+        self.stopping.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self._flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _run(self):
+        while not self.stopping.wait(self.flush_interval):
+            try:
+                self._flush()
+            except OSError as e:
+                print(f"Failed to write serial capture: {e}")
+
+    def _flush(self):
+        with self.lock:
+            records, self.records = self.records, []
+        if not records:
+            return
+        data = b''.join(records)
+        compressed = gzip.compress(data, compresslevel=6)
+        if self.file is None or self.file.tell() >= self.rotate_bytes:
+            if self.file is not None:
+                self.file.close()
+            path = f"{self.base_path}.{self.file_index:04d}{capture_suffix}"
+            self.file_index += 1
+            self.file = open(path, 'ab')
+        self.file.write(compressed)
+        self.file.flush()
+        self.bytes_captured += len(data)
+        self.bytes_written += len(compressed)
+
+
+class CapturingSerial:
+    """
+    Wraps a serial port and records every chunk read from and written to it.
+
+    Received bytes are collected and stamped once per timestamp_resolution seconds
+    (and before every command), which keeps the per-line cost to a bytes append.
+    Everything else is passed through to the wrapped port. Closing the port
+    does not close the writer.
+    """
+
+    def __init__(self, port, writer, timestamp_resolution=0.005):
+        self.port = port
+        self.writer = writer
+        self.timestamp_resolution = timestamp_resolution
+        self.received = bytearray()
+        self.received_since = None
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def readline(self, *args):
+        return self._tee(self.port.readline(*args))
+
+    def read(self, *args):
+        return self._tee(self.port.read(*args))
+
+    def write(self, data):
+        self._stamp_received(time.time())
+        self.writer.record(time.time(), direction_tx, bytes(data))
+        return self.port.write(data)
+
+    def close(self):
+        self._stamp_received(time.time())
+        self.port.close()
+
+    def _tee(self, data):
+        if data:
+            now = time.time()
+            if self.received_since is None:
+                self.received_since = now
+            self.received += data
+            if now - self.received_since >= self.timestamp_resolution:
+                self._stamp_received(now)
+        return data
+
+    def _stamp_received(self, now):
+        if self.received:
+            self.writer.record(now, direction_rx, bytes(self.received))
+            self.received.clear()
+        self.received_since = None
+
+
+def encode_record(timestamp, direction, payload):
+    return record_header.pack(timestamp, direction, len(payload)) + payload
+
+
+def capture_files(capture):
+    """
+    Returns the files of a capture in order. capture is a file, a directory of
+    capture files, or a rotation base name (<base>.<NNNN>.cap.gz).
+    """
+    if os.path.isdir(capture):
+        return sorted(glob.glob(os.path.join(capture, '*' + capture_suffix)))
+    if os.path.isfile(capture):
+        return [capture]
+    files = sorted(glob.glob(glob.escape(capture) + '.*' + capture_suffix))
+    if not files:
+        raise FileNotFoundError(f"No capture files found for {capture}")
+    return files
+
+
+def read_capture(capture):
+    """
+    Yields (host time, direction, payload) records from all files of a capture.
+    A truncated final record (e.g. after a crash) ends the capture quietly.
+    """
+    for path in capture_files(capture):
+        with gzip.open(path, 'rb') as f:
+            while True:
+                try:
+                    header = f.read(record_header.size)
+                    if len(header) < record_header.size:
+                        break
+                    timestamp, direction, length = record_header.unpack(header)
+                    payload = f.read(length)
+                except (EOFError, OSError):
+                    break  # Unfinished compressed member
+                if len(payload) < length:
+                    break
+                yield timestamp, direction, payload
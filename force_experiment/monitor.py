@@ -0,0 +1,188 @@
+"""
+Live session monitor served over HTTP and WebSocket.
+
+The trial loop publishes an immutable snapshot of the session metrics after
+each step; publishing only swaps a reference and wakes the client threads, so
+the trial loop never waits for clients. A background ThreadingHTTPServer
+serves:
+
+    /          small dashboard that follows the WebSocket stream
+    /metrics   the latest snapshot as JSON
+    /ws        WebSocket pushing every new snapshot as a JSON text frame
+
+Enable it with [monitor] in the experiment config or --monitor-port. Several
+booths can be watched from one machine by binding host to "0.0.0.0" and
+naming each booth.
+"""
+import base64
+import hashlib
+import json
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --------------------------- Configuration ---------------------------
+
+websocket_guid = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+client_wait_timeout = 5.0  # Seconds a client thread waits before re-checking for a closed server
+
+# Every field the dashboard reads, as published before the first trial
+initial_metrics = {'participant': '', 'status': 'starting', 'trial_index': 0, 'total_trials': None, 'quest': {},
+                   'force_sample_rate': 0.0, 'dropped_samples': 0, 'phase_latency': {}}
+
+dashboard_html = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Session monitor</title>
+<style>body{font-family:sans-serif;margin:2em}td,th{padding:2px 10px;text-align:right}</style></head>
+<body><h2 id="title">Session monitor</h2><div id="summary"></div><table id="quest"></table>
+<script>
+const num = (v, digits) => (typeof v === 'number' ? v.toFixed(digits) : '-');
+const show = (m) => {
+  document.getElementById('title').textContent = `${m.booth || 'Session'}: ${m.participant || ''}`;
+  const phases = Object.entries(m.phase_latency || {}).map(([k, v]) => `${k} ${num(1000 * v, 0)} ms`).join(', ');
+  document.getElementById('summary').innerHTML =
+    `Trial ${m.trial_index ?? 0} of ${m.total_trials ?? '?'} (${m.status || ''})<br>` +
+    `Force rate ${num(m.force_sample_rate, 0)} samples/s, dropped ${m.dropped_samples ?? 0}<br>` +
+    `Last trial phases: ${phases}`;
+  document.getElementById('quest').innerHTML = '<tr><th>Staircase</th><th>Trials</th><th>Estimate</th><th>SD</th></tr>' +
+    Object.entries(m.quest || {}).map(([k, q]) =>
+      `<tr><td>${k}</td><td>${q.trials ?? ''}</td><td>${num(q.mean, 2)}</td><td>${num(q.sd, 2)}</td></tr>`).join('');
+};
+const connect = () => {
+  const ws = new WebSocket(`ws://${location.host}/ws`);
+  ws.onmessage = (event) => show(JSON.parse(event.data));
+  ws.onclose = () => setTimeout(connect, 2000);
+};
+connect();
+</script></body></html>
+"""
+
+# --------------------------- Functions ---------------------------
+
+
+class SessionMonitor:
+    """
+    Holds the latest metrics snapshot and serves it to monitoring clients.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, booth=''):
+        self.host = host
+        self.port = port
+        self.booth = booth
+        self.condition = threading.Condition()
+        self.snapshot = dict(initial_metrics, booth=booth, published=time.time())
+        self.encoded = json.dumps(self.snapshot).encode()
+        self.version = 0
+        self.server = None
+        self.thread = None
+
+    def publish(self, **metrics):
+        """
+        Replaces the snapshot with the given metrics. Never blocks on clients.
+        """
+        snapshot = dict(metrics, booth=self.booth, published=time.time())
+        encoded = json.dumps(snapshot).encode()
+        with self.condition:
+            self.snapshot, self.encoded = snapshot, encoded
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait_for_update(self, version, timeout=client_wait_timeout):
+        """
+        Waits until a snapshot newer than version exists. Returns (version, encoded snapshot).
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version or self.server is None, timeout)
+            return self.version, self.encoded
+
+    def start(self):
+        """
+        Starts serving in a daemon thread. Returns the bound (host, port).
+        """
+        monitor = self
+
+        class Handler(MonitorRequestHandler):
+            pass
+
+        Handler.monitor = monitor
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='session-monitor', daemon=True)
+        self.thread.start()
+        print(f"Session monitor at http://{self.host}:{self.port}/")
+        return self.host, self.port
+
+    def stop(self):
+        if self.server is None:
+            return
+        server, self.server = self.server, None
+        with self.condition:
+            self.condition.notify_all()
+        server.shutdown()
+        server.server_close()
+
+
+class MonitorRequestHandler(BaseHTTPRequestHandler):
+    monitor = None
+
+    def log_message(self, format, *args):
+        pass  # Keep the experiment console free of request logs
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')  # Allow a dashboard watching several booths
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            with self.monitor.condition:
+                body = self.monitor.encoded
+            self.send_body(body, 'application/json')
+        elif self.path == '/ws' and self.headers.get('Upgrade', '').lower() == 'websocket':
+            self.stream_websocket()
+        elif self.path in ('/', '/index.html'):
+            self.send_body(dashboard_html.encode(), 'text/html; charset=utf-8')
+        else:
+            self.send_error(404)
+
+    def stream_websocket(self):
+        """
+        Completes the WebSocket handshake and pushes each new snapshot until the client goes away.
+        """
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        accept = base64.b64encode(hashlib.sha1((key + websocket_guid).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = True
+
+        version = -1
+        try:
+            while self.monitor.server is not None:
+                new_version, encoded = self.monitor.wait_for_update(version)
+                if new_version != version:
+                    self.wfile.write(websocket_frame(encoded))
+                    self.wfile.flush()
+                    version = new_version
+        except OSError:
+            pass  # Client disconnected
+
+
+def websocket_frame(payload, opcode=0x1):
+    """
+    Encodes an unmasked server-to-client WebSocket frame (text by default).
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 2 ** 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
@@ -0,0 +1,226 @@
+"""
+Real-time mode: fewer random stalls of the trial loop during tap windows.
+
+Enabled with [realtime] in the experiment config. After setup the session
+freezes every object allocated so far out of the garbage collector
+(gc.freeze()), pins the trial loop's thread to a dedicated core (the
+background workers keep the other cores), and raises its scheduling
+priority where the OS permits it (SCHED_FIFO or a lower nice value on Linux,
+HIGH_PRIORITY_CLASS through psutil elsewhere). On Linux the raised priority
+is set with SCHED_RESET_ON_FORK, so worker threads and child processes
+started from the trial loop run at normal priority; the worker threads also
+reset it themselves (release_thread). During tap windows the collector is
+off; it runs between trials instead. exit() restores the original affinity,
+scheduling policy and nice value.
+
+Scheduling jitter is measured with a 1 kHz sleep loop before and after the
+mode is entered, so the gain is printed at the start of every session.
+"""
+import contextlib
+import gc
+import os
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # Only needed for affinity and priority outside Linux
+    psutil = None
+
+# --------------------------- Configuration ---------------------------
+
+probe_period = 0.001  # Seconds between wake-ups of the jitter probe
+probe_garbage = 20  # Small reference cycles allocated per wake-up, like per-line parsing
+
+# --------------------------- Functions ---------------------------
+
+
+def measure_jitter(duration=1.0, period=probe_period):
+    """
+    Sleeps in steps of period for duration seconds, allocating a little garbage
+    on every wake-up, and returns how late the wake-ups were: a dictionary of
+    the mean, 99th percentile and maximum lateness in milliseconds.
+    """
+    lateness = []
+    start = time.perf_counter()
+    target = start
+    while target - start < duration:
+        target += period
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        lateness.append(time.perf_counter() - target)
+        for _ in range(probe_garbage):
+            cycle = {}
+            cycle['self'] = cycle
+    lateness.sort()
+    return {'mean_ms': 1000 * sum(lateness) / len(lateness),
+            'p99_ms': 1000 * lateness[int(0.99 * (len(lateness) - 1))],
+            'max_ms': 1000 * lateness[-1]}
+
+
+def format_jitter(jitter):
+    return f"mean {jitter['mean_ms']:.3f} ms, p99 {jitter['p99_ms']:.3f} ms, max {jitter['max_ms']:.3f} ms"
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    if psutil is not None:
+        return sorted(psutil.Process().cpu_affinity())
+    return list(range(os.cpu_count() or 1))
+
+
+class RealtimeMode:
+    """
+    Switches the calling (trial loop) thread into real-time mode and back.
+
+    cpu is the dedicated core (-1: the last available one); priority is the
+    SCHED_FIFO priority tried on Linux (0 leaves the scheduling alone).
+    """
+
+    def __init__(self, cpu=-1, priority=10):
+        cpus = available_cpus()
+        self.cpu = cpus[cpu] if -len(cpus) <= cpu < len(cpus) else None
+        self.other_cpus = [other for other in cpus if other != self.cpu]
+        self.priority = priority
+        self.active = False
+        self.thread_id = None
+        self.notes = []  # What could and could not be changed, for the session log
+        self.gc_was_enabled = gc.isenabled()
+        self.saved_priority = None  # Scheduling of the thread before enter(), restored by exit()
+
+    def enter(self):
+        """
+        Freezes the current heap, pins the calling thread and raises its priority.
+        """
+        gc.collect()
+        gc.freeze()
+        self.thread_id = threading.get_native_id()
+        self._pin()
+        self._raise_priority()
+        self.active = True
+        return self
+
+    def exit(self):
+        """
+        Re-enables normal garbage collection, unpins the thread and restores its priority.
+        """
+        if not self.active:
+            return
+        if self.gc_was_enabled:
+            gc.enable()
+        gc.unfreeze()
+        if self.other_cpus and hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(self.thread_id, [self.cpu] + self.other_cpus)
+            except OSError:
+                pass
+        self._restore_priority(self.thread_id)
+        self.active = False
+
+    @contextlib.contextmanager
+    def tap_window(self):
+        """
+        Keeps the garbage collector off for the duration of a tap window.
+        """
+        if not self.active:
+            yield
+            return
+        gc.disable()
+        try:
+            yield
+        finally:
+            if self.gc_was_enabled:
+                gc.enable()
+
+    def between_trials(self):
+        """
+        Collects garbage while no tap window is open.
+        """
+        if self.active:
+            gc.collect()
+
+    def release_thread(self):
+        """
+        Moves the calling thread off the dedicated core and back to the original
+        priority (initializer for worker threads).
+        """
+        if not self.active:
+            return
+        if self.other_cpus and hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(threading.get_native_id(), self.other_cpus)
+            except OSError:
+                pass
+        self._restore_priority(threading.get_native_id())
+
+    def _pin(self):
+        if self.cpu is None or not self.other_cpus:
+            self.notes.append("not pinned (only one core available)")
+            return
+        try:
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(self.thread_id, [self.cpu])  # The trial loop thread only
+            elif psutil is not None:
+                psutil.Process().cpu_affinity([self.cpu])  # Whole process
+            else:
+                self.notes.append("not pinned (install psutil)")
+                return
+            self.notes.append(f"pinned to CPU {self.cpu}")
+        except (OSError, AttributeError) as e:
+            self.notes.append(f"not pinned ({e})")
+
+    def _raise_priority(self):
+        if not self.priority:
+            return
+        if hasattr(os, 'sched_setscheduler'):
+            self.saved_priority = (os.sched_getscheduler(self.thread_id), os.sched_getparam(self.thread_id),
+                                   os.getpriority(os.PRIO_PROCESS, self.thread_id))
+            reset_on_fork = getattr(os, 'SCHED_RESET_ON_FORK', 0)
+            try:
+                os.sched_setscheduler(self.thread_id, os.SCHED_FIFO | reset_on_fork, os.sched_param(self.priority))
+                self.notes.append(f"SCHED_FIFO priority {self.priority}")
+                return
+            except (OSError, AttributeError):
+                pass
+            try:
+                if reset_on_fork:  # Children and threads start again from nice 0
+                    os.sched_setscheduler(self.thread_id, os.SCHED_OTHER | reset_on_fork, os.sched_param(0))
+                os.setpriority(os.PRIO_PROCESS, self.thread_id, -10)
+                self.notes.append("nice -10")
+            except OSError:
+                self.notes.append("normal priority (no permission to raise it)")
+        elif psutil is not None:
+            try:
+                process = psutil.Process()
+                self.saved_priority = process.nice()
+                process.nice(psutil.HIGH_PRIORITY_CLASS)
+                self.notes.append("high priority class")
+            except (psutil.Error, AttributeError) as e:
+                self.notes.append(f"normal priority ({e})")
+        else:
+            self.notes.append("normal priority (install psutil)")
+
+    def _restore_priority(self, thread_id):
+        """
+        Puts a thread back to the scheduling policy and nice value saved by enter().
+        """
+        if self.saved_priority is None:
+            return
+        if not hasattr(os, 'sched_setscheduler'):
+            if thread_id == self.thread_id:  # The priority class is per process
+                try:
+                    psutil.Process().nice(self.saved_priority)
+                except (psutil.Error, AttributeError):
+                    pass
+            return
+        policy, param, nice = self.saved_priority
+        try:
+            os.sched_setscheduler(thread_id, policy, param)
+        except OSError:
+            pass
+        try:
+            os.setpriority(os.PRIO_PROCESS, thread_id, nice)
+        except OSError:
+            pass
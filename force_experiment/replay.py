@@ -0,0 +1,326 @@
+"""
+Offline replay of recorded sessions through the acquisition pipeline.
+
+A raw serial capture (see capture.py) is fed back through a pyserial-like port
+(ReplaySerial) into an ExperimentSession, and every recorded tap command is
+measured by the session's own tap strategy (peak or trace) and written with
+the tap CSV writer. Playback runs at the recorded pace (--speed 1), N times
+faster (--speed N) or as fast as possible (--speed max), where the session's
+clock and sleeps follow the recorded host clock (ReplayClock), so the derived
+data does not depend on the replay speed. This regenerates MaxForce or full
+force windows for old sessions in bulk, and lets parser or strategy changes be
+checked and timed against real recordings:
+
+    python -m force_experiment.replay captures/p01 captures/p02 --measure peak --output-dir rederived
+"""
+import argparse
+import collections
+import contextlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from experiment_config import load_config
+from force_buffer import ForceWindow
+from servo_intensity import parse_tap_command
+from .capture import direction_rx, direction_tx, read_capture
+from .session import ExperimentSession
+from .storage import write_tap_rows
+from .tap_strategies import make_tap_strategy
+
+# --------------------------- Configuration ---------------------------
+
+replay_measurements = ('peak', 'trace')  # Tap strategies a replay can rederive
+
+# --------------------------- Functions ---------------------------
+
+
+class ReplaySerial:
+    """
+    Stand-in for serial.Serial that plays back the received bytes of a capture.
+
+    speed is the playback rate relative to the recording (None plays as fast as
+    possible). Commands written during replay are collected in written; the
+    commands sent in the recorded session are available through pop_commands().
+    reset_input_buffer() is a no-op: a capture only holds bytes the host read.
+    """
+
+    def __init__(self, capture, speed=1.0, timeout=1):
+        self.records = read_capture(capture)
+        self._next_record = None  # Record read from the capture but not yet due
+        self.speed = speed
+        self.timeout = timeout
+        self.is_open = True
+        self.exhausted = False
+
+        self.pending = bytearray()  # Received bytes not yet read
+        self.chunks = collections.deque()  # (absolute end offset, host time) of pending chunks
+        self.consumed = 0  # Absolute offset of the first pending byte
+        self.commands = collections.deque()  # (host time, command text) of recorded commands
+        self.written = []
+        self.last_timestamp = None  # Recorded host time of the last line read
+        self._previous_chunk_time = None
+        self.first_timestamp = None
+        self.start_time = None
+        self.bytes_replayed = 0
+        self.lines_read = 0
+
+    # ---- pyserial compatible interface ----
+
+    @property
+    def in_waiting(self):
+        self._advance(block=False)
+        return len(self.pending)
+
+    def readline(self):
+        deadline = time.time() + (self.timeout if self.timeout is not None else 1e9)
+        while True:
+            end = self.pending.find(b'\n')
+            if end >= 0:
+                return self._take(end + 1)
+            if self.exhausted:
+                if self.pending:
+                    return self._take(len(self.pending))
+                time.sleep(max(0.0, deadline - time.time()))  # Nothing more will arrive: time out like a port
+                return b''
+            if not self._advance(block=True, deadline=deadline):
+                return b''
+
+    def read(self, size=1):
+        deadline = time.time() + (self.timeout if self.timeout is not None else 1e9)
+        while len(self.pending) < size and not self.exhausted:
+            if not self._advance(block=True, deadline=deadline):
+                break
+        if not self.pending and self.exhausted:
+            time.sleep(max(0.0, deadline - time.time()))  # Nothing more will arrive: time out like a port
+        return self._take(min(size, len(self.pending)))
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def flushInput(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    # ---- playback ----
+
+    def pop_commands(self, until=None):
+        """
+        Returns the recorded commands sent up to host time until (default: all read so far).
+        """
+        popped = []
+        while self.commands and (until is None or self.commands[0][0] <= until):
+            popped.append(self.commands.popleft())
+        return popped
+
+    def _take(self, size):
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        self.consumed += size
+        while self.chunks and self.chunks[0][0] < self.consumed:
+            self.chunks.popleft()
+        if data:
+            # Host time of the chunk that held the last byte taken
+            self.last_timestamp = self.chunks[0][1] if self.chunks else self._previous_chunk_time
+            self.lines_read += data.count(b'\n')
+        return data
+
+    def peek(self):
+        """
+        Returns the next (host time, direction, payload) record without playing it, or None at the end.
+        """
+        if self._next_record is None:
+            self._next_record = next(self.records, None)
+        return self._next_record
+
+    def _advance(self, block, deadline=None):
+        """
+        Moves the next capture record into the buffer once it is due.
+        Returns False if nothing was added (end of capture or timeout).
+        """
+        record = self.peek()
+        if record is None:
+            self.exhausted = True
+            return False
+        timestamp, direction, payload = record
+
+        if self.first_timestamp is None:
+            self.first_timestamp, self.start_time = timestamp, time.time()
+        if self.speed:
+            due = self.start_time + (timestamp - self.first_timestamp) / self.speed
+            wait = due - time.time()
+            if wait > 0:
+                if not block:
+                    return False
+                if deadline is not None and due > deadline:
+                    time.sleep(max(0.0, deadline - time.time()))
+                    return False
+                time.sleep(wait)
+
+        self._next_record = None
+        if direction == direction_tx:
+            for command in payload.decode('utf-8', errors='replace').splitlines():
+                if command.strip():
+                    self.commands.append((timestamp, command.strip()))
+        elif direction == direction_rx and payload:
+            self.pending.extend(payload)
+            self.chunks.append((self.consumed + len(self.pending), timestamp))
+            self._previous_chunk_time = timestamp
+            self.bytes_replayed += len(payload)
+        return True
+
+
+class ReplayClock:
+    """
+    The recorded host clock, starting at start and running speed times faster
+    than real time. While installed it replaces time.time and time.sleep, like
+    the soak harness's virtual clock; with speed None sleeping advances it at
+    once. A ReplaySerial playing at speed 1 on it delivers each record as the
+    clock reaches the record's host time, so the session's tap windows cover
+    the samples they covered when recorded, whatever the replay speed.
+    """
+
+    def __init__(self, start, speed=None):
+        self.now = start
+        self.speed = speed
+        self._real_time, self._real_sleep = time.time, time.sleep
+        self._real_start = None
+
+    def time(self):
+        if self.speed is not None:
+            return self.now + (self._real_time() - self._real_start) * self.speed
+        return self.now
+
+    def sleep(self, seconds):
+        if self.speed is not None:
+            self._real_sleep(max(0.0, seconds) / self.speed)
+        else:
+            self.now += max(0.0, seconds)
+
+    @contextlib.contextmanager
+    def installed(self):
+        self._real_start = self._real_time()
+        time.time, time.sleep = self.time, self.sleep
+        try:
+            yield self
+        finally:
+            time.time, time.sleep = self._real_time, self._real_sleep
+
+
+def _number(text):
+    try:
+        value = float(text)
+        return int(value) if value.is_integer() else value
+    except ValueError:
+        return text
+
+
+def replay_capture(capture, output_csv=None, measurement='peak', speed=None, config=None):
+    """
+    Replays one capture into an ExperimentSession and measures each recorded tap with
+    the session's tap strategy, writing the tap rows to output_csv (replaced, if it exists).
+    Returns a summary dictionary with counts and the replay throughput.
+    """
+    config = config or load_config()
+    strategy = make_tap_strategy(measurement)
+    port = ReplaySerial(capture, speed=1.0)  # On the recorded clock below
+    session = ExperimentSession(config, os.path.basename(os.path.normpath(capture)).split('.')[0], strategy)
+    session.attach_serial(port, configure=False)  # The recorded session configured the device
+    if output_csv and os.path.isfile(output_csv):
+        os.remove(output_csv)
+
+    first_record = port.peek()
+    clock = ReplayClock(first_record[0] if first_record is not None else 0.0, speed)
+    taps = 0
+    start = time.perf_counter()
+    with clock.installed():
+        while True:
+            for timestamp, command in port.pop_commands():
+                row = _measure_tap(session, timestamp, command)
+                if row is None:
+                    continue
+                taps += 1
+                if output_csv:
+                    write_tap_rows(output_csv, [row], strategy.measurement_column)
+                if isinstance(row[-1], ForceWindow):
+                    row[-1].release()
+            if port.exhausted and not port.pending and not port.commands:
+                break
+            session.stream_decoder.feed(port.read(max(1, port.in_waiting)))  # Between the tap windows
+    elapsed = time.perf_counter() - start
+
+    recorded = (port.last_timestamp - port.first_timestamp) if port.first_timestamp is not None else 0.0
+    return {'capture': capture, 'output': output_csv, 'taps': taps, 'lines': port.lines_read,
+            'bytes': port.bytes_replayed, 'dropped': session.dropped_samples, 'seconds': elapsed,
+            'lines_per_s': port.lines_read / elapsed if elapsed else 0.0,
+            'speedup': recorded / elapsed if elapsed else 0.0}
+
+
+def _measure_tap(session, timestamp, command):
+    """
+    Measures one recorded tap command as TapStrategy.send_taps() does after sending it.
+    Returns the tap row, or None if command is not a tap.
+    """
+    parsed = parse_tap_command(command)
+    if parsed is None:
+        return None
+    tap_digit, condition, fixed_intensity, variable_intensity = parsed
+    if tap_digit == '0':
+        session.trial_number += 1
+    tap_type, intensity = ('Fixed', fixed_intensity) if tap_digit == '0' else ('Variable', variable_intensity)
+    with session.tap_window():
+        measurement = session.tap_strategy.measure(session)
+    return [session.trial_number, int(condition), tap_type, _number(intensity), timestamp, measurement]
+
+
+def _replay_job(job):
+    capture, output_csv, measurement, speed, config_path = job
+    return replay_capture(capture, output_csv, measurement, speed, load_config(config_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded serial captures through the acquisition pipeline.")
+    parser.add_argument('captures', nargs='+', help="Capture files, directories or rotation base names")
+    parser.add_argument('--speed', default='max', help="Playback speed: 1 (recorded pace), N, or max")
+    parser.add_argument('--measure', choices=replay_measurements, default='peak',
+                        help="Tap strategy that measures the replayed taps")
+    parser.add_argument('--output-dir', default=None, help="Where to write the regenerated tap CSVs")
+    parser.add_argument('--config', default=None, help="Experiment config with the window durations")
+    parser.add_argument('--workers', type=int, default=1, help="Parallel replays (only with --speed max)")
+    args = parser.parse_args()
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    jobs = []
+    for capture in args.captures:
+        output_csv = None
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            name = os.path.basename(os.path.normpath(capture)).split('.')[0]
+            output_csv = os.path.join(args.output_dir, f"{name}_tap_timestamps_force_data.csv")
+        jobs.append((capture, output_csv, args.measure, speed, args.config))
+
+    if speed is None and args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            summaries = list(pool.map(_replay_job, jobs))
+    else:
+        summaries = [_replay_job(job) for job in jobs]
+
+    for summary in summaries:
+        print(f"{summary['capture']}: {summary['taps']} taps from {summary['lines']} lines "
+              f"({summary['lines_per_s']:.0f} lines/s, {summary['speedup']:.1f}x recorded pace)"
+              + (f" -> {summary['output']}" if summary['output'] else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
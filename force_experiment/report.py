@@ -0,0 +1,437 @@
+"""
+Post-session HTML reports, built in a background worker process.
+
+When a session's last trial ends, the session queues a report job (a small
+JSON file in the report queue directory) and makes sure a report worker is
+running; the next participant can start at once. The worker is a separate,
+low-priority process that builds the queued reports in order and waits a
+while for more before it exits, so back-to-back sessions share one worker.
+
+A report is one self-contained HTML file with inline SVG plots:
+
+    - the staircase of every condition and set, with its threshold estimate
+    - the psychometric fit of every staircase (psychometric_fit.py)
+    - force QA: peak force against the commanded intensity and the samples
+      of every tap window
+
+Trial and tap files are parsed through the cohort cache of
+aggregate_sessions.py (.cohort_cache in the working directory), so a later
+cohort aggregation finds them already parsed. Reports can also be built by hand:
+
+    python -m force_experiment.report build data/participant_x_20241004-153707.csv \
+        --taps data/x_tap_timestamps_force_data.csv --output x.html
+    python -m force_experiment.report worker data/reports/queue
+"""
+import argparse
+import contextlib
+import glob
+import html
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy
+
+from aggregate_sessions import _concatenate, cache_directory_name, update_cache
+from psychometric_fit import fit_groups, group_trials, infer_set_numbers, negative_responses, positive_responses
+
+# --------------------------- Configuration ---------------------------
+
+queue_directory_name = "queue"
+job_suffix = ".json"
+failed_suffix = ".failed"
+lock_name = "worker.lock"
+
+worker_idle_timeout = 120.0  # Seconds the worker waits for the next session's job before it exits
+worker_poll_interval = 1.0
+stale_lock_age = 600.0  # A lock not touched for this long belongs to a worker that died
+
+plot_width, plot_height = 520, 240
+plot_margin = (48, 16, 16, 36)  # Left, right, top, bottom
+fixed_color, variable_color = '#1f77b4', '#d62728'
+positive_color, negative_color, other_color = '#2ca02c', '#d62728', '#7f7f7f'
+
+style = """
+body { font-family: sans-serif; margin: 2em; color: #222; }
+h1 { font-size: 1.4em; } h2 { font-size: 1.15em; margin-top: 2em; }
+table { border-collapse: collapse; margin: 0.5em 0; }
+th, td { border: 1px solid #ccc; padding: 3px 8px; text-align: right; }
+th { background: #f3f3f3; }
+.plots { display: flex; flex-wrap: wrap; gap: 12px; }
+figure { margin: 0; } figcaption { font-size: 0.9em; text-align: center; }
+.warning { color: #b00; }
+svg text { font-size: 10px; font-family: sans-serif; }
+"""
+
+# --------------------------- Plots ---------------------------
+
+
+def _ticks(low, high, count=5):
+    return numpy.linspace(low, high, count)
+
+
+def svg_plot(series, x_label='', y_label='', horizontal_lines=(), width=plot_width, height=plot_height):
+    """
+    Returns an inline SVG plot. series is a list of dictionaries with x, y, color
+    (one for the series or one per point), style ('line', 'points' or 'both') and
+    optionally line_color; horizontal_lines is a list of (y, color).
+    """
+    xs = numpy.concatenate([numpy.asarray(s['x'], dtype=float) for s in series] + [numpy.empty(0)])
+    ys = numpy.concatenate([numpy.asarray(s['y'], dtype=float) for s in series] +
+                           [numpy.array([y for y, color in horizontal_lines], dtype=float)])
+    xs, ys = xs[numpy.isfinite(xs)], ys[numpy.isfinite(ys)]
+    x_low, x_high = (xs.min(), xs.max()) if xs.size else (0.0, 1.0)
+    y_low, y_high = (ys.min(), ys.max()) if ys.size else (0.0, 1.0)
+    if x_high == x_low:
+        x_low, x_high = x_low - 1, x_high + 1
+    if y_high == y_low:
+        y_low, y_high = y_low - 1, y_high + 1
+    y_pad = 0.05 * (y_high - y_low)
+    y_low, y_high = y_low - y_pad, y_high + y_pad
+
+    left, right, top, bottom = plot_margin
+    inner_width, inner_height = width - left - right, height - top - bottom
+
+    def px(x):
+        return left + (numpy.asarray(x, dtype=float) - x_low) / (x_high - x_low) * inner_width
+
+    def py(y):
+        return top + (y_high - numpy.asarray(y, dtype=float)) / (y_high - y_low) * inner_height
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">',
+             f'<rect x="{left}" y="{top}" width="{inner_width}" height="{inner_height}" fill="none" stroke="#999"/>']
+    for tick in _ticks(x_low, x_high):
+        parts.append(f'<text x="{px(tick):.1f}" y="{top + inner_height + 12}" text-anchor="middle">{tick:.3g}</text>')
+    for tick in _ticks(y_low, y_high):
+        parts.append(f'<line x1="{left}" x2="{left + inner_width}" y1="{py(tick):.1f}" y2="{py(tick):.1f}" '
+                     f'stroke="#eee"/>')
+        parts.append(f'<text x="{left - 4}" y="{py(tick) + 3:.1f}" text-anchor="end">{tick:.3g}</text>')
+    parts.append(f'<text x="{left + inner_width / 2}" y="{height - 4}" text-anchor="middle">'
+                 f'{html.escape(x_label)}</text>')
+    parts.append(f'<text x="12" y="{top + inner_height / 2}" text-anchor="middle" '
+                 f'transform="rotate(-90 12 {top + inner_height / 2})">{html.escape(y_label)}</text>')
+    for y, color in horizontal_lines:
+        if numpy.isfinite(y):
+            parts.append(f'<line x1="{left}" x2="{left + inner_width}" y1="{py(y):.1f}" y2="{py(y):.1f}" '
+                         f'stroke="{color}" stroke-dasharray="4 3"/>')
+
+    for s in series:
+        x, y = numpy.asarray(s['x'], dtype=float), numpy.asarray(s['y'], dtype=float)
+        colors = numpy.broadcast_to(numpy.asarray(s['color']), x.shape)
+        finite = numpy.isfinite(x) & numpy.isfinite(y)
+        x, y, colors = px(x[finite]), py(y[finite]), colors[finite]
+        if s.get('style', 'line') in ('line', 'both') and x.size > 1:
+            points = " ".join(f"{a:.1f},{b:.1f}" for a, b in zip(x, y))
+            line_color = s.get('line_color', colors[0])
+            parts.append(f'<polyline points="{points}" fill="none" stroke="{line_color}" stroke-width="1.2"/>')
+        if s.get('style', 'line') in ('points', 'both'):
+            parts.extend(f'<circle cx="{a:.1f}" cy="{b:.1f}" r="2.5" fill="{color}"/>'
+                         for a, b, color in zip(x, y, colors))
+    parts.append('</svg>')
+    return "".join(parts)
+
+
+def _figure(svg, caption):
+    return f'<figure>{svg}<figcaption>{html.escape(caption)}</figcaption></figure>'
+
+
+def _table(header, rows):
+    head = "".join(f"<th>{html.escape(str(name))}</th>" for name in header)
+    body = "".join("<tr>" + "".join(f"<td>{html.escape(str(value))}</td>" for value in row) + "</tr>"
+                   for row in rows)
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+def _format(value, digits=2):
+    return "" if value is None or not numpy.isfinite(value) else f"{value:.{digits}f}"
+
+
+# --------------------------- Report ---------------------------
+
+
+def load_session(trial_csv, tap_csv=None, cache_directory=None):
+    """
+    Parses a session's trial CSV and the participant's tap CSV through the cohort cache.
+    Returns (trials, taps): dictionaries of column arrays, the taps limited to the
+    last session in the tap file (empty if there is none).
+    """
+    cache_directory = cache_directory or os.path.join(os.getcwd(), cache_directory_name)
+    files = [('trials', os.path.abspath(trial_csv))]
+    if tap_csv and os.path.isfile(tap_csv):
+        files.append(('taps', os.path.abspath(tap_csv)))
+    manifest = update_cache(files, cache_directory, workers=1, prune=False)
+
+    entries = {kind: manifest['files'].get(path) for kind, path in files}
+    trials = _concatenate([entries['trials']['cache']]) if entries.get('trials') else {}
+    taps = _concatenate([entries['taps']['cache']]) if entries.get('taps') else {}
+    if taps:
+        last_session = taps['session_index'] == taps['session_index'].max()
+        taps = {name: values[last_session] for name, values in taps.items()}
+    return trials, taps
+
+
+def staircase_section(trials, fit_by_key):
+    """
+    Returns the HTML of one staircase plot per condition and set.
+    """
+    data = dict(trials, session_index=numpy.zeros(trials['participant'].size, dtype=int))
+    sets = infer_set_numbers(data)
+    response = trials['response'].astype(str)
+    colors = numpy.where(numpy.isin(response, positive_responses), positive_color,
+                         numpy.where(numpy.isin(response, negative_responses), negative_color, other_color))
+    figures = []
+    for condition, set_number in sorted(set(zip(trials['condition'].tolist(), sets.tolist()))):
+        rows = numpy.flatnonzero((trials['condition'] == condition) & (sets == set_number))
+        rows = rows[numpy.argsort(trials['specific_trial'][rows], kind='stable')]
+        levels = trials['reference_level'][rows].astype(float)
+        if not numpy.isfinite(levels).any():
+            continue
+        fit = fit_by_key.get((condition, set_number))
+        lines = [(fit['posterior_threshold'], '#555')] if fit else []
+        svg = svg_plot([{'x': trials['specific_trial'][rows], 'y': levels, 'color': colors[rows],
+                         'line_color': '#999', 'style': 'both'}],
+                       x_label="Trial in staircase", y_label="Reference level", horizontal_lines=lines)
+        caption = f"Condition {condition}, set {set_number}"
+        if fit:
+            caption += f": threshold {fit['posterior_threshold']:.2f} ± {fit['posterior_threshold_sd']:.2f}"
+        figures.append(_figure(svg, caption))
+    legend = (f'<p>Responses: <span style="color:{positive_color}">second stronger</span>, '
+              f'<span style="color:{negative_color}">first stronger</span>, '
+              f'<span style="color:{other_color}">none</span>; dashed: posterior threshold.</p>')
+    return "<h2>Staircases</h2>" + legend + f'<div class="plots">{"".join(figures)}</div>'
+
+
+def fit_staircases(trials, function='weibull'):
+    """
+    Fits every staircase of the session. Returns (table rows, {(condition, set): fit}).
+    """
+    data = dict(trials, session_index=numpy.zeros(trials['participant'].size, dtype=int))
+    group_keys, levels, positives, totals = group_trials(data)
+    if not group_keys.size:
+        return [], {}
+    fit = fit_groups(levels, positives, totals, function)
+    rows, fit_by_key = [], {}
+    for index, key in enumerate(group_keys):
+        values = {name: float(fit[name][index]) for name in fit}
+        fit_by_key[(int(key['condition']), int(key['set']))] = values
+        rows.append([int(key['condition']), int(key['set']), int(totals[index].sum()),
+                     _format(values['threshold']), _format(values['slope']),
+                     _format(values['posterior_threshold']), _format(values['posterior_threshold_sd'])])
+    return rows, fit_by_key
+
+
+def force_section(taps):
+    """
+    Returns the HTML of the force QA: summary, peak force against intensity, samples per tap.
+    """
+    if not taps or not taps['trial'].size:
+        return "<h2>Force QA</h2><p>No tap force data recorded for this session.</p>"
+    tap_type = taps['tap_type'].astype(str)
+    samples = taps['samples'].astype(int)
+    peaks = taps['peak'].astype(float)
+    empty = int((samples == 0).sum())
+    rows = []
+    for name in ('Fixed', 'Variable'):
+        mask = tap_type == name
+        if not mask.any():
+            continue
+        valid = numpy.isfinite(peaks[mask])
+        correlation = numpy.nan
+        if valid.sum() > 2 and numpy.ptp(taps['intensity'][mask][valid]) > 0:
+            correlation = numpy.corrcoef(taps['intensity'][mask][valid], peaks[mask][valid])[0, 1]
+        rows.append([name, int(mask.sum()), int((samples[mask] == 0).sum()),
+                     _format(numpy.median(samples[mask]), 0),
+                     _format(numpy.nanmin(peaks[mask]) if valid.any() else numpy.nan, 1),
+                     _format(numpy.nanmax(peaks[mask]) if valid.any() else numpy.nan, 1),
+                     _format(correlation)])
+    summary = _table(['Tap', 'Taps', 'Without samples', 'Median samples', 'Min peak', 'Max peak',
+                      'Intensity-peak r'], rows)
+    warning = (f'<p class="warning">{empty} tap windows have no force samples.</p>' if empty else "")
+
+    colors = numpy.where(tap_type == 'Fixed', fixed_color, variable_color)
+    scatter = svg_plot([{'x': taps['intensity'], 'y': peaks, 'color': colors, 'style': 'points'}],
+                       x_label="Commanded intensity", y_label="Peak force")
+    order = numpy.arange(samples.size)
+    counts = svg_plot([{'x': order[tap_type == name], 'y': samples[tap_type == name], 'color': color,
+                        'style': 'line'} for name, color in (('Fixed', fixed_color), ('Variable', variable_color))],
+                      x_label="Tap", y_label="Samples in window")
+    legend = (f'<p><span style="color:{fixed_color}">fixed</span> and '
+              f'<span style="color:{variable_color}">variable</span> taps.</p>')
+    return ("<h2>Force QA</h2>" + summary + warning + legend + '<div class="plots">' +
+            _figure(scatter, "Peak force against commanded intensity") +
+            _figure(counts, "Force samples per tap window") + "</div>")
+
+
+def build_report(trial_csv, output_path, tap_csv=None, cache_directory=None, function='weibull'):
+    """
+    Writes the HTML report of one session. Returns the output path.
+    """
+    start = time.perf_counter()
+    trials, taps = load_session(trial_csv, tap_csv, cache_directory)
+    if not trials:
+        raise ValueError(f"No trials in {trial_csv}")
+    participant = str(trials['participant'][0])
+    response = trials['response'].astype(str)
+    durations = trials['trial_duration'].astype(float)
+    fit_rows, fit_by_key = fit_staircases(trials, function)
+
+    overview = _table(['Participant', 'Trials', 'Answered', 'Errors', 'Mean trial (s)', 'Session (min)'],
+                      [[participant, response.size,
+                        int(numpy.isin(response, positive_responses + negative_responses).sum()),
+                        int((response == 'Error').sum()), _format(numpy.nanmean(durations), 1),
+                        _format(numpy.nansum(durations) / 60, 1)]])
+    thresholds = _table(['Condition', 'Set', 'Trials', 'Threshold', 'Slope', 'Posterior threshold',
+                         'Posterior SD'], fit_rows) if fit_rows else "<p>No answered trials to fit.</p>"
+
+    document = (f"<!DOCTYPE html><html><head><meta charset='utf-8'>"
+                f"<title>Session report: {html.escape(participant)}</title><style>{style}</style></head><body>"
+                f"<h1>Session report: {html.escape(participant)}</h1>"
+                f"<p>{html.escape(os.path.basename(trial_csv))}, generated {time.strftime('%Y-%m-%d %H:%M:%S')}"
+                f" ({function} fit)</p>" + overview +
+                "<h2>Threshold estimates</h2>" + thresholds +
+                staircase_section(trials, fit_by_key) + force_section(taps) +
+                f"<p>Built in {time.perf_counter() - start:.2f} s.</p></body></html>")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    temporary_path = output_path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        f.write(document)
+    os.replace(temporary_path, output_path)
+    return output_path
+
+
+# --------------------------- Worker ---------------------------
+
+
+def _acquire_lock(lock_path):
+    """
+    Creates the worker lock. Returns False if another live worker holds it.
+    """
+    try:
+        if time.time() - os.path.getmtime(lock_path) > stale_lock_age:
+            os.remove(lock_path)
+    except OSError:
+        pass
+    try:
+        descriptor = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.write(descriptor, str(os.getpid()).encode())
+    os.close(descriptor)
+    return True
+
+
+def _pending_jobs(queue_directory):
+    return sorted(glob.glob(os.path.join(queue_directory, '*' + job_suffix)))
+
+
+def run_job(job_path):
+    with open(job_path) as f:
+        job = json.load(f)
+    return build_report(job['trial_csv'], job['output'], job.get('tap_csv'), job.get('cache_directory'),
+                        job.get('function', 'weibull'))
+
+
+def serve(queue_directory, idle_timeout=worker_idle_timeout):
+    """
+    Builds queued reports in order until the queue has been empty for idle_timeout
+    seconds. Returns at once if another worker is serving the queue.
+    """
+    lock_path = os.path.join(queue_directory, lock_name)
+    while _acquire_lock(lock_path):
+        try:
+            idle_since = time.time()
+            while time.time() - idle_since < idle_timeout:
+                jobs = _pending_jobs(queue_directory)
+                if not jobs:
+                    time.sleep(worker_poll_interval)
+                    continue
+                for job_path in jobs:
+                    try:
+                        output = run_job(job_path)
+                        os.remove(job_path)
+                        print(f"Report written to {output}")
+                    except Exception as e:
+                        print(f"Failed to build the report of {job_path}: {e}")
+                        os.replace(job_path, job_path + failed_suffix)
+                    os.utime(lock_path)
+                idle_since = time.time()
+        finally:
+            os.remove(lock_path)
+        # A job queued after the last look would otherwise wait for the next session
+        if not _pending_jobs(queue_directory):
+            break
+
+
+def _lower_priority():
+    """
+    Child process setup: normal scheduling on every core, then a lower priority
+    (the session may have put its trial loop in real-time mode).
+    """
+    with contextlib.suppress(OSError, AttributeError):
+        os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+    with contextlib.suppress(OSError, AttributeError):
+        os.sched_setaffinity(0, range(os.cpu_count() or 1))
+    os.nice(10)
+
+
+def start_worker(queue_directory):
+    """
+    Starts a report worker for the queue in a separate, low-priority process that
+    outlives the caller (it exits at once if one is already running).
+    Returns the subprocess.Popen of the worker.
+    """
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-m', 'force_experiment.report', 'worker', os.path.abspath(queue_directory)]
+    if hasattr(os, 'nice'):
+        return subprocess.Popen(command, cwd=package_root, preexec_fn=_lower_priority)
+    return subprocess.Popen(command, cwd=package_root,
+                            creationflags=getattr(subprocess, 'BELOW_NORMAL_PRIORITY_CLASS', 0))
+
+
+def queue_report(report_directory, trial_csv, tap_csv=None, cache_directory=None, function='weibull', start=True):
+    """
+    Queues the report of a finished session and starts a worker for it.
+    Returns the path the report will be written to.
+    """
+    queue_directory = os.path.join(report_directory, queue_directory_name)
+    os.makedirs(queue_directory, exist_ok=True)
+    output = os.path.join(os.path.abspath(report_directory),
+                          os.path.splitext(os.path.basename(trial_csv))[0] + '.html')
+    job = {'trial_csv': os.path.abspath(trial_csv), 'tap_csv': os.path.abspath(tap_csv) if tap_csv else None,
+           'output': output, 'cache_directory': os.path.abspath(cache_directory or cache_directory_name),
+           'function': function}
+    job_path = os.path.join(queue_directory, f"{time.time():.6f}-{os.getpid()}{job_suffix}")
+    with open(job_path + '.tmp', 'w') as f:
+        json.dump(job, f)
+    os.replace(job_path + '.tmp', job_path)
+    if start:
+        start_worker(queue_directory)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build post-session HTML reports.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Build the report of one session")
+    build_parser.add_argument('trial_csv')
+    build_parser.add_argument('--taps', default=None, help="The participant's tap CSV")
+    build_parser.add_argument('--output', default=None, help="HTML file (default: next to the trial CSV)")
+    build_parser.add_argument('--function', choices=['weibull', 'logistic'], default='weibull')
+    worker_parser = subparsers.add_parser('worker', help="Build queued reports until the queue stays empty")
+    worker_parser.add_argument('queue_directory')
+    worker_parser.add_argument('--idle-timeout', type=float, default=worker_idle_timeout)
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        serve(args.queue_directory, args.idle_timeout)
+        return 0
+    output = args.output or os.path.splitext(args.trial_csv)[0] + '.html'
+    print(f"Report written to {build_report(args.trial_csv, output, args.taps, function=args.function)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+try:
+    import pygame
+except ImportError:  # Only the live session's foot switch window needs it
+    pygame = None
+
+# --------------------------- Configuration ---------------------------
+
+response_poll_interval = 5  # Milliseconds between polls of the event queue (keeps a real-time loop off the CPU)
+
+# --------------------------- Functions ---------------------------
+
+
+def initialize_display():
+    """
+    Opens the small Pygame window that receives the foot switch key events.
+    """
+    if pygame is None:
+        raise ImportError("pygame is required for the foot switch window")
+    pygame.init()
+    screen = pygame.display.set_mode((300, 200))  # Small window for Pygame events
+    pygame.display.set_caption('Foot Switch Input')
+    return screen
+
+
+def close_display():
+    pygame.quit()
+    print("Pygame closed.")
+
+
+def get_foot_response():
+    """
+    Waits for the participant to press the Right or Left arrow key.
+    Returns 'Second' for Right and 'First' for Left.
+    """
+    print("Waiting for foot response (Right for 'Second', Left for 'First')")
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                raise SystemExit
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_RIGHT:  # Right arrow key (Yes)
+                    print("Right foot pressed (Second)")
+                    return 'Second'
+                elif event.key == pygame.K_LEFT:  # Left arrow key (No)
+                    print("Left foot pressed (First)")
+                    return 'First'
+        pygame.time.wait(response_poll_interval)
+
+
+def wait_for_up_arrow(session):
+    """
+    Waits for the participant to press the Up Arrow key, then tells the Arduino to continue.
+    """
+    print("Waiting for Up Arrow key press to move back to the wall...")
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                raise SystemExit
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_UP:
+                    print("Up Arrow key pressed.", end=' ')
+                    if session.connected:
+                        session.ser.write(b'continue\n')  # Send "continue" to Arduino
+                        print("Sent 'continue' to Arduino.")
+                    else:
+                        print("Serial not connected. Cannot send 'continue'.")
+                    return
+        pygame.time.wait(response_poll_interval)
@@ -0,0 +1,820 @@
+import contextlib
+import functools
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+try:
+    import serial
+except ImportError:  # Only needed to open the port (replay attaches its own)
+    serial = None
+try:
+    from psychopy.data import QuestHandler
+except ImportError:  # Only needed to run trials (replay re-measures recorded taps without staircases)
+    QuestHandler = None
+
+from adaptive_scheduler import AdaptiveScheduler
+from command_queue import build_trial_timeline, execute_timeline
+from force_buffer import ChannelBuffers, ForceRingBuffer
+from force_stream import ChannelLayout, StreamDecoder, parse_stream_line, print_loss_report
+from motion_profile import MotionPlanner
+from schedule_compiler import load_schedule
+from servo_intensity import IntensityTable, tap_command
+from .acquisition import AcquisitionPort
+from .archive import start_background_compaction
+from .capture import CaptureWriter, CapturingSerial
+from .realtime import RealtimeMode, format_jitter, measure_jitter
+from .report import queue_report
+from .responses import get_foot_response, wait_for_up_arrow
+from .storage import get_tap_csv_filename, initialize_csv, write_tap_rows
+from .tap_strategies import make_tap_strategy
+from .trial_store import TrialStore
+
+# --------------------------- Configuration ---------------------------
+
+motor_settle_time = 0.5  # Delay after a motor command before the next step
+pre_return_delay = 1.0  # Delay between the taps and the return move
+condition8_distance, condition8_speed = 3, 1  # Condition 8 moves back slowly...
+condition8_return_speed = 2  # ...and forward to the wall faster
+
+# --------------------------- Functions ---------------------------
+
+
+def create_new_quest(quest):
+    """
+    Initializes a new QuestHandler instance.
+    """
+    return QuestHandler(startVal=quest.start_val, startValSd=quest.start_val_sd, pThreshold=quest.p_threshold,
+                        nTrials=quest.n_trials, minVal=quest.min_val, maxVal=quest.max_val)
+
+
+def initialize_quest_handlers(protocol, quest):
+    """
+    Initializes QuestHandler instances for each condition and each set.
+    Returns a dictionary with keys as 'condition_set' and values as QuestHandler objects.
+    """
+    quest_dict = {}
+    for condition in range(1, protocol.total_conditions + 1):
+        for set_num in range(1, protocol.total_sets_per_condition + 1):
+            key = f"{condition}_set{set_num}"
+            quest_dict[key] = create_new_quest(quest)
+    return quest_dict
+
+
+def condition_parameters(condition, protocol):
+    """
+    Returns the (distance, speed) of a condition.
+    """
+    if condition in [1, 2]:
+        return protocol.distances[0], protocol.speeds[0] if condition == 1 else protocol.speeds[1]
+    if condition in [3, 4]:
+        return protocol.distances[1], protocol.speeds[0] if condition == 3 else protocol.speeds[1]
+    if condition in [5, 6]:
+        return protocol.distances[2], protocol.speeds[0] if condition == 5 else protocol.speeds[1]
+    if condition == 7:
+        return 0, 0  # Baseline, no movement
+    return condition8_distance, condition8_speed  # Moving back 3 cm at slow speed
+
+
+def build_trials(config, quest_dict=None, rng=random):
+    """
+    Returns the session's trials in presentation order, as dictionaries with
+    Condition, Set, Distance, Speed and QuestKey. The order follows [run]:
+    a compiled schedule file, shuffled condition blocks ('blocked') or all
+    trials shuffled ('shuffled'); with use_adaptive_scheduler a generator
+    picks the next staircase as the session runs.
+    """
+    protocol, run = config.protocol, config.run
+    templates = {}
+    for condition in range(1, protocol.total_conditions + 1):
+        distance, speed = condition_parameters(condition, protocol)
+        for set_num in range(1, protocol.total_sets_per_condition + 1):
+            quest_key = f"{condition}_set{set_num}"
+            templates[quest_key] = {'Condition': condition, 'Set': set_num, 'Distance': distance,
+                                    'Speed': speed, 'QuestKey': quest_key}
+
+    if run.use_adaptive_scheduler:
+        scheduler = AdaptiveScheduler(quest_dict, trials_per_staircase=protocol.trials_per_set,
+                                      max_consecutive=run.max_consecutive_condition,
+                                      target_sd=run.target_posterior_sd)
+        print("Adaptive trial ordering enabled.")
+        return scheduler, scheduler.iter_trials(templates)
+
+    if run.schedule_file:
+        schedule = load_schedule(run.schedule_file, protocol)  # ValueError if compiled for another design
+        print(f"Trial order loaded from {run.schedule_file}.")
+        return None, [templates[f"{condition}_set{set_num}"] for condition, set_num in schedule]
+
+    conditions = list(range(1, protocol.total_conditions + 1))
+    if run.trial_order == 'blocked':
+        rng.shuffle(conditions)  # Randomize the order of the condition blocks
+    trials = [templates[f"{condition}_set{set_num}"]
+              for condition in conditions
+              for set_num in range(1, protocol.total_sets_per_condition + 1)
+              for _ in range(protocol.trials_per_set)]
+    if run.trial_order == 'shuffled':
+        rng.shuffle(trials)
+    print(f"Total Trials Generated: {len(trials)}")
+    return None, trials
+
+
+class ExperimentSession:
+    """
+    One participant's session: the serial link, the Quest staircases, the data
+    files and the trial loop shared by every experiment variant. How taps are
+    measured is delegated to the tap strategy chosen in [run] tap_strategy.
+    """
+
+    def __init__(self, config, participant_name, tap_strategy=None):
+        self.config = config
+        self.participant_name = participant_name
+        self.tap_strategy = tap_strategy or make_tap_strategy(config.run.tap_strategy)
+        self.quest_dict = initialize_quest_handlers(config.protocol, config.quest) if QuestHandler is not None else {}
+        self.ser = None
+        self.serial_connected = False
+        self.trial_number = 0  # Tap trial counter written to the tap CSV
+        self.force_buffer = ForceRingBuffer()
+        self.channel_layout = ChannelLayout(config.sensors.channels)
+        self.channel_buffers = ChannelBuffers(self.channel_layout.names)
+        self.stream_decoder = StreamDecoder(self.channel_layout)  # Keeps a line cut between two windows
+        self.motion_planner = None
+        if config.motion.use_profiles:
+            self.motion_planner = MotionPlanner(config.motion.acceleration, config.motion.start_speed)
+            self.motion_planner.plan(list(config.protocol.speeds) + [condition8_speed, condition8_return_speed])
+        self.intensity_table = IntensityTable(config.servo.calibration) if config.servo.fine_intensity else None
+        self.motion_state_log = []  # Motion state tags: (host time, name, value, Arduino micros)
+        self.csv_file = None
+        self.csv_writer = None
+        self.trial_store = None  # TrialStore of the trial database, if [paths] trial_database is set
+        self.staged_taps = []  # Tap records of the running trial, committed with its trial row
+        self.scheduler = None
+        self.capture = None  # CaptureWriter of the raw serial traffic, if [capture] is enabled
+        self.realtime = None  # RealtimeMode of the trial loop, if [realtime] is enabled
+        self.acquisition = None  # AcquisitionPort of the acquisition process, if [acquisition] is enabled
+
+        # Pipelined trials ([run] pipeline_trials): background workers and the running return move
+        self.motion_worker = None
+        self.io_worker = None
+        self.pending_motion = None
+
+        # Live metrics (published to the monitor, if any)
+        self.monitor = None
+        self.trial_index = 0
+        self.total_trials = config.protocol.total_trials
+        self.force_sample_rate = 0.0  # Samples per second in the last force window
+        self.dropped_samples = 0  # Samples lost in transmission this session
+        self.phase_latency = {}  # Seconds spent in each phase of the last trial
+
+    @property
+    def connected(self):
+        return bool(self.serial_connected and self.ser and self.ser.is_open)
+
+    @property
+    def fine_intensity(self):
+        """
+        True once the Arduino holds the intensity table, so taps can use fine intensity codes.
+        """
+        return self.intensity_table is not None and self.intensity_table.uploaded
+
+    def tap_window(self):
+        """
+        Context of one tap window: the garbage collector is paused in real-time mode.
+        """
+        return self.realtime.tap_window() if self.realtime is not None else contextlib.nullcontext()
+
+    def tap_command(self, tap_digit, condition, fixed_intensity, variable_intensity):
+        return tap_command(tap_digit, condition, fixed_intensity, variable_intensity, self.fine_intensity) + "\n"
+
+    def reset_input(self):
+        """
+        Clears the serial input buffer and the unfinished line kept by the stream decoder.
+        """
+        self.ser.reset_input_buffer()
+        self.stream_decoder.reset()
+
+    # ---- setup ----
+
+    def initialize_serial(self):
+        """
+        Attempts to establish a serial connection with the Arduino.
+        """
+        serial_config = self.config.serial
+        try:
+            if serial is None:
+                raise ImportError("pyserial is not installed")
+            if self.config.acquisition.enabled:
+                self.start_acquisition(functools.partial(serial.Serial, serial_config.port, serial_config.baud_rate,
+                                                         timeout=serial_config.timeout))
+                return self.serial_connected
+            self.ser = serial.Serial(serial_config.port, serial_config.baud_rate, timeout=serial_config.timeout)
+            self.serial_connected = True
+            print("Serial connection established.")
+            if self.config.capture.enabled:
+                self.start_capture()
+            self.configure_device()
+        except Exception as e:
+            print(f"Failed to connect to Arduino: {e}")
+            print("Proceeding without serial connection. Motor commands and taps will not be sent.")
+            self.ser, self.serial_connected = None, False
+        return self.serial_connected
+
+    def attach_serial(self, port, configure=True):
+        """
+        Uses an already open serial port (or a stand-in such as SimulatedSerial or ReplaySerial).
+        configure=False skips configure_device(), e.g. for a replayed recording.
+        """
+        self.ser, self.serial_connected = port, True
+        if configure:
+            self.configure_device()
+
+    def start_acquisition(self, open_port):
+        """
+        Hands the serial port to an acquisition process ([acquisition]) and takes force
+        windows from its shared-memory ring. open_port is a picklable callable that
+        opens the port in that process (e.g. functools.partial(serial.Serial, ...)).
+        """
+        acquisition_config, capture = self.config.acquisition, None
+        if self.config.capture.enabled:
+            capture_config = self.config.capture
+            capture = (self._capture_base_path(), capture_config.rotate_bytes, capture_config.flush_interval,
+                       capture_config.timestamp_resolution)
+        self.acquisition = AcquisitionPort(open_port, self.channel_layout.names, acquisition_config.capacity,
+                                           acquisition_config.name or None, acquisition_config.poll_interval,
+                                           capture, self.config.serial.timeout).start()
+        self.ser, self.serial_connected = self.acquisition, True
+        self.channel_buffers = self.acquisition.buffers
+        self.force_buffer = self.channel_buffers['force']
+        print(f"Serial connection established in acquisition process {self.acquisition.process.pid}; "
+              f"force ring '{self.channel_buffers.name}' in shared memory.")
+        if capture is not None:
+            print(f"Capturing serial traffic to {capture[0]}.*.cap.gz")
+        self.configure_device()
+
+    def configure_device(self):
+        """
+        Enables the configured sensor channels on the Arduino (only force is on after
+        reset) and uploads the motion profiles of queued trials and the intensity table.
+        """
+        if self.channel_layout.names != ['force']:
+            self.send_motor_command(f"CHANNELS {self.channel_layout.mask}", "sensor channel")
+        if self.motion_planner is not None and self.config.run.use_command_queue:
+            try:
+                if self.motion_planner.upload(self.ser):
+                    print(f"Uploaded {len(self.motion_planner.profiles)} motion profiles.")
+            except Exception as e:
+                print(f"Error uploading motion profiles: {e}")
+        if self.intensity_table is not None:
+            try:
+                if self.intensity_table.upload(self.ser):
+                    print("Uploaded the intensity table; taps use fine intensities.")
+            except Exception as e:
+                print(f"Error uploading the intensity table: {e}")
+            if not self.intensity_table.uploaded:
+                print("Taps fall back to whole intensity levels.")
+
+    def start_capture(self):
+        """
+        Tees the serial port into a raw capture file (see capture.py).
+        """
+        capture_config = self.config.capture
+        base_path = self._capture_base_path()
+        try:
+            self.capture = CaptureWriter(base_path, capture_config.rotate_bytes, capture_config.flush_interval).start()
+        except OSError as e:
+            print(f"Failed to start serial capture: {e}")
+            return
+        self.ser = CapturingSerial(self.ser, self.capture, capture_config.timestamp_resolution)
+        print(f"Capturing serial traffic to {base_path}.*.cap.gz")
+
+    def _capture_base_path(self):
+        return os.path.join(self.config.capture.directory, f"{self.participant_name}_{time.strftime('%Y%m%d_%H%M%S')}")
+
+    def open_csv(self):
+        self.csv_file, self.csv_writer = initialize_csv(self.participant_name, self.config.paths)
+
+    def open_store(self):
+        """
+        Opens the trial database and registers this session in it.
+        """
+        paths = self.config.paths
+        if not paths.trial_database:
+            return
+        database = os.path.join(os.getcwd(), paths.data_directory, paths.trial_database)
+        try:
+            self.trial_store = TrialStore(database, self.participant_name, self.tap_strategy.name,
+                                          self.config.to_dict())
+            print(f"Trial database: {database} (session {self.trial_store.session_id})")
+        except Exception as e:
+            print(f"Failed to open trial database: {e}")
+
+    def enter_realtime(self):
+        """
+        Enters real-time mode ([realtime]) for the trial loop, which must be the calling
+        thread, and prints the scheduling jitter measured before and after.
+        """
+        realtime_config = self.config.realtime
+        if not realtime_config.enabled:
+            return
+        before = measure_jitter(realtime_config.probe_duration) if realtime_config.probe_duration else None
+        self.realtime = RealtimeMode(realtime_config.cpu, realtime_config.priority).enter()
+        print(f"Real-time mode: heap frozen, {', '.join(self.realtime.notes)}.")
+        if before is not None:
+            with self.realtime.tap_window():
+                after = measure_jitter(realtime_config.probe_duration)
+            print(f"Scheduling jitter before: {format_jitter(before)}")
+            print(f"Scheduling jitter after:  {format_jitter(after)}")
+
+    def queue_report(self):
+        """
+        Hands the session report ([report]) to the background report worker.
+        """
+        if not self.config.report.enabled or self.csv_file is None:
+            return
+        paths = self.config.paths
+        try:
+            output = queue_report(os.path.join(os.getcwd(), paths.data_directory, self.config.report.directory),
+                                  self.csv_file.name, get_tap_csv_filename(self.participant_name, paths),
+                                  function=self.config.report.function)
+            print(f"Session report queued: {output}")
+        except OSError as e:
+            print(f"Failed to queue the session report: {e}")
+
+    def close(self):
+        """
+        Closes the trial CSV, the trial database and the serial connection.
+        """
+        try:
+            if self.csv_file is not None and not self.csv_file.closed:
+                self.csv_file.close()
+                print("CSV file closed.")
+        except Exception as e:
+            print(f"Failed to close CSV file: {e}")
+        if self.trial_store is not None:
+            self.trial_store.close()
+            self.trial_store = None
+        if self.realtime is not None:
+            self.realtime.exit()
+        if self.connected:
+            self.ser.close()
+            print("Serial connection closed.")
+        if self.capture is not None:
+            self.capture.close()
+            self._finish_capture(self.capture.base_path, self.capture.bytes_captured)
+            self.capture = None
+        if self.acquisition is not None:
+            self.acquisition.close()  # Already closed with the port, unless the process died
+            if self.acquisition.capture is not None:
+                self._finish_capture(self.acquisition.capture[0], self.acquisition.stats.get('bytes_captured', 0))
+            self.acquisition = None
+
+    def _finish_capture(self, base_path, bytes_captured):
+        print(f"Serial capture closed ({bytes_captured} bytes).")
+        if self.config.capture.compact and bytes_captured:
+            try:
+                start_background_compaction(base_path)
+                print(f"Compacting the capture into {base_path}.farc in the background.")
+            except OSError as e:
+                print(f"Failed to start capture compaction: {e}")
+
+    # ---- acquisition ----
+
+    def _read_stream(self, duration, on_force, label, on_samples=None):
+        """
+        Reads the force stream for duration seconds in chunks, passing the force values
+        of each chunk and their sequence numbers (NumPy arrays, -1 for unnumbered readings)
+        to on_force and, if given, its demultiplexed channel samples to on_samples.
+        Returns False if reading failed.
+        """
+        if self.acquisition is not None:
+            return self._follow_acquisition(duration, on_force, label)
+        decoder = self.stream_decoder
+        start_time, malformed = time.time(), decoder.malformed
+        sequence_numbers = []  # Sequence numbers of fixed-rate samples, for gap detection
+        force_count = 0
+        while (time.time() - start_time) < duration:
+            if not self.connected:
+                print("Serial port not connected. Cannot read force data.")
+                return False
+            try:
+                samples, forces, lines = decoder.feed(self.ser.read(max(1, self.ser.in_waiting)))
+                force_sequence = numpy.full(len(forces), -1, dtype=numpy.int64)
+                if 'force' in samples:
+                    chunk_sequence, sample_forces = samples['force']
+                    sequence_numbers.append(chunk_sequence)
+                    if len(forces):
+                        forces = numpy.concatenate((sample_forces, forces))
+                        force_sequence = numpy.concatenate((chunk_sequence, force_sequence))
+                    else:
+                        forces, force_sequence = sample_forces, chunk_sequence
+                if on_samples is not None and samples:
+                    on_samples(samples)
+                if len(forces):
+                    if on_force is not None:
+                        on_force(forces, force_sequence)
+                    force_count += len(forces)
+                for line in lines:
+                    kind, value = parse_stream_line(line)
+                    if kind == 'state':
+                        self.motion_state_log.append((time.time(),) + value)
+                    else:
+                        print(f"Warning: Ignoring non-force line '{line}'")
+            except Exception as e:
+                print(f"Error reading force data: {e}")
+                return False
+        if decoder.malformed > malformed:
+            print(f"Warning: {decoder.malformed - malformed} sample lines did not match the channel layout.")
+        if sequence_numbers:
+            self.dropped_samples += print_loss_report(numpy.concatenate(sequence_numbers), label=label)['lost']
+        self.force_sample_rate = force_count / max(time.time() - start_time, 1e-9)
+        return True
+
+    def _follow_acquisition(self, duration, on_force, label):
+        """
+        _read_stream() while the acquisition process owns the port: handles the lines
+        that are not samples for duration seconds, then passes the force samples that
+        arrived meanwhile to on_force.
+        """
+        ring = self.force_buffer
+        start_time, start = time.time(), ring.mark()
+        while (time.time() - start_time) < duration:
+            if not self.connected:
+                print("Serial port not connected. Cannot read force data.")
+                return False
+            received = self.acquisition.next_line(duration - (time.time() - start_time))
+            if received is None:
+                continue
+            host_time, line = received
+            kind, value = parse_stream_line(line)
+            if kind == 'state':
+                self.motion_state_log.append((host_time,) + value)
+            else:
+                print(f"Warning: Ignoring non-force line '{line}'")
+        stop = ring.mark()
+        self.dropped_samples += print_loss_report(ring.sequence_numbers(start, stop), label=label)['lost']
+        self.force_sample_rate = (stop - start) / max(time.time() - start_time, 1e-9)
+        if on_force is not None:
+            with ring.window(start, stop) as window:
+                on_force(window.values, window.sequence_numbers)
+        return True
+
+    def read_force_window(self, duration):
+        """
+        Reads force data for duration seconds into the ring buffer.
+        Returns a pinned ForceWindow over the samples (the caller releases it), or None on failure.
+        """
+        window_start, overruns = self.force_buffer.mark(), self.force_buffer.overruns
+        on_force = self.force_buffer.extend if self.acquisition is None else None  # The process fills the ring
+        if not self._read_stream(duration, on_force, "Force window"):
+            return None
+        if self.force_buffer.overruns > overruns:
+            print(f"Warning: {self.force_buffer.overruns - overruns} samples dropped to protect windows still in use.")
+        return self.force_buffer.window(window_start)
+
+    def read_channel_windows(self, duration, channels=None):
+        """
+        Reads the sensor stream for duration seconds and demultiplexes it into the channel buffers.
+        Returns pinned ForceWindows {channel: window} for channels (default: all enabled), or None.
+        """
+        channels = channels or self.channel_layout.names
+        marks = self.channel_buffers.mark(channels)
+        on_samples = self.channel_buffers.extend if self.acquisition is None else None  # The process fills the rings
+        if not self._read_stream(duration, None, "Channel window", on_samples):
+            return None
+        return self.channel_buffers.windows(marks)
+
+    def buffer_samples(self, samples, forces):
+        """
+        Keeps force samples read outside a force window (e.g. while a queued timeline runs) in the buffers.
+        """
+        self.channel_buffers.extend(samples)
+        if 'force' in samples:
+            self.force_buffer.extend(samples['force'][1], samples['force'][0])
+        if len(forces):
+            self.force_buffer.extend(forces)
+
+    def read_highest_force(self, duration=0.5):
+        """
+        Reads force data for duration seconds and returns the highest value, or None.
+        """
+        highest = [-float('inf')]
+
+        def keep_highest(values, sequence_numbers):
+            if len(values):
+                highest[0] = max(highest[0], float(values.max()))
+
+        if not self._read_stream(duration, keep_highest, "Highest force window"):
+            return None
+        return highest[0] if highest[0] != -float('inf') else None
+
+    # ---- motion ----
+
+    def send_motor_command(self, command, description):
+        if self.connected:
+            try:
+                self.ser.write(f"{command}\n".encode())
+            except Exception as e:
+                print(f"Error sending {description} command: {e}")
+        else:
+            print(f"Serial port not connected. Skipping {description}.")
+        time.sleep(motor_settle_time)
+
+    def run_queued_trial(self, distance, speed, variable_intensity, condition):
+        """
+        Runs the moves and taps of one trial as a single timeline on the Arduino.
+        Tap timestamps come from the firmware's completion reports instead of host sleeps.
+        """
+        self.trial_number += 1
+        fixed_intensity = self.config.protocol.fixed_intensity
+        timeline = build_trial_timeline(condition, distance, speed, fixed_intensity, variable_intensity,
+                                        self.motion_planner, self.intensity_table if self.fine_intensity else None)
+        print(f"Condition {condition}: Running queued timeline with {len(timeline.entries)} steps.")
+        try:
+            with self.tap_window():
+                events = execute_timeline(self.ser, timeline, self.stream_decoder, self.buffer_samples)
+        except Exception as e:
+            print(f"Error during serial communication: {e}")
+            return False
+        if events is None:
+            return False
+        self.motion_state_log.extend(events['states'])
+
+        column = self.tap_strategy.measurement_column
+        rows = [[self.trial_number, condition, 'Fixed', fixed_intensity, events.get('tap_fixed'), ''],
+                [self.trial_number, condition, 'Variable', variable_intensity, events.get('tap_variable'), '']]
+        self.stage_taps(rows, None)
+        if column:
+            write_tap_rows(get_tap_csv_filename(self.participant_name, self.config.paths), rows, column)
+        return True
+
+    def control_motors(self, distance, speed, variable_intensity, condition, quest_key=None):
+        """
+        Controls the stepper motor and sends taps based on the condition.
+        Returns the participant's response for Condition 8 (collected at the back position),
+        'Error' if the queued timeline did not run, else None.
+        """
+        fixed_intensity = self.config.protocol.fixed_intensity
+        if self.config.run.use_command_queue and condition in range(1, 8) and self.connected:
+            if not self.run_queued_trial(distance, speed, variable_intensity, condition):
+                return 'Error'  # No stimulus was played: no response to collect
+            return None
+
+        if condition in range(1, 7):  # Conditions 1 to 6
+            print(f"Condition {condition}: Moving stepper motor for {distance} cm at {speed} cm/s")
+            self.send_motor_command(f"MOVE {distance} {speed}", "motor")
+
+            self.tap_strategy.send_taps(self, condition, fixed_intensity, variable_intensity)
+
+            if self.motion_worker is not None:
+                # The return move runs while run_trial waits for the response
+                self.pending_motion = self.motion_worker.submit(self.return_motor, condition, distance, speed)
+            else:
+                self.return_motor(condition, distance, speed)
+
+        elif condition == 7:  # Baseline: No movement, just taps
+            print("Condition 7: Baseline, no movement, applying taps.")
+            self.tap_strategy.send_taps(self, condition, fixed_intensity, variable_intensity)
+
+        elif condition == 8:  # Moving back, taps and response at the back position
+            print("Condition 8: Moving back 3 cm at slow speed, applying taps.")
+            self.send_motor_command(f"MOVE {condition8_distance} {condition8_speed}", "MOVE_BACK")
+
+            self.tap_strategy.send_taps(self, condition, fixed_intensity, variable_intensity)
+
+            response = get_foot_response()
+            if quest_key is not None:
+                self.quest_dict[quest_key].addResponse(1 if response == 'Second' else 0)
+
+            wait_for_up_arrow(self)
+
+            print(f"Condition 8: Moving forward to the wall at {condition8_return_speed} cm/s.")
+            self.send_motor_command(f"MOVE_RETURN {condition8_distance} {condition8_return_speed}", "MOVE_FORWARD")
+            return response
+        return None
+
+    def return_motor(self, condition, distance, speed):
+        """
+        Moves the hand back to the wall after the taps of conditions 1 to 6.
+        """
+        print(f"Condition {condition}: Waiting for {pre_return_delay} second before returning motor.")
+        time.sleep(pre_return_delay)
+
+        print(f"Condition {condition}: Returning motor to original position at {speed} cm/s")
+        self.send_motor_command(f"MOVE_RETURN {distance} {speed}", "return motor")
+
+    def wait_for_motion(self):
+        """
+        Waits until a return move running in the background has finished.
+        """
+        if self.pending_motion is None:
+            return
+        wait_start = time.time()
+        self.pending_motion.result()
+        self.pending_motion = None
+        self.phase_latency['motion_wait'] = time.time() - wait_start
+
+    # ---- trials ----
+
+    def next_intensity(self, quest_key):
+        """
+        Returns the next variable intensity of a staircase.
+        """
+        try:
+            return self.quest_dict[quest_key].next()
+        except Exception as e:
+            print(f"Error retrieving next Quest value for {quest_key}: {e}")
+            return 4  # Default to 4 if error occurs
+
+    def run_trial(self, overall_trial_num, trial, specific_trial_num, variable_intensity=None,
+                  on_stimulus_done=None):
+        """
+        Runs one trial and returns its row for the trial CSV.
+        variable_intensity may be computed ahead of time; on_stimulus_done is called
+        once the taps are done, before the response wait.
+        """
+        condition, quest_key = trial['Condition'], trial['QuestKey']
+        self.phase_latency = {}
+        self.wait_for_motion()  # The previous trial's return move must finish before this trial moves
+        phase_start = time.time()
+        if variable_intensity is None:
+            variable_intensity = self.next_intensity(quest_key)
+
+        print(f"\nOverall Trial {overall_trial_num}: Condition = {condition}, Set = {trial['Set']}, "
+              f"SpecificTrial = {specific_trial_num}, Distance = {trial['Distance']} cm, "
+              f"Speed = {trial['Speed']} cm/s, ReferenceLevel = {variable_intensity}")
+
+        trial_data = {
+            'SubjectID': self.participant_name,
+            'Condition': f"Condition {condition}",
+            'OverallTrial': overall_trial_num,
+            'SpecificTrial': specific_trial_num,
+            'ProbeLevel': self.config.protocol.fixed_intensity,
+            'ReferenceLevel': variable_intensity,
+            'Response': '',
+            'TrialDuration': ''
+        }
+        trial_start_time = time.time()
+        self.phase_latency['quest'] = trial_start_time - phase_start
+
+        response = self.control_motors(trial['Distance'], trial['Speed'], variable_intensity, condition, quest_key)
+        phase_start = time.time()
+        self.phase_latency['stimulus'] = phase_start - trial_start_time
+        if on_stimulus_done is not None:
+            on_stimulus_done()
+        if response == 'Error':
+            print("Stimulus failed; recording the trial as an error without a Quest update.")
+            trial_data['Response'] = 'Error'
+        elif condition == 8:
+            trial_data['Response'] = response or ''
+        else:
+            try:
+                response = get_foot_response()
+                trial_data['Response'] = response
+                self.quest_dict[quest_key].addResponse(1 if response == 'Second' else 0)
+            except Exception as e:
+                print(f"Error during response collection: {e}")
+                trial_data['Response'] = 'Error'
+
+        trial_data['TrialDuration'] = round(time.time() - trial_start_time, 3)  # Rounded to milliseconds
+        self.phase_latency['response'] = time.time() - phase_start
+        return trial_data
+
+    def stage_taps(self, rows, measurement_column):
+        """
+        Keeps a trial's tap rows for the trial database until the trial is written.
+        """
+        if self.trial_store is not None:
+            self.staged_taps.extend(self.trial_store.tap_records(rows, measurement_column))
+
+    def take_staged_taps(self):
+        tap_records, self.staged_taps = self.staged_taps, []
+        return tap_records
+
+    def write_trial(self, trial_data, tap_records=(), quest_key=None):
+        """
+        Writes a trial row to the CSV and commits it with its taps to the trial database.
+        Returns the seconds it took (the caller records it, as this may run on the I/O worker).
+        """
+        phase_start = time.time()
+        try:
+            self.csv_writer.writerow(trial_data)
+            self.csv_file.flush()  # Ensure data is written to disk immediately
+            print("Trial data written to CSV.")
+        except Exception as e:
+            print(f"Error writing trial data to CSV: {e}")
+        if self.trial_store is not None:
+            try:
+                self.trial_store.add_trial(trial_data, tap_records, quest_key)
+            except Exception as e:
+                print(f"Error writing trial to the trial database: {e}")
+        return time.time() - phase_start
+
+    # ---- monitoring ----
+
+    def quest_estimates(self):
+        """
+        Returns each staircase's trial count, threshold estimate and posterior SD.
+        """
+        estimates = {}
+        for quest_key, handler in self.quest_dict.items():
+            try:
+                estimates[quest_key] = {'trials': len(handler.data), 'mean': float(handler.mean()),
+                                        'sd': float(handler.sd())}
+            except Exception:
+                continue
+        return estimates
+
+    def publish_metrics(self, status='running'):
+        """
+        Publishes a snapshot of the session metrics to the monitor, if one is attached.
+        """
+        if self.monitor is None:
+            return
+        self.monitor.publish(participant=self.participant_name, status=status, trial_index=self.trial_index,
+                             total_trials=self.total_trials, quest=self.quest_estimates(),
+                             force_sample_rate=self.force_sample_rate, dropped_samples=self.dropped_samples,
+                             phase_latency=dict(self.phase_latency))
+
+    def run(self, trials=None):
+        """
+        Runs every trial of the session and writes one CSV row per trial.
+        """
+        if QuestHandler is None:
+            print("PsychoPy is not installed. Cannot run the Quest staircases.")
+            return
+        if trials is None:
+            self.scheduler, trials = build_trials(self.config, self.quest_dict)
+        if isinstance(trials, list):
+            self.total_trials = len(trials)
+        specific_trial_counters = {quest_key: 0 for quest_key in self.quest_dict}
+
+        print("Starting experimental trials...")
+        self.publish_metrics()
+        if self.config.run.pipeline_trials:
+            self.run_pipelined(trials, specific_trial_counters)
+        else:
+            for overall_trial_num, trial in enumerate(trials, start=1):
+                self.trial_index = overall_trial_num
+                specific_trial_counters[trial['QuestKey']] += 1
+                trial_data = self.run_trial(overall_trial_num, trial, specific_trial_counters[trial['QuestKey']])
+                self.phase_latency['write'] = self.write_trial(trial_data, self.take_staged_taps(), trial['QuestKey'])
+                self.publish_metrics()
+                if self.realtime is not None:
+                    self.realtime.between_trials()
+
+        print("\nAll trials completed.")
+        self.publish_metrics(status='completed')
+        self.queue_report()
+        if self.scheduler is not None:
+            print(f"Adaptive ordering ran {self.scheduler.total_trials()} of {self.config.protocol.total_trials} "
+                  f"trials; {len(self.scheduler.stopped_early)} staircases stopped early.")
+
+    def run_pipelined(self, trials, specific_trial_counters):
+        """
+        Runs the trials with the response wait overlapping the rest of the trial's work:
+        the return move runs on a motion worker, and CSV writes and the next trial's
+        Quest intensity run on an I/O worker (one thread each, so their order is kept).
+        The next trial's intensity is only computed ahead when it comes from another
+        staircase, and its moves wait for the return move to finish.
+        """
+        # Workers leave the real-time core to the trial loop
+        initializer = self.realtime.release_thread if self.realtime is not None else None
+        self.motion_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='motion', initializer=initializer)
+        self.io_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trial-io', initializer=initializer)
+        upcoming = trials if isinstance(trials, list) else None  # Adaptive order is only known one trial ahead
+        prepared = None  # (trial index, future intensity) of the next trial
+        pending_write = None  # Future write time of the previous trial
+        try:
+            for index, trial in enumerate(trials):
+                self.trial_index = index + 1
+                specific_trial_counters[trial['QuestKey']] += 1
+                variable_intensity = None
+                if prepared is not None and prepared[0] == index:
+                    variable_intensity = prepared[1].result()
+                prepared = None
+
+                def prepare_next(index=index, trial=trial):
+                    nonlocal prepared
+                    if upcoming is not None and index + 1 < len(upcoming):
+                        next_trial = upcoming[index + 1]
+                        if next_trial['QuestKey'] != trial['QuestKey']:
+                            prepared = (index + 1, self.io_worker.submit(self.next_intensity, next_trial['QuestKey']))
+
+                trial_data = self.run_trial(index + 1, trial, specific_trial_counters[trial['QuestKey']],
+                                            variable_intensity, prepare_next)
+                if pending_write is not None:  # 'write' is the previous trial's, done during this one
+                    self.phase_latency['write'] = pending_write.result()
+                pending_write = self.io_worker.submit(self.write_trial, trial_data, self.take_staged_taps(),
+                                                      trial['QuestKey'])
+                self.publish_metrics()
+                if self.realtime is not None:
+                    self.realtime.between_trials()
+            self.wait_for_motion()
+            if pending_write is not None:
+                self.phase_latency['write'] = pending_write.result()
+        finally:
+            self.io_worker.shutdown(wait=True)
+            self.motion_worker.shutdown(wait=True)
+            self.io_worker = self.motion_worker = self.pending_motion = None
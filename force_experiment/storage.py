@@ -0,0 +1,94 @@
+import csv
+import os
+import sys
+import time
+
+from force_buffer import ForceWindow
+
+# --------------------------- Configuration ---------------------------
+
+trial_fieldnames = ['SubjectID', 'Condition', 'OverallTrial', 'SpecificTrial',
+                    'ProbeLevel', 'ReferenceLevel', 'Response', 'TrialDuration']
+tap_fieldnames = ['Trial Number', 'Condition', 'Tap Type', 'Intensity', 'Timestamp']
+
+# --------------------------- Functions ---------------------------
+
+
+def sanitize_participant_name(participant_name):
+    """
+    Returns the participant name with only the characters that are safe in a file name.
+    """
+    return "".join(c for c in participant_name if c.isalnum() or c in (" ", "_")).rstrip()
+
+
+def initialize_csv(participant_name, paths):
+    """
+    Initializes the CSV file for data recording.
+    Returns the file object and CSV writer.
+    """
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    sanitized_name = sanitize_participant_name(participant_name)
+    filename = f"participant_{sanitized_name}_{timestamp}.csv"
+    directory = os.path.join(os.getcwd(), paths.data_directory)
+    os.makedirs(directory, exist_ok=True)  # Create directory if it doesn't exist
+    filepath = os.path.join(directory, filename)
+    try:
+        csv_file = open(filepath, mode='w', newline='', buffering=1)  # Line-buffered
+        writer = csv.DictWriter(csv_file, fieldnames=trial_fieldnames)
+        writer.writeheader()
+        print(f"CSV file initialized at {filepath}")
+        return csv_file, writer
+    except Exception as e:
+        print(f"Failed to initialize CSV file: {e}")
+        sys.exit(1)
+
+
+def get_tap_csv_filename(participant_name, paths, channel='force'):
+    """
+    Returns the path of the per-participant tap timestamp and force data CSV.
+    Sensor channels other than the tap force get a file of their own.
+    """
+    return os.path.join(paths.tap_directory, tap_csv_basename(participant_name, channel))
+
+
+def tap_csv_basename(participant_name, channel='force'):
+    """
+    Returns the file name of a participant's tap CSV for a sensor channel.
+    """
+    if channel != 'force':
+        return f'{participant_name}_tap_timestamps_{channel}_data.csv'
+    return f'{participant_name}_tap_timestamps_force_data.csv'
+
+
+def tap_measurement(value):
+    """
+    Returns a tap measurement as it is stored: force windows become lists on their uniform
+    sample grid, with nan for lost samples, or None (an empty measurement) if the shared
+    ring overwrote their samples before they were copied.
+    """
+    if not isinstance(value, ForceWindow):
+        return value
+    values = value.snapshot()
+    if values is None:
+        print(f"Warning: Force samples {value.start}-{value.stop} were overwritten before they were stored; "
+              f"the tap is recorded without them.")
+    return values
+
+
+def write_tap_rows(csv_filename, rows, measurement_column='Force Data'):
+    """
+    Appends tap rows to the tap CSV, writing the header if the file is new.
+    Force windows are written with tap_measurement(). Returns True if the rows were written.
+    """
+    rows = [[tap_measurement(value) for value in row] for row in rows]
+    try:
+        file_exists = os.path.isfile(csv_filename)
+        with open(csv_filename, 'a', newline='') as csvfile:
+            csv_writer = csv.writer(csvfile)
+            if not file_exists:
+                csv_writer.writerow(tap_fieldnames + [measurement_column])
+            csv_writer.writerows(rows)
+        return True
+    except Exception as e:
+        print(f"Failed to write to CSV: {e}")
+        return False
@@ -0,0 +1,167 @@
+import time
+
+from force_buffer import ForceWindow
+from .storage import get_tap_csv_filename, write_tap_rows
+
+# --------------------------- Functions ---------------------------
+
+
+class TapStrategy:
+    """
+    Sends a trial's two taps and measures each one.
+
+    Subclasses implement measure(), which is called right after each tap command
+    and returns the value stored for that tap. Strategies with a measurement
+    column append one row per tap to the participant's tap CSV.
+    """
+
+    name = None
+    measurement_column = None  # Tap CSV column for the measurement; None writes no tap file
+
+    def measure(self, session):
+        raise NotImplementedError
+
+    def send_taps(self, session, condition, fixed_intensity, variable_intensity):
+        """
+        Sends the fixed tap and then the variable tap. Returns False if the taps could not be sent.
+        """
+        session.trial_number += 1
+        print(f"Participant name: {session.participant_name}, Trial number: {session.trial_number}")
+        if not session.connected:
+            print("Serial port not connected. Skipping taps.")
+            return False
+
+        rows = []
+        try:
+            session.reset_input()
+            with session.tap_window():
+                for tap_digit, tap_type, intensity in (('0', 'Fixed', fixed_intensity),
+                                                       ('1', 'Variable', variable_intensity)):
+                    print(f"Sending {tap_type.lower()} tap: intensity = {intensity}, Condition = {condition}")
+                    command = session.tap_command(tap_digit, condition, fixed_intensity, variable_intensity)
+                    session.ser.write(command.encode())
+                    timestamp = time.time()
+                    rows.append([session.trial_number, condition, tap_type, intensity, timestamp,
+                                 self.measure(session)])
+        except Exception as e:
+            print(f"Error during serial communication: {e}")
+            return False
+        finally:
+            self.log_taps(session, condition, rows)
+        return True
+
+    def log_taps(self, session, condition, rows):
+        """
+        Writes the measured taps to the tap CSV and the trial database, and releases any force windows.
+        """
+        session.stage_taps(rows, self.measurement_column)
+        if self.measurement_column and rows:
+            csv_filename = get_tap_csv_filename(session.participant_name, session.config.paths)
+            if write_tap_rows(csv_filename, rows, self.measurement_column):
+                print(f"Data logged to {csv_filename} for trial {session.trial_number}, condition {condition}.")
+        for row in rows:
+            if isinstance(row[-1], ForceWindow):
+                row[-1].release()
+
+
+class NoMeasurement(TapStrategy):
+    """
+    Sends the taps without measuring them.
+    """
+
+    name = 'none'
+    tap_interval = 0.5  # Seconds between the taps
+
+    def measure(self, session):
+        time.sleep(self.tap_interval)
+        return None
+
+
+class AckOnly(TapStrategy):
+    """
+    Reads and prints the Arduino's reply to each tap (no force data is stored).
+    """
+
+    name = 'ack'
+    tap_interval = 0.5
+
+    def measure(self, session):
+        time.sleep(self.tap_interval)
+        response = session.ser.readline().decode('utf-8').strip()
+        print(f"Arduino response after tap: {response}")
+        return response
+
+
+class PeakInWindow(TapStrategy):
+    """
+    Stores the highest force read during a short window after each tap, found
+    in the pinned ForceWindow itself (no copy of the samples is made).
+    """
+
+    name = 'peak'
+    measurement_column = 'MaxForce'
+    settle_time = 0.1  # Delay between the tap command and the measurement window
+
+    def measure(self, session):
+        time.sleep(self.settle_time)
+        window = session.read_force_window(session.config.protocol.peak_window_duration)
+        force = 0
+        if window is None or not len(window):
+            print("Force measurement failed for tap.")
+        else:
+            with window:
+                force = float(window.values.max())
+        print(f"Highest force during tap: {force}")
+        return force
+
+
+class FullTrace(TapStrategy):
+    """
+    Stores every force sample read after each tap, as a pinned ForceWindow.
+    """
+
+    name = 'trace'
+    measurement_column = 'Force Data'
+
+    def measure(self, session):
+        window = session.read_force_window(session.config.protocol.force_window_duration)
+        return window if window is not None else []
+
+
+class ChannelTraces(TapStrategy):
+    """
+    Stores the samples of every enabled sensor channel after each tap, one tap CSV per channel.
+    """
+
+    name = 'channels'
+    measurement_column = 'Force Data'
+
+    def measure(self, session):
+        windows = session.read_channel_windows(session.config.protocol.force_window_duration)
+        return windows if windows is not None else {}
+
+    def log_taps(self, session, condition, rows):
+        for channel in session.channel_layout.names:
+            channel_rows = [row[:-1] + [row[-1].get(channel, [])] for row in rows]
+            session.stage_taps(channel_rows, self.measurement_column if channel == 'force' else channel)
+            if channel_rows:
+                csv_filename = get_tap_csv_filename(session.participant_name, session.config.paths, channel)
+                if write_tap_rows(csv_filename, channel_rows, self.measurement_column):
+                    print(f"Data logged to {csv_filename} for trial {session.trial_number}, condition {condition}.")
+        for row in rows:
+            for window in row[-1].values():
+                window.release()
+
+
+tap_strategies = {strategy.name: strategy for strategy in (NoMeasurement, PeakInWindow, FullTrace, AckOnly,
+                                                           ChannelTraces)}
+
+
+def make_tap_strategy(name):
+    """
+    Returns a new strategy instance by its config name.
+    """
+    try:
+        return tap_strategies[name]()
+    except KeyError:
+        raise ValueError(f"Unknown tap strategy '{name}'; choose one of {', '.join(tap_strategies)}")
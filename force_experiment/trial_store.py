@@ -0,0 +1,286 @@
+"""
+SQLite trial database shared by all sessions.
+
+Every session, trial and tap is stored in one database file (data/trials.sqlite
+by default, set with [paths] trial_database) in WAL mode: each trial and its taps
+are committed in one transaction, readers never block the running session, and
+cross-session questions are index lookups instead of scans over CSV files:
+
+    SELECT participant, overall_trial, reference_level FROM trials
+    WHERE condition = 5 AND reference_level > 5;
+
+The per-session CSV files are still written, and export_csv() recreates them
+from the database:
+
+    python -m force_experiment.trial_store export --db data/trials.sqlite --output-dir export
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from force_buffer import ForceWindow
+from force_stream import sensor_channels
+from .storage import sanitize_participant_name, tap_csv_basename, tap_fieldnames, tap_measurement, trial_fieldnames
+
+# --------------------------- Configuration ---------------------------
+
+schema = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    participant TEXT NOT NULL,
+    started REAL NOT NULL,
+    tap_strategy TEXT,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS trials (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    participant TEXT NOT NULL,
+    condition INTEGER NOT NULL,
+    quest_key TEXT,
+    overall_trial INTEGER,
+    specific_trial INTEGER,
+    probe_level REAL,
+    reference_level REAL,
+    response TEXT,
+    trial_duration REAL,
+    recorded REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS taps (
+    id INTEGER PRIMARY KEY,
+    trial_id INTEGER NOT NULL REFERENCES trials(id),
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    participant TEXT NOT NULL,
+    tap_trial INTEGER,
+    condition INTEGER,
+    tap_type TEXT,
+    intensity REAL,
+    timestamp REAL,
+    measurement_column TEXT,
+    measurement TEXT
+);
+CREATE INDEX IF NOT EXISTS trials_participant ON trials(participant);
+CREATE INDEX IF NOT EXISTS trials_condition ON trials(condition, reference_level);
+CREATE INDEX IF NOT EXISTS trials_quest_key ON trials(quest_key);
+CREATE INDEX IF NOT EXISTS trials_session ON trials(session_id, overall_trial);
+CREATE INDEX IF NOT EXISTS taps_trial ON taps(trial_id);
+CREATE INDEX IF NOT EXISTS taps_participant ON taps(participant, condition);
+"""
+
+# --------------------------- Functions ---------------------------
+
+
+def connect(database):
+    """
+    Opens the trial database in WAL mode and creates the schema if needed.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+    connection = sqlite3.connect(database, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=FULL")  # A committed trial survives a power cut
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.executescript(schema)
+    return connection
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _measurement(value):
+    """
+    Encodes a tap measurement (a number, a force window or text) as JSON.
+    Force windows are encoded with tap_measurement(): NaN for lost samples, null if overwritten.
+    """
+    return json.dumps(tap_measurement(value))
+
+
+def _staged_measurement(value):
+    """
+    Encodes a tap measurement when it is staged; force windows of a pinning ring are
+    retained instead and encoded on commit. Shared-ring windows are copied now, as the
+    acquisition process may overwrite them before the trial is written.
+    """
+    if isinstance(value, ForceWindow) and value.buffer.pins_windows:
+        return value.retain()
+    return _measurement(value)
+
+
+class TrialStore:
+    """
+    Writes one session's trials and taps to the trial database.
+
+    Tap rows are staged as the taps are measured and committed together with
+    their trial in add_trial(). Only one thread writes at a time (the trial loop
+    or the pipelined I/O worker).
+    """
+
+    def __init__(self, database, participant_name, tap_strategy=None, config=None):
+        self.database = database
+        self.connection = connect(database)
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO sessions (participant, started, tap_strategy, config) VALUES (?, ?, ?, ?)",
+                (participant_name, time.time(), tap_strategy, json.dumps(config) if config else None))
+        self.session_id = cursor.lastrowid
+        self.participant_name = participant_name
+
+    def tap_records(self, rows, measurement_column):
+        """
+        Converts tap CSV rows into tap records. Pinned force windows are not copied: the records
+        share them with the tap CSV writer (retained) until add_trial() commits and releases them.
+        """
+        return [(row[0], row[1], row[2], _number(row[3]), _number(row[4]), measurement_column,
+                 _staged_measurement(row[5]) if len(row) > 5 else None) for row in rows]
+
+    def add_trial(self, trial_data, tap_records=(), quest_key=None):
+        """
+        Commits one trial row (in trial CSV layout) and its tap records in one transaction.
+        The tap records' force windows are released afterwards, even if the commit fails.
+        """
+        try:
+            return self._insert_trial(trial_data, tap_records, quest_key)
+        finally:
+            for record in tap_records:
+                if isinstance(record[-1], ForceWindow):
+                    record[-1].release()
+
+    def _insert_trial(self, trial_data, tap_records, quest_key):
+        condition = str(trial_data['Condition']).replace('Condition', '').strip()
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO trials (session_id, participant, condition, quest_key, overall_trial, specific_trial, "
+                "probe_level, reference_level, response, trial_duration, recorded) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.session_id, self.participant_name, int(condition), quest_key, trial_data['OverallTrial'],
+                 trial_data['SpecificTrial'], _number(trial_data['ProbeLevel']),
+                 _number(trial_data['ReferenceLevel']), trial_data['Response'],
+                 _number(trial_data['TrialDuration']), time.time()))
+            self.connection.executemany(
+                "INSERT INTO taps (trial_id, session_id, participant, tap_trial, condition, tap_type, intensity, "
+                "timestamp, measurement_column, measurement) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(cursor.lastrowid, self.session_id, self.participant_name) + record[:-1]
+                 + (_measurement(record[-1]) if isinstance(record[-1], ForceWindow) else record[-1],)
+                 for record in tap_records])
+        return cursor.lastrowid
+
+    def close(self):
+        self.connection.close()
+
+
+def find_trials(connection, participant=None, condition=None, min_reference_level=None, quest_key=None):
+    """
+    Returns trial rows (as dictionaries) matching every given filter, across sessions.
+    """
+    clauses, parameters = [], []
+    for clause, value in (("participant = ?", participant), ("condition = ?", condition),
+                          ("reference_level > ?", min_reference_level), ("quest_key = ?", quest_key)):
+        if value is not None:
+            clauses.append(clause)
+            parameters.append(value)
+    query = "SELECT * FROM trials" + (" WHERE " + " AND ".join(clauses) if clauses else "")
+    cursor = connection.execute(query + " ORDER BY session_id, overall_trial", parameters)
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+def export_csv(database, output_directory, session_id=None):
+    """
+    Writes each session's trial CSV and each participant's tap CSVs (one per sensor
+    channel) in the layouts of initialize_csv() and write_tap_rows(). A session whose
+    taps were measured into another column than the participant's tap CSV holds
+    (e.g. MaxForce after Force Data) gets a tap CSV of its own instead of being
+    appended. Existing files are replaced, so exporting twice gives the same files.
+    Returns the paths written.
+    """
+    connection = connect(database)
+    os.makedirs(output_directory, exist_ok=True)
+    sessions = connection.execute("SELECT id, participant, started FROM sessions" +
+                                  (" WHERE id = ?" if session_id is not None else ""),
+                                  () if session_id is None else (session_id,)).fetchall()
+    written = []
+    tap_columns = {}  # Tap CSV path -> measurement column in its header
+    for sid, participant, started in sessions:
+        name = sanitize_participant_name(participant) or "unknown_participant"
+        trials = connection.execute(
+            "SELECT condition, overall_trial, specific_trial, probe_level, reference_level, response, "
+            "trial_duration FROM trials WHERE session_id = ? ORDER BY overall_trial", (sid,)).fetchall()
+        if not trials:
+            continue
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+        path = os.path.join(output_directory, f"participant_{name}_{stamp}.csv")
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=trial_fieldnames)
+            writer.writeheader()
+            for condition, overall, specific, probe, reference, response, duration in trials:
+                writer.writerow({'SubjectID': participant, 'Condition': f"Condition {condition}",
+                                 'OverallTrial': overall, 'SpecificTrial': specific, 'ProbeLevel': probe,
+                                 'ReferenceLevel': reference, 'Response': response, 'TrialDuration': duration})
+        written.append(path)
+
+        taps = connection.execute(
+            "SELECT tap_trial, condition, tap_type, intensity, timestamp, measurement_column, measurement "
+            "FROM taps WHERE session_id = ? AND measurement_column IS NOT NULL ORDER BY id", (sid,)).fetchall()
+        by_column = {}
+        for row in taps:
+            by_column.setdefault(row[5], []).append(row)
+        for column, rows in by_column.items():
+            # Extra sensor channels are stored under their name and written with a Force Data column
+            channel, header = (column, 'Force Data') if column in sensor_channels else ('force', column)
+            path = os.path.join(output_directory, tap_csv_basename(name, channel))
+            if tap_columns.get(path, header) != header:
+                suffix = "taps.csv" if channel == 'force' else f"{channel}_taps.csv"
+                session_path = os.path.join(output_directory, f"participant_{name}_{stamp}_{suffix}")
+                print(f"Session {sid} stored {header} taps but {path} holds {tap_columns[path]}; "
+                      f"writing them to {session_path}.")
+                path = session_path
+            new_file = path not in tap_columns  # A participant's later sessions append to this run's file
+            with open(path, 'w' if new_file else 'a', newline='') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(tap_fieldnames + [header])
+                writer.writerows([row[:5] + (json.loads(row[6]) if row[6] else '',) for row in rows])
+            if new_file:
+                tap_columns[path] = header
+                written.append(path)
+    connection.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or query the trial database.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help="Write the sessions as CSV files")
+    export_parser.add_argument('--db', required=True, help="Trial database")
+    export_parser.add_argument('--output-dir', required=True, help="Directory for the CSV files")
+    export_parser.add_argument('--session', type=int, default=None, help="Only this session id")
+    query_parser = subparsers.add_parser('trials', help="List matching trials across sessions")
+    query_parser.add_argument('--db', required=True, help="Trial database")
+    query_parser.add_argument('--participant', default=None)
+    query_parser.add_argument('--condition', type=int, default=None)
+    query_parser.add_argument('--min-reference-level', type=float, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        for path in export_csv(args.db, args.output_dir, args.session):
+            print(f"Wrote {path}")
+        return 0
+
+    connection = connect(args.db)
+    rows = find_trials(connection, args.participant, args.condition, args.min_reference_level)
+    for row in rows:
+        print(f"{row['participant']}\tsession {row['session_id']}\ttrial {row['overall_trial']}\t"
+              f"condition {row['condition']}\treference {row['reference_level']}\t{row['response']}")
+    print(f"{len(rows)} trials")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
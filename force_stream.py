@@ -0,0 +1,342 @@
+import re
+
+import numpy
+
+# --------------------------- Configuration ---------------------------
+
+# Numeric field of a force line ("Force sensor difference: N" or a bare integer)
+force_value_pattern = re.compile(r"[-+]?\d*\.\d+|\d+")
+
+# Prefixes of non-force lines sent by the firmware
+legacy_prefix = b"Force sensor difference:"  # Unnumbered force lines of the original firmware
+state_prefix = "STATE"  # Motion state tags: "STATE <name> <value> <micros>"
+sample_prefix = "F,"  # Sequence-numbered samples: "F,<seq>,<value>"
+sample_prefix_bytes = sample_prefix.encode()
+queue_prefixes = ("QACK", "QDONE", "QEND")  # Command queue reports
+
+# Bytes of a block of lines that holds nothing but numbers (StreamDecoder's fast path)
+numeric_bytes = b"0123456789+-., \t\r\n"
+sample_separators = bytes.maketrans(b"F,", b"  ")  # Turns a block of sample lines into plain numbers
+
+# Fixed sampling rate of the firmware (FORCE_SAMPLE_RATE_HZ in sketch_forcesensor.ino)
+sample_rate = 1000
+
+# Sequence numbers are unsigned 32-bit on the Arduino
+sequence_modulus = 2 ** 32
+
+# Sensor channels of the firmware, in the order their values follow the sequence
+# number in "F,<seq>,<value>[,<value>...]" lines (CHANNEL_* in sketch_forcesensor.ino).
+# A channel is sampled on every sequence number divisible by its rate divider.
+sensor_channels = {
+    'force': 1,  # Tapped hand, A6/A7 difference (the original single channel)
+    'hand_force': 2,  # Moving hand, A4/A5 difference
+    'carriage_accel': 4,  # Stepper carriage accelerometer axis, A0
+}
+
+# --------------------------- Functions ---------------------------
+
+
+def parse_stream_line(line):
+    """
+    Classifies one decoded line from the Arduino.
+    Returns a (kind, value) tuple where kind is:
+      'sample'  - value is a (sequence number, force) tuple from the fixed-rate stream
+      'force'   - value is the force reading as a float (legacy, unnumbered formats)
+      'state'   - value is a (name, value, micros) tuple from a motion state tag
+      'queue'   - value is the raw command queue report
+      'message' - value is any other text (e.g. "Moving servo to angle: 70")
+    """
+    if line.startswith(sample_prefix):
+        parts = line.split(',')
+        try:
+            return 'sample', (int(parts[1]), float(parts[2]))
+        except (IndexError, ValueError):
+            return 'message', line
+    if line.startswith(state_prefix):
+        parts = line.split()
+        try:
+            return 'state', (parts[1], int(parts[2]), int(parts[3]))
+        except (IndexError, ValueError):
+            return 'message', line
+    if line.startswith(queue_prefixes):
+        return 'queue', line
+
+    force_value_str = force_value_pattern.findall(line)
+    if force_value_str and (line.startswith("Force") or line[0].isdigit() or line[0] in "+-."):
+        return 'force', float(force_value_str[0])
+    return 'message', line
+
+
+def sequence_restarts(sequence_numbers):
+    """
+    Returns the indices at which the counter restarted (the firmware was reset or
+    reconnected): steps back by more than half the counter range, which a 32-bit
+    wraparound never produces.
+    """
+    seqs = numpy.asarray(sequence_numbers, dtype=numpy.int64)
+    if seqs.size < 2:
+        return numpy.empty(0, dtype=numpy.int64)
+    return numpy.flatnonzero(numpy.diff(seqs) % sequence_modulus >= sequence_modulus // 2) + 1
+
+
+def unwrap_sequence(sequence_numbers):
+    """
+    Returns the sequence numbers as a monotonically increasing int64 array,
+    undoing the 32-bit wraparound of the firmware counter. After a restart (see
+    sequence_restarts()) the new segment continues right after the old one, so
+    no samples are counted as lost there.
+    """
+    seqs = numpy.asarray(sequence_numbers, dtype=numpy.int64)
+    if seqs.size < 2:
+        return seqs
+    steps = numpy.diff(seqs) % sequence_modulus
+    steps[steps >= sequence_modulus // 2] = 1
+    return numpy.concatenate(([seqs[0]], seqs[0] + numpy.cumsum(steps)))
+
+
+def summarize_sequence(sequence_numbers):
+    """
+    Detects gaps in a run of sample sequence numbers.
+    Returns a dictionary with the received and expected sample counts, the number
+    of lost samples, the loss percentage, a list of (first missing seq, count) gaps
+    and the number of counter restarts (not counted as gaps).
+    """
+    seqs = unwrap_sequence(sequence_numbers)
+    if seqs.size == 0:
+        return {'received': 0, 'expected': 0, 'lost': 0, 'loss_percent': 0.0, 'gaps': [], 'restarts': 0}
+
+    expected = int(seqs[-1] - seqs[0] + 1)
+    steps = numpy.diff(seqs)
+    gap_index = numpy.flatnonzero(steps > 1)
+    gaps = [(int(seqs[i] + 1), int(steps[i] - 1)) for i in gap_index]
+    lost = expected - int(seqs.size)
+    return {
+        'received': int(seqs.size),
+        'expected': expected,
+        'lost': lost,
+        'loss_percent': 100.0 * lost / expected,
+        'gaps': gaps,
+        'restarts': int(sequence_restarts(sequence_numbers).size),
+    }
+
+
+def uniform_time_base(sequence_numbers, values, rate=sample_rate, start_time=0.0, step=1):
+    """
+    Places samples on a uniform time grid derived from their sequence numbers.
+    step is the channel's rate divider (a sample on every step-th sequence number).
+    Returns (times, forces) NumPy arrays covering every expected sample from the
+    first to the last one; lost samples are NaN in forces.
+    """
+    seqs = unwrap_sequence(sequence_numbers)
+    if seqs.size == 0:
+        return numpy.empty(0), numpy.empty(0)
+
+    offsets = (seqs - seqs[0]) // step
+    forces = numpy.full(int(offsets[-1]) + 1, numpy.nan)
+    forces[offsets] = numpy.asarray(values, dtype=float)
+    times = start_time + numpy.arange(forces.size) * step / rate
+    return times, forces
+
+
+class ChannelLayout:
+    """
+    Which sensor channels are enabled and where their values sit in a sample line.
+    The firmware only sends the values of enabled channels that are due at a
+    sequence number, so the layout is needed to demultiplex the stream.
+    """
+
+    def __init__(self, channels=('force',), rate=sample_rate):
+        unknown = [name for name in channels if name not in sensor_channels]
+        if unknown:
+            raise ValueError(f"Unknown sensor channel(s): {', '.join(unknown)}")
+        self.names = [name for name in sensor_channels if name in channels]  # Firmware order
+        self.dividers = numpy.array([sensor_channels[name] for name in self.names], dtype=numpy.int64)
+        self.rate = rate
+
+    @property
+    def mask(self):
+        """
+        Bit mask of the enabled channels for the firmware's CHANNELS command.
+        """
+        return sum(1 << index for index, name in enumerate(sensor_channels) if name in self.names)
+
+    def channel_rate(self, name):
+        return self.rate / sensor_channels[name]
+
+
+def decode_samples(lines, layout):
+    """
+    Demultiplexes a block of "F,<seq>,<value>[,<value>...]" lines in one pass.
+    Returns a dictionary of channel name -> (sequence numbers, values) NumPy arrays
+    and the number of malformed lines that were skipped.
+    """
+    empty = {name: (numpy.empty(0, dtype=numpy.int64), numpy.empty(0)) for name in layout.names}
+    if not lines:
+        return empty, 0
+    bodies = [line[2:] if line.startswith(sample_prefix) else '' for line in lines]
+    counts = numpy.fromiter((body.count(',') + 1 if body else 0 for body in bodies), dtype=numpy.int64,
+                            count=len(bodies))
+    try:
+        fields = numpy.array(','.join(body for body in bodies if body).split(','), dtype=numpy.float64)
+    except ValueError:
+        # Some line holds a non-numeric field; fall back to dropping the offending lines
+        valid = [body for body in bodies if body and all(_is_number(field) for field in body.split(','))]
+        malformed = len(lines) - len(valid)
+        decoded, more = decode_samples([sample_prefix + body for body in valid], layout)
+        return decoded, malformed + more
+
+    present = counts > 0
+    starts = (numpy.cumsum(counts) - counts)[present]
+    counts = counts[present]
+    seqs = fields[starts].astype(numpy.int64)
+
+    # due[i, k]: channel k has a value in line i; its field follows the earlier due channels
+    due = (seqs[:, None] % layout.dividers[None, :]) == 0
+    positions = numpy.cumsum(due, axis=1)
+    well_formed = counts == 1 + due.sum(axis=1)
+    malformed = len(lines) - int(well_formed.sum())
+
+    decoded = {}
+    for index, name in enumerate(layout.names):
+        rows = due[:, index] & well_formed
+        decoded[name] = (seqs[rows], fields[starts[rows] + positions[rows, index]])
+    return decoded, malformed
+
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+class StreamDecoder:
+    """
+    Chunk decoder for the text stream in every format the firmware has used:
+    "F,<seq>,<value>[,<value>...]" samples, "Force sensor difference: N" and
+    bare numbers, mixed with STATE tags, queue reports and messages.
+
+    feed() takes raw bytes as read from the port, decodes all complete lines in
+    one call and keeps the unfinished last line for the next chunk. A block that
+    holds nothing but numbers once the line prefixes are stripped is parsed with
+    a single NumPy call; other blocks fall back to a per-line parse. Lines that
+    look like samples but do not parse are counted in malformed.
+    """
+
+    def __init__(self, layout=None):
+        self.layout = layout or ChannelLayout()
+        self.partial = b''
+        self.resync = False  # Skip to the next line start (the input buffer was cleared mid-line)
+        self.sequenced = False  # Sample lines were seen: unnumbered numbers are fragments of them
+        self.lines = 0
+        self.malformed = 0
+
+    def feed(self, chunk):
+        """
+        Decodes the complete lines in partial + chunk. Returns (samples, forces, lines):
+        samples is a decode_samples() style {channel: (sequence numbers, values)} of the
+        sample lines, forces a NumPy array of the unnumbered force readings and lines a
+        list of the other (non-empty) lines as text, e.g. for parse_stream_line().
+        """
+        data = self.partial + chunk
+        if self.resync:
+            start = data.find(b'\n')
+            if start < 0:
+                self.partial = b''
+                return {}, numpy.empty(0), []
+            data, self.resync = data[start + 1:], False
+        end = data.rfind(b'\n')
+        if end < 0:
+            self.partial = data
+            return {}, numpy.empty(0), []
+        self.partial = data[end + 1:]
+        return self._decode(data[:end])
+
+    def flush(self):
+        """
+        Decodes the unfinished last line, e.g. at the end of a recording.
+        """
+        data, self.partial = self.partial, b''
+        return self._decode(data)
+
+    def reset(self):
+        """
+        Drops the unfinished line after the port's input buffer was cleared; decoding
+        resumes at the next line start.
+        """
+        self.partial, self.resync = b'', True
+
+    def _decode(self, block):
+        if not block or block.isspace():
+            return {}, numpy.empty(0), []
+        line_count = block.count(b'\n') + 1
+        body = block.replace(legacy_prefix, b'') if legacy_prefix in block else block
+        sequenced = sample_prefix_bytes in body
+        if sequenced:
+            body = body.translate(sample_separators)
+        if not body.translate(None, numeric_bytes):
+            decoded = self._decode_numbers(body, line_count, sequenced)
+            if decoded is not None:
+                self.lines += line_count
+                return decoded
+        return self._decode_lines(block)
+
+    def _decode_numbers(self, body, line_count, sequenced):
+        """
+        Parses a block of numbers, one force reading or one single-channel sample per line.
+        Returns None if the block does not have that shape.
+        """
+        if sequenced and self.layout.names != ['force']:
+            return None  # Lines carry a varying number of channel values
+        if not sequenced and (self.sequenced or b',' in body):
+            return None
+        dtype = numpy.float64 if b'.' in body else numpy.int64  # Integers parse much faster
+        try:
+            fields = numpy.fromstring(body, dtype=dtype, sep=' ')
+        except ValueError:
+            return None
+        if len(fields) != (2 if sequenced else 1) * line_count:
+            return None
+        if not sequenced:
+            return {}, fields.astype(numpy.float64), []
+        self.sequenced = True
+        return ({'force': (fields[0::2].astype(numpy.int64, copy=False), fields[1::2].astype(numpy.float64))},
+                numpy.empty(0), [])
+
+    def _decode_lines(self, block):
+        sample_lines, forces, lines = [], [], []
+        for raw in block.split(b'\n'):
+            line = raw.decode('utf-8', errors='replace').strip()
+            if not line:
+                continue
+            self.lines += 1
+            if line.startswith(sample_prefix):
+                sample_lines.append(line)
+                continue
+            kind, value = parse_stream_line(line)
+            if kind != 'force':
+                lines.append(line)
+            elif self.sequenced:
+                self.malformed += 1  # What is left of a sample line cut by a cleared input buffer
+            else:
+                forces.append(value)
+        samples = {}
+        if sample_lines:
+            self.sequenced = True
+            samples, malformed = decode_samples(sample_lines, self.layout)
+            self.malformed += malformed
+        return samples, numpy.array(forces, dtype=numpy.float64), lines
+
+
+def print_loss_report(sequence_numbers, label="Force window"):
+    """
+    Prints the sample loss of a window if any samples were dropped, and any counter restarts.
+    """
+    summary = summarize_sequence(sequence_numbers)
+    if summary['restarts']:
+        print(f"{label}: {summary['restarts']} sample counter restart(s) (device reset or reconnect).")
+    if summary['lost']:
+        print(f"{label}: lost {summary['lost']} of {summary['expected']} samples "
+              f"({summary['loss_percent']:.2f}%) in {len(summary['gaps'])} gaps.")
+    return summary
@@ -0,0 +1,185 @@
+"""
+Acceleration-limited stepper motion profiles computed on the host.
+
+The firmware steps a plain 'M' move at one constant period (stepPeriodFor()),
+starting and stopping at full speed. A profile instead ramps the step rate from
+start_speed up to the move's speed at a fixed acceleration, cruises, and ramps
+down again (a trapezoid in speed over time; a triangle for moves too short to
+reach full speed). Only the ramp is uploaded: up to profile_segments runs of
+equal step intervals ("PROFILE <slot> <cruise us> <steps>x<us>,..."), which the
+firmware replays forwards at the start of a move and backwards at its end. A
+profile depends only on the speed, so one slot per speed is uploaded once per
+session and referenced by the 'P' entries of a command queue timeline.
+"""
+import time
+
+import numpy
+
+from command_queue import iteration_step
+
+# --------------------------- Configuration ---------------------------
+
+# Must match the firmware (PROFILE_SLOTS and PROFILE_SEGMENTS in sketch_forcesensor.ino)
+profile_slots = 4
+profile_segments = 8
+max_interval_us = 65535  # Step intervals are unsigned 16-bit on the Arduino
+
+# Condition speeds follow the firmware's convention that STEP is held high and
+# low for iteration_step / speed each, so one step period covers this distance
+nominal_step = 2 * iteration_step
+
+# --------------------------- Functions ---------------------------
+
+
+def steps_for_distance(distance):
+    """
+    Returns the whole number of steps for a distance in cm.
+    """
+    return int(round(distance / iteration_step))
+
+
+def ramp_intervals(speed, acceleration, start_speed):
+    """
+    Returns the step intervals (seconds) that accelerate from start_speed to speed.
+    Step k ends where the constant-acceleration motion has covered k steps.
+    """
+    start_speed = min(start_speed, speed)
+    ramp_steps = int(numpy.ceil((speed ** 2 - start_speed ** 2) / (2 * acceleration * nominal_step)))
+    if ramp_steps <= 0:
+        return numpy.empty(0)
+    positions = numpy.arange(ramp_steps + 1) * nominal_step
+    times = (numpy.sqrt(start_speed ** 2 + 2 * acceleration * positions) - start_speed) / acceleration
+    return numpy.diff(times)
+
+
+def step_intervals(steps, speed, acceleration, start_speed):
+    """
+    Returns the interval (seconds) before each of steps steps of a full trapezoidal move.
+    """
+    ramp = ramp_intervals(speed, acceleration, start_speed)
+    cruise = nominal_step / speed
+    index = numpy.arange(steps)
+    distance_to_edge = numpy.minimum(index, steps - 1 - index)
+    padded = numpy.append(ramp, cruise)
+    return padded[numpy.minimum(distance_to_edge, len(ramp))]
+
+
+def compress_ramp(intervals, segments=profile_segments):
+    """
+    Groups ramp intervals into at most segments runs of one interval each, with
+    boundaries spaced evenly in log(interval). Each run keeps its total duration.
+    Returns a list of (steps, interval_us) tuples.
+    """
+    if len(intervals) == 0:
+        return []
+    logs = numpy.log(intervals)
+    edges = numpy.linspace(logs.min(), logs.max(), segments + 1)[1:-1]
+    # Intervals shrink along the ramp, so the bin index only ever decreases
+    bins = numpy.searchsorted(edges, logs, side='right')
+    runs = []
+    for bin_index in numpy.unique(bins)[::-1]:
+        members = intervals[bins == bin_index]
+        interval_us = min(max_interval_us, int(round(members.mean() * 1000000)))
+        runs.append((len(members), interval_us))
+    return runs
+
+
+class MotionProfile:
+    """
+    The uploaded ramp of one speed: the runs of step intervals and the cruise interval.
+    """
+
+    __slots__ = ('slot', 'speed', 'cruise_us', 'ramp')
+
+    def __init__(self, slot, speed, acceleration, start_speed, segments=profile_segments):
+        self.slot = slot
+        self.speed = speed
+        self.cruise_us = min(max_interval_us, 2 * int(iteration_step / speed * 1000000))  # stepPeriodFor()
+        self.ramp = compress_ramp(ramp_intervals(speed, acceleration, start_speed), segments)
+
+    @property
+    def ramp_steps(self):
+        return sum(steps for steps, interval_us in self.ramp)
+
+    def intervals_us(self, steps):
+        """
+        Returns the step intervals the firmware will use for a move of steps steps.
+        """
+        ramp = numpy.repeat([interval_us for count, interval_us in self.ramp],
+                            [count for count, interval_us in self.ramp])
+        index = numpy.arange(steps)
+        distance_to_edge = numpy.minimum(index, steps - 1 - index)
+        padded = numpy.append(ramp, self.cruise_us).astype(numpy.int64)
+        return padded[numpy.minimum(distance_to_edge, len(ramp))]
+
+    def duration(self, steps):
+        """
+        Returns the nominal duration of a move of steps steps in seconds.
+        """
+        return int(self.intervals_us(steps).sum()) / 1000000
+
+    def encode(self):
+        """
+        Returns the PROFILE command line for this profile.
+        """
+        fields = ["PROFILE", str(self.slot), str(self.cruise_us)]
+        if self.ramp:
+            fields.append(','.join(f"{count}x{interval_us}" for count, interval_us in self.ramp))
+        return ' '.join(fields) + "\n"
+
+
+class MotionPlanner:
+    """
+    Computes and caches one profile per speed and uploads them to the Arduino.
+    """
+
+    def __init__(self, acceleration=20.0, start_speed=1.0):
+        self.acceleration = acceleration
+        self.start_speed = start_speed
+        self.profiles = {}  # Speed -> MotionProfile
+        self.uploaded = set()  # Slots acknowledged by the firmware
+
+    def profile_for(self, speed):
+        """
+        Returns the cached profile for a speed, creating it in the next free slot.
+        """
+        profile = self.profiles.get(speed)
+        if profile is None:
+            if len(self.profiles) >= profile_slots:
+                raise ValueError(f"The firmware holds {profile_slots} motion profiles; "
+                                 f"{len(self.profiles) + 1} speeds were requested.")
+            profile = MotionProfile(len(self.profiles), speed, self.acceleration, self.start_speed)
+            self.profiles[speed] = profile
+        return profile
+
+    def plan(self, speeds):
+        for speed in speeds:
+            self.profile_for(speed)
+        return self
+
+    def upload(self, ser, timeout=1.0):
+        """
+        Sends every planned profile that is not on the Arduino yet and waits for
+        its "PACK <slot>" acknowledgement. Returns True if all were accepted.
+        """
+        for profile in self.profiles.values():
+            if profile.slot in self.uploaded:
+                continue
+            ser.write(profile.encode().encode())
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                line = ser.readline().decode('utf-8', errors='replace').strip()
+                if line.startswith("PACK"):
+                    if line != f"PACK {profile.slot}":
+                        print(f"Arduino rejected motion profile {profile.slot}: {line}")
+                        return False
+                    self.uploaded.add(profile.slot)
+                    break
+            else:
+                print(f"No acknowledgement received for motion profile {profile.slot}.")
+                return False
+        return True
+
+    def has_profile(self, speed):
+        profile = self.profiles.get(speed)
+        return profile is not None and profile.slot in self.uploaded
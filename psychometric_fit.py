@@ -0,0 +1,293 @@
+"""
+Fits psychometric functions to every (participant, session, condition, set) at once.
+
+All staircases are fitted in one batched grid computation over NumPy arrays:
+the log-likelihood of every group is evaluated on a threshold x slope grid,
+giving maximum-likelihood estimates and the grid-posterior mean and SD of the
+threshold. Bootstrap confidence intervals are computed in parallel by
+resampling responses from the fitted functions.
+
+Input is the cohort .npz from aggregate_sessions.py or one or more trial CSVs:
+
+    python psychometric_fit.py cohort.npz --function weibull --bootstrap 1000 --output thresholds.csv
+
+Condition 8 rows carry no Response in the trial CSV and are skipped.
+"""
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+# --------------------------- Configuration ---------------------------
+
+# Parameter grids (intensities are the 1-7 servo levels used by the Quest staircases)
+threshold_grid = numpy.linspace(0.5, 7.5, 141)
+slope_grids = {
+    'weibull': numpy.geomspace(0.5, 30, 48),
+    'logistic': numpy.geomspace(0.1, 20, 48),
+}
+
+# "Which tap was stronger?" has no guessing floor; lapses allow for finger errors
+default_guess_rate = 0.0
+default_lapse_rate = 0.02
+
+# Responses counted as a positive ("second tap stronger") answer
+positive_responses = ('Second', 'Yes')
+negative_responses = ('First', 'No')
+
+level_resolution = 0.05  # Quest intensities are pooled to this resolution (servo steps are 0.1)
+
+# --------------------------- Model ---------------------------
+
+
+def psychometric(x, threshold, slope, function='weibull', guess_rate=default_guess_rate,
+                 lapse_rate=default_lapse_rate):
+    """
+    Evaluates a Weibull or logistic psychometric function (broadcasts over all arguments).
+    """
+    if function == 'weibull':
+        core = 1 - numpy.exp(-(numpy.maximum(x, 1e-9) / threshold) ** slope)
+    elif function == 'logistic':
+        core = 1 / (1 + numpy.exp(-slope * (x - threshold)))
+    else:
+        raise ValueError(f"Unknown psychometric function '{function}'")
+    return guess_rate + (1 - guess_rate - lapse_rate) * core
+
+
+# --------------------------- Data ---------------------------
+
+
+def load_trials(paths):
+    """
+    Loads trial rows from a cohort .npz or trial CSVs.
+    Returns a dictionary of column arrays: participant, session_index, condition,
+    overall_trial, specific_trial, reference_level, response.
+    """
+    if len(paths) == 1 and paths[0].endswith('.npz'):
+        with numpy.load(paths[0], allow_pickle=False) as archive:
+            data = {name: archive[name] for name in archive.files}
+        data.setdefault('session_index', numpy.zeros(data['participant'].size, dtype=int))
+        return data
+
+    columns = {name: [] for name in ['participant', 'session_index', 'condition', 'overall_trial',
+                                     'specific_trial', 'reference_level', 'response']}
+    for session_index, path in enumerate(sorted(paths)):
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                condition = (row.get('Condition') or '').replace('Condition', '').strip()
+                try:
+                    columns['condition'].append(int(condition))
+                    columns['overall_trial'].append(int(row['OverallTrial']))
+                    columns['specific_trial'].append(int(row['SpecificTrial']))
+                    columns['reference_level'].append(float(row['ReferenceLevel']))
+                except (KeyError, ValueError):
+                    continue
+                columns['participant'].append(row.get('SubjectID', ''))
+                columns['session_index'].append(session_index)
+                columns['response'].append(row.get('Response', ''))
+    return {name: numpy.asarray(values) for name, values in columns.items()}
+
+
+def infer_set_numbers(data):
+    """
+    Returns the staircase set of every trial. The trial CSV has no Set column, but
+    SpecificTrial counts trials per staircase, so the n-th occurrence of a
+    SpecificTrial value within a participant's condition belongs to set n.
+    """
+    keys = numpy.char.add(numpy.char.add(data['participant'].astype(str), '|'),
+                          numpy.char.add(data['session_index'].astype(str), '|'))
+    keys = numpy.char.add(numpy.char.add(keys, data['condition'].astype(str)), '|')
+    keys = numpy.char.add(keys, data['specific_trial'].astype(str))
+
+    order = numpy.lexsort((data['overall_trial'], keys))
+    sorted_keys = keys[order]
+    starts = numpy.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+    group_start = numpy.maximum.accumulate(numpy.where(starts, numpy.arange(order.size), 0))
+    sets = numpy.empty(order.size, dtype=int)
+    sets[order] = numpy.arange(order.size) - group_start + 1
+    return sets
+
+
+def group_trials(data):
+    """
+    Counts responses per group and intensity level.
+    Returns (group keys, levels, positive counts, totals): levels holds the
+    intensities shared by all groups (rounded to level_resolution), and the
+    counts are dense [groups, levels] arrays.
+    """
+    response = data['response'].astype(str)
+    positive = numpy.isin(response, positive_responses)
+    valid = positive | numpy.isin(response, negative_responses)
+    sets = infer_set_numbers(data)
+
+    records = numpy.rec.fromarrays([
+        data['participant'].astype(str)[valid], data['session_index'][valid].astype(int),
+        data['condition'][valid].astype(int), sets[valid]],
+        names='participant,session_index,condition,set')
+    rounded = numpy.round(data['reference_level'][valid].astype(float) / level_resolution) * level_resolution
+
+    group_keys, group_index = numpy.unique(records, return_inverse=True)
+    levels, level_index = numpy.unique(rounded, return_inverse=True)
+    shape = (group_keys.size, levels.size)
+    flat_index = numpy.ravel_multi_index((group_index.ravel(), level_index.ravel()), shape)
+    size = group_keys.size * levels.size
+    totals = numpy.bincount(flat_index, minlength=size).reshape(shape).astype(float)
+    positives = numpy.bincount(flat_index, weights=positive[valid], minlength=size).reshape(shape)
+    return group_keys, levels, positives, totals
+
+
+# --------------------------- Fitting ---------------------------
+
+
+def log_probability_tables(levels, function, guess_rate, lapse_rate):
+    """
+    Returns log(p) and log(1 - p) of every level on the threshold x slope grid,
+    each as a [levels, grid points] array.
+    """
+    slope_grid = slope_grids[function]
+    p = psychometric(levels[:, None, None], threshold_grid[None, :, None], slope_grid[None, None, :],
+                     function, guess_rate, lapse_rate)
+    p = numpy.clip(p, 1e-9, 1 - 1e-9).reshape(levels.size, -1)
+    return numpy.log(p), numpy.log1p(-p)
+
+
+def grid_log_likelihood(positives, totals, log_p, log_q):
+    """
+    Returns the [groups, thresholds, slopes] log-likelihood of every group on the grid.
+    Because all groups share one table of levels this is two matrix products.
+    """
+    log_likelihood = positives @ log_p + (totals - positives) @ log_q
+    return log_likelihood.reshape(positives.shape[0], threshold_grid.size, -1)
+
+
+def summarize_grid(log_likelihood, function):
+    """
+    Returns the maximum-likelihood threshold and slope and the posterior mean and
+    SD of the threshold (flat prior on the grid) for every group.
+    """
+    slope_grid = slope_grids[function]
+    groups = log_likelihood.shape[0]
+    flat_best = log_likelihood.reshape(groups, -1).argmax(axis=1)
+    best_threshold, best_slope = numpy.unravel_index(flat_best, log_likelihood.shape[1:])
+
+    posterior = numpy.exp(log_likelihood - log_likelihood.max(axis=(1, 2), keepdims=True))
+    threshold_marginal = posterior.sum(axis=2)
+    threshold_marginal /= threshold_marginal.sum(axis=1, keepdims=True)
+    mean = threshold_marginal @ threshold_grid
+    variance = threshold_marginal @ threshold_grid ** 2 - mean ** 2
+
+    return {
+        'threshold': threshold_grid[best_threshold],
+        'slope': slope_grid[best_slope],
+        'posterior_threshold': mean,
+        'posterior_threshold_sd': numpy.sqrt(numpy.maximum(variance, 0)),
+    }
+
+
+def fit_groups(levels, positives, totals, function='weibull', guess_rate=default_guess_rate,
+               lapse_rate=default_lapse_rate):
+    """
+    Fits every group at once.
+    Returns a dictionary of per-group arrays: threshold and slope (maximum likelihood),
+    posterior_threshold and posterior_threshold_sd.
+    """
+    log_p, log_q = log_probability_tables(levels, function, guess_rate, lapse_rate)
+    return summarize_grid(grid_log_likelihood(positives, totals, log_p, log_q), function)
+
+
+def _bootstrap_batch(args):
+    """
+    Worker: fits replicate response sets drawn from the fitted functions.
+    Returns a [replicates, groups] array of thresholds.
+    """
+    levels, totals, probabilities, function, guess_rate, lapse_rate, replicates, seed = args
+    rng = numpy.random.default_rng(seed)
+    # Single precision halves the cost of the matrix products; ranks are unaffected
+    log_p, log_q = (table.astype(numpy.float32) for table in
+                    log_probability_tables(levels, function, guess_rate, lapse_rate))
+    totals = totals.astype(numpy.float32)
+    thresholds = numpy.empty((replicates, totals.shape[0]))
+    for replicate in range(replicates):
+        positives = rng.binomial(totals.astype(int), probabilities).astype(numpy.float32)
+        log_likelihood = grid_log_likelihood(positives, totals, log_p, log_q)
+        flat_best = log_likelihood.reshape(totals.shape[0], -1).argmax(axis=1)
+        thresholds[replicate] = threshold_grid[numpy.unravel_index(flat_best, log_likelihood.shape[1:])[0]]
+    return thresholds
+
+
+def bootstrap_intervals(levels, totals, fit, function='weibull', guess_rate=default_guess_rate,
+                        lapse_rate=default_lapse_rate, replicates=1000, confidence=0.95, workers=None,
+                        seed=None):
+    """
+    Parametric bootstrap confidence intervals of the thresholds, computed in parallel.
+    Returns (lower, upper) arrays.
+    """
+    probabilities = psychometric(levels[None, :], fit['threshold'][:, None], fit['slope'][:, None],
+                                 function, guess_rate, lapse_rate)
+    workers = min(workers or os.cpu_count() or 1, replicates)
+    per_worker = [replicates // workers + (1 if i < replicates % workers else 0) for i in range(workers)]
+    seeds = numpy.random.SeedSequence(seed).spawn(workers)
+    jobs = [(levels, totals, probabilities, function, guess_rate, lapse_rate, count, child)
+            for count, child in zip(per_worker, seeds)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        samples = numpy.concatenate(list(pool.map(_bootstrap_batch, jobs)))
+    tail = (1 - confidence) / 2 * 100
+    return numpy.percentile(samples, tail, axis=0), numpy.percentile(samples, 100 - tail, axis=0)
+
+
+def write_results(path, group_keys, totals, fit, intervals=None):
+    """
+    Writes one row per fitted group.
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        header = ['SubjectID', 'Session', 'Condition', 'Set', 'Trials', 'Threshold', 'Slope',
+                  'PosteriorThreshold', 'PosteriorThresholdSD']
+        if intervals is not None:
+            header += ['ThresholdCILow', 'ThresholdCIHigh']
+        writer.writerow(header)
+        for index, key in enumerate(group_keys):
+            row = [key['participant'], int(key['session_index']), int(key['condition']), int(key['set']),
+                   int(totals[index].sum()), round(float(fit['threshold'][index]), 4),
+                   round(float(fit['slope'][index]), 4), round(float(fit['posterior_threshold'][index]), 4),
+                   round(float(fit['posterior_threshold_sd'][index]), 4)]
+            if intervals is not None:
+                row += [round(float(intervals[0][index]), 4), round(float(intervals[1][index]), 4)]
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit psychometric functions to every staircase.")
+    parser.add_argument('inputs', nargs='+', help="Cohort .npz or trial CSV files")
+    parser.add_argument('--function', choices=sorted(slope_grids), default='weibull')
+    parser.add_argument('--guess-rate', type=float, default=default_guess_rate)
+    parser.add_argument('--lapse-rate', type=float, default=default_lapse_rate)
+    parser.add_argument('--bootstrap', type=int, default=0, help="Bootstrap replicates (0 = no CIs)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default='thresholds.csv')
+    args = parser.parse_args()
+
+    group_keys, levels, positives, totals = group_trials(load_trials(args.inputs))
+    if not group_keys.size:
+        print("No trials with responses found.")
+        return 1
+    print(f"Fitting {group_keys.size} staircases...")
+    fit = fit_groups(levels, positives, totals, args.function, args.guess_rate, args.lapse_rate)
+
+    intervals = None
+    if args.bootstrap:
+        intervals = bootstrap_intervals(levels, totals, fit, args.function, args.guess_rate,
+                                        args.lapse_rate, replicates=args.bootstrap, workers=args.workers,
+                                        seed=args.seed)
+    write_results(args.output, group_keys, totals, fit, intervals)
+    print(f"Thresholds written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""
+Compiles seed-reproducible, counterbalanced trial schedules ahead of time.
+
+A schedule fixes the order of every (condition, set) trial of a session. It is
+generated offline from a seed, validated, and stored as a small JSON file that
+the experiment loads instantly at session start ([run] schedule_file in
+experiment.toml) instead of shuffling in front of the participant.
+
+Two layouts are supported:
+  blocked     - one block per condition (sets in sequence), as trial_order = "blocked";
+                block orders follow a balanced Latin square across participants
+  interleaved - all trials mixed; thousands of candidate orders are generated in
+                parallel and the best ones meeting the constraints (no long runs
+                of one condition, conditions balanced across session quarters) are kept
+
+The design (conditions, sets per condition and trials per set) is taken from
+[protocol] in the experiment config, or from --sets-per-condition and
+--trials-per-set, and stored in each schedule; load_schedule() refuses a
+schedule compiled for a different design than the session's.
+
+    python schedule_compiler.py --seed 2024 --participants 30 --mode interleaved --output schedules
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from experiment_config import ConfigError, load_config
+
+# --------------------------- Configuration ---------------------------
+
+schedule_version = 1
+max_code = 9  # Conditions and sets are stored as one digit per trial
+
+# Constraints for interleaved schedules
+default_max_run = 3  # Longest allowed run of trials from one condition
+default_position_blocks = 4  # Session quarters used for the position balance check
+default_max_imbalance = 3  # Max deviation of a condition's trial count per quarter
+default_candidates = 5000
+
+# --------------------------- Generation ---------------------------
+
+
+def balanced_latin_square(n):
+    """
+    Returns the rows of a Williams balanced Latin square for n conditions (0-based).
+    For odd n the mirrored rows are appended, giving 2n rows.
+    """
+    first = [0]
+    low, high = 1, n - 1
+    for position in range(1, n):
+        if position % 2:
+            first.append(low)
+            low += 1
+        else:
+            first.append(high)
+            high -= 1
+    rows = [[(value + shift) % n for value in first] for shift in range(n)]
+    if n % 2:
+        rows += [list(reversed(row)) for row in rows]
+    return rows
+
+
+def blocked_schedule(participant_index, seed, conditions, sets, trials):
+    """
+    Returns (conditions, sets) lists for a blocked session. The block order is the
+    participant's row of a balanced Latin square over seed-shuffled condition labels.
+    """
+    labels = list(range(1, conditions + 1))
+    random.Random(f"{seed}-labels").shuffle(labels)
+    rows = balanced_latin_square(conditions)
+    order = [labels[index] for index in rows[participant_index % len(rows)]]
+
+    condition_list, set_list = [], []
+    for condition in order:
+        for set_num in range(1, sets + 1):
+            condition_list += [condition] * trials
+            set_list += [set_num] * trials
+    return condition_list, set_list
+
+
+def interleaved_candidate(seed, candidate_index, conditions, sets, trials):
+    """
+    Returns one shuffled (conditions, sets) candidate, reproducible from the seed and index.
+    """
+    pairs = [(condition, set_num) for condition in range(1, conditions + 1)
+             for set_num in range(1, sets + 1) for _ in range(trials)]
+    random.Random(f"{seed}-{candidate_index}").shuffle(pairs)
+    return [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+
+
+def max_run_length(condition_list):
+    """
+    Returns the longest run of consecutive trials from the same condition.
+    """
+    longest = current = 0
+    previous = None
+    for condition in condition_list:
+        current = current + 1 if condition == previous else 1
+        longest = max(longest, current)
+        previous = condition
+    return longest
+
+
+def position_imbalance(condition_list, blocks=default_position_blocks):
+    """
+    Returns the largest deviation of any condition's trial count in a session
+    block from its expected count (trials are expected evenly spread).
+    """
+    counts = {}
+    block_size = len(condition_list) / blocks
+    for position, condition in enumerate(condition_list):
+        block = min(int(position / block_size), blocks - 1)
+        counts[(condition, block)] = counts.get((condition, block), 0) + 1
+    conditions = set(condition_list)
+    expected = len(condition_list) / len(conditions) / blocks
+    return max(abs(counts.get((condition, block), 0) - expected)
+               for condition in conditions for block in range(blocks))
+
+
+def score_candidates(job):
+    """
+    Worker: generates and scores a range of interleaved candidates.
+    Returns (max run, imbalance, candidate index) for the candidates meeting the constraints.
+    """
+    seed, design, start, stop, max_run, max_imbalance, blocks = job
+    accepted = []
+    for candidate_index in range(start, stop):
+        condition_list, _ = interleaved_candidate(seed, candidate_index, *design)
+        run = max_run_length(condition_list)
+        if run > max_run:
+            continue
+        imbalance = position_imbalance(condition_list, blocks)
+        if imbalance <= max_imbalance:
+            accepted.append((run, imbalance, candidate_index))
+    return accepted
+
+
+def search_interleaved(seed, count, design, candidates=default_candidates, max_run=default_max_run,
+                       max_imbalance=default_max_imbalance, blocks=default_position_blocks, workers=None):
+    """
+    Scores candidates of the design (conditions, sets, trials) in parallel and returns
+    the indices of the best count candidates.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, candidates // (workers * 4))
+    jobs = [(seed, design, start, min(start + chunk, candidates), max_run, max_imbalance, blocks)
+            for start in range(0, candidates, chunk)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        accepted = [result for batch in pool.map(score_candidates, jobs) for result in batch]
+    accepted.sort()
+    if len(accepted) < count:
+        raise RuntimeError(f"Only {len(accepted)} of {candidates} candidates meet the constraints; "
+                           f"{count} are needed. Increase --candidates or relax the constraints.")
+    return accepted[:count]
+
+
+# --------------------------- Schedule files ---------------------------
+
+
+def checksum(condition_codes, set_codes):
+    return hashlib.sha256(f"{condition_codes}|{set_codes}".encode()).hexdigest()[:16]
+
+
+def make_schedule(condition_list, set_list, design, **metadata):
+    """
+    Returns the schedule dictionary stored on disk for the design (conditions, sets, trials).
+    The order is kept as two digit strings (one character per trial), which keeps files
+    small and fast to load.
+    """
+    condition_codes = ''.join(str(condition) for condition in condition_list)
+    set_codes = ''.join(str(set_num) for set_num in set_list)
+    schedule = {
+        'version': schedule_version,
+        'total_conditions': design[0],
+        'total_sets_per_condition': design[1],
+        'trials_per_set': design[2],
+        'max_run': max_run_length(condition_list),
+        'imbalance': position_imbalance(condition_list),
+        'conditions': condition_codes,
+        'sets': set_codes,
+        'checksum': checksum(condition_codes, set_codes),
+    }
+    schedule.update(metadata)
+    return schedule
+
+
+def validate_schedule(schedule):
+    """
+    Checks a schedule's integrity and balance. Raises ValueError if it is invalid.
+    """
+    if schedule.get('version') != schedule_version:
+        raise ValueError(f"Unsupported schedule version {schedule.get('version')}")
+    condition_codes, set_codes = schedule['conditions'], schedule['sets']
+    if checksum(condition_codes, set_codes) != schedule['checksum']:
+        raise ValueError("Schedule checksum mismatch")
+    if len(condition_codes) != len(set_codes):
+        raise ValueError("Schedule condition and set lists differ in length")
+
+    counts = {}
+    for condition, set_num in zip(condition_codes, set_codes):
+        counts[(condition, set_num)] = counts.get((condition, set_num), 0) + 1
+    expected_keys = {(str(condition), str(set_num))
+                     for condition in range(1, schedule['total_conditions'] + 1)
+                     for set_num in range(1, schedule['total_sets_per_condition'] + 1)}
+    if set(counts) != expected_keys or any(count != schedule['trials_per_set'] for count in counts.values()):
+        raise ValueError("Schedule is not balanced across conditions and sets")
+
+
+def save_schedule(path, schedule):
+    validate_schedule(schedule)
+    with open(path, 'w') as f:
+        json.dump(schedule, f, separators=(',', ':'))
+
+
+def load_schedule(path, protocol=None):
+    """
+    Loads and validates a schedule file, and checks that it was compiled for the design
+    in protocol (the experiment config's [protocol]), if given. Raises ValueError otherwise.
+    Returns a list of (condition, set) tuples in presentation order.
+    """
+    with open(path) as f:
+        schedule = json.load(f)
+    validate_schedule(schedule)
+    if protocol is not None:
+        fields = ('total_conditions', 'total_sets_per_condition', 'trials_per_set')
+        mismatched = [f"{field} {schedule[field]} (config: {getattr(protocol, field)})"
+                      for field in fields if schedule[field] != getattr(protocol, field)]
+        if mismatched:
+            raise ValueError(f"Schedule {path} was compiled for a different design: {', '.join(mismatched)}")
+    return [(int(condition), int(set_num)) for condition, set_num in zip(schedule['conditions'], schedule['sets'])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile reproducible trial schedules.")
+    parser.add_argument('--seed', type=int, required=True, help="Master seed")
+    parser.add_argument('--participants', type=int, default=1, help="Number of schedules to compile")
+    parser.add_argument('--mode', choices=['blocked', 'interleaved'], default='blocked')
+    parser.add_argument('--candidates', type=int, default=default_candidates,
+                        help="Interleaved candidates to generate")
+    parser.add_argument('--max-run', type=int, default=default_max_run)
+    parser.add_argument('--max-imbalance', type=float, default=default_max_imbalance)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default='schedules', help="Output directory")
+    parser.add_argument('--config', default=None, help="Experiment config with the design (default: $EXPERIMENT_CONFIG or experiment.toml)")
+    parser.add_argument('--sets-per-condition', type=int, default=None, help="Override [protocol] total_sets_per_condition")
+    parser.add_argument('--trials-per-set', type=int, default=None, help="Override [protocol] trials_per_set")
+    args = parser.parse_args()
+
+    try:
+        protocol = load_config(args.config).protocol
+    except ConfigError as e:
+        print(f"Invalid experiment config: {e}")
+        return 2
+    design = (protocol.total_conditions, args.sets_per_condition or protocol.total_sets_per_condition,
+              args.trials_per_set or protocol.trials_per_set)
+    if design[0] > max_code or design[1] > max_code:
+        print(f"Schedules store conditions and sets as single digits; at most {max_code} of each are supported.")
+        return 2
+    print(f"Design: {design[0]} conditions x {design[1]} sets x {design[2]} trials")
+
+    os.makedirs(args.output, exist_ok=True)
+    if args.mode == 'interleaved':
+        chosen = search_interleaved(args.seed, args.participants, design, args.candidates, args.max_run,
+                                    args.max_imbalance, workers=args.workers)
+        print(f"Selected {len(chosen)} interleaved orders from {args.candidates} candidates.")
+
+    for participant_index in range(args.participants):
+        if args.mode == 'blocked':
+            condition_list, set_list = blocked_schedule(participant_index, args.seed, *design)
+            metadata = {'mode': 'blocked', 'seed': args.seed, 'participant_index': participant_index}
+        else:
+            candidate_index = chosen[participant_index][2]
+            condition_list, set_list = interleaved_candidate(args.seed, candidate_index, *design)
+            metadata = {'mode': 'interleaved', 'seed': args.seed, 'participant_index': participant_index,
+                        'candidate_index': candidate_index}
+        path = os.path.join(args.output, f"schedule_{args.seed}_{participant_index + 1:03d}.json")
+        save_schedule(path, make_schedule(condition_list, set_list, design, **metadata))
+        print(f"Schedule written to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
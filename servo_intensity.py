@@ -0,0 +1,130 @@
+"""
+Fine-grained tap intensities and the servo lookup table.
+
+The legacy tap command "0<condition><fixed><variable>" carries one digit per
+intensity, so the firmware only ever taps at whole levels (10 servo degrees
+each) whatever fraction the staircase asks for. Fine intensities are sent as
+three-digit codes in hundredths of a level ("T0<condition><fff><vvv>") and
+played with Servo.writeMicroseconds(). The pulse width of a code is
+interpolated from a table of lut_size pulse widths, one every lut_code_step
+codes, that is computed here from a calibration and uploaded at session start
+("LUT <us>,<us>,..." answered with "LACK <entries>"). Queued timelines skip
+the table and carry the pulse width itself ('U' entries).
+"""
+import re
+import time
+
+import numpy
+
+from command_queue import servo_degrees_per_level, servo_neutral_position
+
+# --------------------------- Configuration ---------------------------
+
+# Must match the firmware (LUT_SIZE, LUT_CODE_STEP, SERVO_MIN_PULSE and
+# SERVO_MAX_PULSE in sketch_forcesensor.ino)
+lut_size = 33
+lut_code_step = 25  # The table covers intensities 0 to 8 in quarter levels
+servo_min_pulse = 544  # Servo library pulse widths (us) for 0 and 180 degrees
+servo_max_pulse = 2400
+
+codes_per_level = 100
+max_code = 999
+
+# Tap commands: tap digit (0 fixed, 1 variable), condition, fixed and variable intensity
+legacy_tap_pattern = re.compile(r"^([01])(\d)(\d)(.+)$")
+fine_tap_pattern = re.compile(r"^T([01])(\d)(\d{3})(\d{3})$")
+
+# --------------------------- Functions ---------------------------
+
+
+def intensity_code(intensity):
+    """
+    Returns the three-digit code (hundredths of a level) of an intensity.
+    """
+    return min(max_code, max(0, int(round(intensity * codes_per_level))))
+
+
+def angle_pulse(angle):
+    """
+    Returns the pulse width (us) that Servo.write() uses for an angle.
+    """
+    return servo_min_pulse + angle * (servo_max_pulse - servo_min_pulse) / 180
+
+
+def tap_command(tap_digit, condition, fixed_intensity, variable_intensity, fine=False):
+    """
+    Returns the tap command line (without newline) in the legacy or the fine encoding.
+    """
+    if fine:
+        return f"T{tap_digit}{condition}{intensity_code(fixed_intensity):03d}{intensity_code(variable_intensity):03d}"
+    return f"{tap_digit}{condition}{fixed_intensity}{variable_intensity}"
+
+
+def parse_tap_command(text):
+    """
+    Parses a tap command in either encoding.
+    Returns (tap digit, condition, fixed intensity, variable intensity) with the
+    intensities as text, or None if text is not a tap command.
+    """
+    match = fine_tap_pattern.match(text)
+    if match:
+        tap_digit, condition, fixed_code, variable_code = match.groups()
+        return (tap_digit, int(condition), f"{int(fixed_code) / codes_per_level:g}",
+                f"{int(variable_code) / codes_per_level:g}")
+    match = legacy_tap_pattern.match(text)
+    if match:
+        tap_digit, condition, fixed_intensity, variable_intensity = match.groups()
+        return tap_digit, int(condition), fixed_intensity, variable_intensity
+    return None
+
+
+class IntensityTable:
+    """
+    The intensity -> servo pulse width table uploaded to the Arduino.
+
+    calibration is a list of (intensity, pulse us) points in increasing
+    intensity, e.g. measured with a force gauge; between and beyond them the
+    table is interpolated linearly. Without points it reproduces the legacy
+    mapping of 10 degrees per level above neutral.
+    """
+
+    def __init__(self, calibration=()):
+        intensities = numpy.arange(lut_size) * lut_code_step / codes_per_level
+        if calibration:
+            points = numpy.asarray(calibration, dtype=float)
+            pulses = numpy.interp(intensities, points[:, 0], points[:, 1])
+        else:
+            pulses = angle_pulse(servo_neutral_position + intensities * servo_degrees_per_level)
+        self.pulses = numpy.clip(numpy.round(pulses), servo_min_pulse, servo_max_pulse).astype(int)
+        self.uploaded = False
+
+    def pulse_width(self, intensity):
+        """
+        Returns the pulse width (us) the firmware plays for an intensity
+        (the same integer interpolation as pulseForCode()).
+        """
+        code = min(intensity_code(intensity), (lut_size - 1) * lut_code_step)
+        index = min(code // lut_code_step, lut_size - 2)
+        low, high = int(self.pulses[index]), int(self.pulses[index + 1])
+        return low + int((high - low) * (code - index * lut_code_step) / lut_code_step)
+
+    def encode(self):
+        return "LUT " + ",".join(str(pulse) for pulse in self.pulses) + "\n"
+
+    def upload(self, ser, timeout=1.0):
+        """
+        Sends the table and waits for its "LACK <entries>" acknowledgement.
+        Returns True if the firmware accepted every entry.
+        """
+        ser.write(self.encode().encode())
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            line = ser.readline().decode('utf-8', errors='replace').strip()
+            if line.startswith("LACK"):
+                if line != f"LACK {lut_size}":
+                    print(f"Arduino rejected the intensity table: {line}")
+                    return False
+                self.uploaded = True
+                return True
+        print("No acknowledgement received for the intensity table.")
+        return False
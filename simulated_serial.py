@@ -0,0 +1,512 @@
+import re
+import threading
+import time
+
+import numpy
+
+from command_queue import iteration_step, queue_size
+from force_stream import sensor_channels
+from servo_intensity import lut_code_step, lut_size, servo_max_pulse, servo_min_pulse
+
+# --------------------------- Configuration ---------------------------
+
+# Defaults of the simulated Arduino (see sketch_forcesensor.ino)
+default_sample_rate = 1000  # Force samples per second
+sample_block = 16  # Samples sent at a time (SAMPLE_BLOCK, one half of the firmware's double buffer)
+baseline_force = 12  # Resting sensor difference
+noise_amplitude = 3  # Peak-to-peak noise around the baseline
+tap_force_per_degree = 4  # Peak force per servo degree above neutral
+tap_duration = 0.2  # Seconds a tap presses on the sensor
+neutral_position = 30  # Neutral servo angle
+accel_midpoint = 512  # Accelerometer reading at rest (ADC counts)
+
+# Firmware limits and constants (see sketch_forcesensor.ino)
+received_chars = 200  # Size of the command buffer (numChars)
+profile_slots = 4
+profile_segments = 8
+queue_ops = 'MPWSUNC'  # Op codes loadQueue() accepts
+cpu_frequency = 16000000  # F_CPU
+timer2_prescalers = (8, 32, 64, 128, 256, 1024)
+condition_distances = {1: 0.5, 2: 0.5, 3: 1.5, 4: 1.5, 5: 3, 6: 3}  # cm moved before the taps
+leading_integer = re.compile(r"\s*([+-]?\d+)")
+
+# Line formats the firmware has used over time
+line_formats = ('sequenced', 'legacy', 'bare')
+
+# --------------------------- Functions ---------------------------
+
+
+class SimulatedSerial:
+    """
+    Stand-in for serial.Serial that behaves like the Arduino running
+    sketch_forcesensor.ino: it streams force samples at a fixed rate and
+    handles commands the way the firmware's handleCommand() does. A trial
+    command ("0..." or "T0...") and QLOAD/QRUN queue entries whose output
+    (STATE, QDONE and QEND lines) and force pulses appear at the times
+    updateQueue() would produce them; commands the firmware does not know,
+    such as the host's "1..." taps and "MOVE <distance> <speed>", are ignored.
+
+    With realtime=True, samples become available in blocks of sample_block as
+    wall-clock time passes, and read() and readline() block like a real port,
+    sleeping until the next block is due in one time.sleep() call; with
+    realtime=False every read returns the next samples immediately (for
+    throughput measurements).
+    line_format selects "F,<seq>,<value>" ('sequenced'),
+    "Force sensor difference: N" ('legacy') or a bare integer ('bare');
+    'sequenced' lines carry the extra sensor channels enabled with CHANNELS.
+    drop_rate randomly skips sequence numbers to simulate lost samples.
+    """
+
+    def __init__(self, port=None, baudrate=None, timeout=1, sample_rate=default_sample_rate,
+                 realtime=True, line_format='sequenced', drop_rate=0.0, seed=None):
+        if line_format not in line_formats:
+            raise ValueError(f"Unknown line format '{line_format}'")
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.sample_rate = sample_rate
+        self.realtime = realtime
+        self.line_format = line_format
+        self.drop_rate = drop_rate
+        self.rng = numpy.random.default_rng(seed)
+        self.is_open = True
+
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.next_seq = 0  # Sequence number of the next sample to generate
+        self.pending = bytearray()  # Generated bytes not yet read
+        self.taps = []  # (start time, peak force) of active tap pulses
+        self.boot_time = self.start_time  # micros() counts from here
+        self.received = ''  # Command characters before the next newline
+        self.queue = []  # (op, a, b, c) entries of the loaded queue
+        self.profiles = [(0, [])] * profile_slots  # (cruise, [(steps, interval)]) per slot
+        self.scheduled = []  # (time, kind, value) output of the running queue, in time order
+        self.waiting_entry = None  # (index, time) of a 'C' entry waiting for "continue"
+        self.continue_received = False
+        self.queue_report = False
+        self.queue_start = self.start_time
+        self.bytes_written = 0
+        self.lines_generated = 0
+        self.lines_read = 0
+        self.commands = []  # Every command line received, in order
+        self.channel_mask = 1  # Enabled sensor channels (CHANNELS command); force only after reset
+        self.intensity_lut = []  # Pulse widths uploaded with LUT
+        self._print("Arduino is ready")
+
+    # ---- pyserial compatible interface ----
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            self._generate()
+            return len(self.pending)
+
+    def readline(self):
+        deadline = time.time() + (self.timeout if self.timeout is not None else 1e9)
+        while True:
+            with self.lock:
+                self._generate()
+                end = self.pending.find(b'\n')
+                if end >= 0:
+                    line = bytes(self.pending[:end + 1])
+                    del self.pending[:end + 1]
+                    self.lines_read += 1
+                    return line
+            if not self.realtime:
+                with self.lock:
+                    self._generate(extra_samples=1)
+                continue
+            if time.time() >= deadline:
+                return b''
+            self._wait(deadline)
+
+    def read(self, size=1):
+        deadline = time.time() + (self.timeout if self.timeout is not None else 1e9)
+        while True:
+            with self.lock:
+                self._generate(extra_samples=0 if self.realtime else max(1, size // 10))
+                if len(self.pending) >= size or not self.realtime or time.time() >= deadline:
+                    data = bytes(self.pending[:size])
+                    del self.pending[:size]
+                    self.lines_read += data.count(b'\n')
+                    return data
+            self._wait(deadline)
+
+    def write(self, data):
+        with self.lock:
+            self.bytes_written += len(data)
+            self._generate()
+            self._receive(data.decode('utf-8', errors='replace'))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self._generate()
+            self.pending.clear()
+
+    def flushInput(self):
+        self.reset_input_buffer()
+
+    def close(self):
+        self.is_open = False
+
+    # ---- simulation ----
+
+    def _forces_at(self, times):
+        """
+        Returns the simulated forces at times (an array): baseline noise plus tap pulses.
+        """
+        forces = baseline_force + self.rng.uniform(-noise_amplitude, noise_amplitude, len(times)) / 2
+        for tap_start, peak in self.taps:
+            phase = (times - tap_start) / tap_duration
+            pressed = (phase >= 0) & (phase <= 1)
+            forces[pressed] += peak * numpy.sin(numpy.pi * phase[pressed])
+        return numpy.abs(forces.astype(numpy.int64))
+
+    def _channel_values(self, name, forces):
+        """
+        Returns samples of an extra sensor channel: the moving hand feels a third
+        of the tap, the carriage accelerometer only noise.
+        """
+        if name == 'hand_force':
+            return numpy.abs((baseline_force + (forces - baseline_force) / 3).astype(numpy.int64))
+        return accel_midpoint + self.rng.uniform(-noise_amplitude, noise_amplitude, len(forces)).astype(numpy.int64)
+
+    def _format_samples(self, seqs, forces):
+        """
+        Returns the text of a block of samples in the line format.
+        """
+        if self.line_format == 'legacy':
+            return ''.join([f"Force sensor difference: {value}\r\n" for value in forces.tolist()])
+        if self.line_format == 'bare':
+            return ''.join([f"{value}\r\n" for value in forces.tolist()])
+        if self.channel_mask == 1:
+            return ''.join([f"F,{seq},{value}\r\n" for seq, value in zip(seqs.tolist(), forces.tolist())])
+        # Values of the enabled channels that are due at each sequence number
+        columns = []
+        for index, (name, divider) in enumerate(sensor_channels.items()):
+            if self.channel_mask >> index & 1:
+                values = forces if name == 'force' else self._channel_values(name, forces)
+                columns.append((divider, values.tolist()))
+        lines = []
+        for row, seq in enumerate(seqs.tolist()):
+            fields = ','.join([str(values[row]) for divider, values in columns if seq % divider == 0])
+            lines.append(f"F,{seq},{fields}\r\n")
+        return ''.join(lines)
+
+    def _wait(self, deadline):
+        """
+        Sleeps until the next block of samples or queued action is due, or until deadline.
+        """
+        with self.lock:
+            # Half a sample late, so the block is due despite the rounding of epoch times
+            wake = self.start_time + (self.next_seq + sample_block + 0.5) / self.sample_rate
+            if self.scheduled:
+                wake = min(wake, self.scheduled[0][0])
+        time.sleep(max(0.0, min(wake, deadline) - time.time()))
+
+    def _generate(self, extra_samples=0):
+        """
+        Appends the queued output and the samples that are due (realtime, whole blocks)
+        or extra_samples more samples. Must be called with the lock held.
+        """
+        if self.realtime:
+            elapsed = int((time.time() - self.start_time) * self.sample_rate)
+            due = max(self.next_seq, elapsed - elapsed % sample_block)
+        else:
+            due = self.next_seq + extra_samples
+        self._run_scheduled(self._now(due))
+        if due <= self.next_seq:
+            return
+
+        seqs = numpy.arange(self.next_seq, due)
+        if self.drop_rate:
+            seqs = seqs[self.rng.random(len(seqs)) >= self.drop_rate]
+        forces = self._forces_at(self.start_time + seqs / self.sample_rate)
+        self.next_seq = due
+        self.lines_generated += len(seqs)
+        self.pending.extend(self._format_samples(seqs, forces).encode())
+        # Forget finished taps
+        now = self.start_time + due / self.sample_rate
+        self.taps = [tap for tap in self.taps if now - tap[0] <= tap_duration]
+
+    def _now(self, seq=None):
+        if self.realtime:
+            return time.time()
+        return self.start_time + (self.next_seq if seq is None else seq) / self.sample_rate
+
+    def _micros(self, t):
+        return round((t - self.boot_time) * 1000000) % (2 ** 32)
+
+    def _print(self, text):
+        self.pending.extend(f"{text}\r\n".encode())
+
+    # ---- firmware (sketch_forcesensor.ino) ----
+
+    def _receive(self, text):
+        """
+        Collects command characters up to a newline like recvWithEndMarker().
+        """
+        for character in text:
+            if character == '\r':
+                continue
+            if character != '\n':
+                self.received = (self.received + character)[:received_chars - 1]
+                continue
+            command, self.received = self.received, ''
+            self.commands.append(command)
+            self._handle_command(command)
+
+    def _handle_command(self, command):
+        """
+        Translates a received command the way handleCommand() does; unknown commands are ignored.
+        Must be called with the lock held.
+        """
+        if command == "continue":
+            self._continue()
+        elif command.startswith("RATE"):
+            rate = _atol(command[4:])
+            valid = _rate_reachable(rate)
+            if valid:
+                # Keep the sequence continuous across the rate change
+                self.start_time = self._now() - self.next_seq / rate
+                self.sample_rate = rate
+            self._print(f"RATE {rate}" if valid else f"RATE invalid {rate}")
+        elif command.startswith("PROFILE"):
+            slot = self._load_profile(command)
+            self._print(f"PACK {slot}" if slot >= 0 else "PACK invalid")
+        elif command.startswith("LUT"):
+            self._print(f"LACK {self._load_lut(command)}")
+        elif command.startswith("CHANNELS"):
+            mask = _atol(command[8:])
+            if mask & 1 and mask < 1 << len(sensor_channels):
+                self.channel_mask = mask
+                self._print(f"CHANNELS {mask}")
+            else:
+                self._print(f"CHANNELS invalid {mask}")
+        elif command.startswith("QLOAD"):
+            self._print(f"QACK {self._load_queue(command)}")
+        elif command == "QRUN":
+            self._start_queue(report=True)
+        elif self._queue_running():
+            self._print("Busy, command ignored.")
+        elif command.startswith("MOVE_BACK"):
+            self._print("Moving stepper back 3 cm at slow speed.")
+            self.queue = [('M', int(3 / iteration_step), 0, _step_period(1.0))]
+            self._start_queue(report=False)
+        elif command.startswith("MOVE_FORWARD"):
+            self._print("Returning to the wall.")
+            self.queue = [('M', int(3 / iteration_step), 1, _step_period(1.0))]
+            self._start_queue(report=False)
+        elif (command[:1] == '0' and len(command) >= 4) or (command.startswith("T0") and len(command) == 9):
+            self._trial_queue(command)
+            self._start_queue(report=False)
+
+    def _trial_queue(self, command):
+        """
+        Queues a whole trial (moves and both taps) for a "0<condition><fixed><variable>"
+        or "T0<condition><fixed code><variable code>" command.
+        """
+        fine = command[0] == 'T'
+        condition = ord(command[2 if fine else 1]) - ord('0')
+        tap_op = 'S'  # Servo angle
+        fixed_tap = neutral_position + (ord(command[2]) - ord('0')) * 10
+        variable_tap = neutral_position + (ord(command[3]) - ord('0')) * 10
+        if fine:
+            tap_op = 'U'  # Servo pulse width
+            fixed_tap, variable_tap = self._pulse_for_code(_atol(command[3:6])), self._pulse_for_code(_atol(command[6:]))
+        self.queue = []
+        taps = [(tap_op, fixed_tap, 0, 0), ('W', 200000, 0, 0), ('N', 0, 0, 0), ('W', 1000000, 0, 0),
+                (tap_op, variable_tap, 0, 0), ('W', 200000, 0, 0), ('N', 0, 0, 0)]
+        if condition == 8:
+            steps = int(3 / iteration_step)
+            self._enqueue([('M', steps, 0, _step_period(1.0))] + taps +
+                          [('C', 0, 0, 0), ('M', steps, 1, _step_period(2.0))])
+            return
+        steps = int(condition_distances.get(condition, 0) / iteration_step)
+        speed = 1.0 if condition % 2 == 1 else 2.0  # Odd conditions are slow, even conditions fast
+        if steps > 0:
+            self._enqueue([('M', steps, 0, _step_period(speed)), ('W', 1000000, 0, 0),
+                           ('M', steps, 1, _step_period(speed))])
+        self._enqueue(taps)
+
+    def _enqueue(self, entries):
+        self.queue.extend(entries[:queue_size - len(self.queue)])
+
+    def _load_queue(self, command):
+        """
+        Parses "QLOAD <entry>;<entry>;..." like loadQueue(). Returns the entries loaded, or -1.
+        """
+        if self._queue_running():
+            return -1
+        self.queue = []
+        for entry in [entry for entry in command[6:].split(';') if entry]:
+            fields = [_atol(field) for field in [field for field in entry.split(',') if field][1:4]]
+            op, a, b, c = (entry[0],) + tuple(fields + [0] * (3 - len(fields)))
+            if len(self.queue) >= queue_size or op not in queue_ops or \
+                    (op == 'P' and not (0 <= c < len(self.profiles) and self.profiles[c][0])):
+                self.queue = []
+                return -1
+            self.queue.append((op, a, b, c))
+        return len(self.queue)
+
+    def _load_profile(self, command):
+        """
+        Parses "PROFILE <slot> <cruise us> <steps>x<us>,..." like loadProfile(). Returns the slot, or -1.
+        """
+        fields = [field for field in command[7:].split(' ') if field]
+        if not fields:
+            return -1
+        slot = _atol(fields[0])
+        if not 0 <= slot < len(self.profiles) or len(fields) < 2 or self._queue_running():
+            return -1
+        cruise, segments = _atol(fields[1]), []
+        self.profiles[slot] = (cruise, segments)
+        for run in [run for run in fields[2].split(',') if run] if len(fields) > 2 else []:
+            if 'x' not in run or len(segments) >= profile_segments:
+                segments.clear()
+                return -1
+            segments.append((_atol(run), _atol(run[run.index('x') + 1:])))
+        return slot if cruise > 0 else -1
+
+    def _load_lut(self, command):
+        """
+        Parses "LUT <us>,<us>,..." like loadLut(). Returns the number of entries, or -1.
+        """
+        if self._queue_running():
+            return -1
+        pulses = [_atol(field) for field in command[3:].replace(',', ' ').split()]
+        if len(pulses) > lut_size or not all(servo_min_pulse <= pulse <= servo_max_pulse for pulse in pulses):
+            self.intensity_lut = []
+            return -1
+        self.intensity_lut = pulses if len(pulses) >= 2 else []
+        return len(self.intensity_lut) or -1
+
+    def _pulse_for_code(self, code):
+        """
+        Pulse width of a fine intensity code, as computed by pulseForCode() in the firmware.
+        """
+        if not self.intensity_lut:
+            return servo_min_pulse + (10 * neutral_position + code) * (servo_max_pulse - servo_min_pulse) // 1800
+        code = min(max(code, 0), (len(self.intensity_lut) - 1) * lut_code_step)
+        index = min(code // lut_code_step, len(self.intensity_lut) - 2)
+        low, high = self.intensity_lut[index], self.intensity_lut[index + 1]
+        return low + int((high - low) * (code - index * lut_code_step) / lut_code_step)
+
+    # ---- command queue ----
+
+    def _queue_running(self):
+        return bool(self.scheduled) or self.waiting_entry is not None
+
+    def _start_queue(self, report):
+        """
+        Starts the loaded queue like startQueue(): its output is scheduled at the times
+        updateQueue() would produce it.
+        """
+        self.scheduled = []  # A restarted queue drops what was still to come
+        self.waiting_entry = None
+        self.queue_report = report
+        self.queue_start = self._now()
+        self.continue_received = False
+        if self.queue:
+            self._schedule(0, self.queue_start)
+
+    def _schedule(self, index, t):
+        """
+        Schedules the queue's output from entry index on, starting at time t, up to the
+        end of the queue or a 'C' entry that has not received "continue" yet.
+        """
+        for index in range(index, len(self.queue)):
+            op, a, b, c = self.queue[index]
+            if op in ('M', 'P'):
+                self._at(t, f"STATE MOVE_START {b} {self._micros(t)}")
+                t += self._move_duration(op, a, c) / 1000000
+                self._at(t, f"STATE MOVE_END {b} {self._micros(t)}")
+            elif op == 'W':
+                t += a / 1000000
+            elif op in ('S', 'U'):
+                angle = a if op == 'S' else (a - servo_min_pulse) * 180 / (servo_max_pulse - servo_min_pulse)
+                self._at(t, f"Moving servo to {'angle' if op == 'S' else 'pulse'}: {a}")
+                self.scheduled.append((t, 'tap', max(0, angle - neutral_position) * tap_force_per_degree))
+                self._at(t, f"STATE TAP_ON {a} {self._micros(t)}")
+            elif op == 'N':
+                self._at(t, f"STATE TAP_OFF {neutral_position} {self._micros(t)}")
+            elif op == 'C':
+                self._at(t, "Waiting for foot press...")
+                self._at(t, f"STATE WAIT_CONTINUE 0 {self._micros(t)}")
+                if not self.continue_received:
+                    self.waiting_entry = (index, t)
+                    return
+                self.continue_received = False
+            if self.queue_report:
+                self._at(t, f"QDONE {index} {round((t - self.queue_start) * 1000000)}")
+        if self.queue_report:
+            self._at(t, f"QEND {round((t - self.queue_start) * 1000000)}")
+        self.scheduled.append((t, 'end', None))
+
+    def _continue(self):
+        if self.waiting_entry is None:
+            self.continue_received = True  # Consumed when the queue reaches its 'C' entry
+            return
+        (index, t), self.waiting_entry = self.waiting_entry, None
+        t = max(t, self._now())  # Timing restarts after the participant's response
+        if self.queue_report:
+            self._at(t, f"QDONE {index} {round((t - self.queue_start) * 1000000)}")
+        self._schedule(index + 1, t)
+
+    def _move_duration(self, op, steps, period):
+        """
+        Microseconds a move of steps takes: a step period per step, or the profile's intervals ('P').
+        """
+        if op == 'M':
+            return steps * 2 * (period // 2)
+        cruise, segments = self.profiles[period]
+        total = 0
+        for index in range(steps):
+            from_edge, interval = min(index, steps - 1 - index), cruise
+            for segment_steps, segment_interval in segments:
+                if from_edge < segment_steps:
+                    interval = segment_interval
+                    break
+                from_edge -= segment_steps
+            total += 2 * (interval // 2)
+        return total
+
+    def _at(self, t, text):
+        self.scheduled.append((t, 'line', text))
+
+    def _run_scheduled(self, now):
+        """
+        Emits the scheduled output that is due by now and starts its tap pulses.
+        """
+        while self.scheduled and self.scheduled[0][0] <= now:
+            t, kind, value = self.scheduled.pop(0)
+            if kind == 'line':
+                self._print(value)
+            elif kind == 'tap':
+                self.taps.append((t, value))
+
+
+def _atol(text):
+    """
+    Parses a leading integer like C's atol(): 0 if there is none.
+    """
+    match = leading_integer.match(text)
+    return int(match.group(1)) if match else 0
+
+
+def _rate_reachable(rate):
+    """
+    Whether setSampleRate() can reach rate with one of Timer2's prescalers.
+    """
+    return rate > 0 and any(1 <= cpu_frequency // prescaler // rate - 1 <= 255 for prescaler in timer2_prescalers)
+
+
+def _step_period(speed):
+    """
+    Step period in microseconds for a speed in cm/s, as stepPeriodFor() computes it.
+    """
+    return 2 * int(iteration_step / speed * 1000000)
@@ -8,11 +8,145 @@
 #define DIR_PIN 8  // Direction pin for the stepper driver
 #define sensorPinA A6 // Force sensor pin A
 #define sensorPinB A7 // Force sensor pin B
+#define handPinA A4   // Moving-hand force sensor pin A
+#define handPinB A5   // Moving-hand force sensor pin B
+#define accelPin A0   // Stepper carriage accelerometer (one axis)
 
 Servo servo;        // Create a servo object
 int neutralPos = 30; // Neutral position for the servo
 float iterationStep = 0.00247551686615886833514689880305; // cm per step
 
+// Serial speed; must match baud_rate in the Python scripts.
+// 1 kHz of "F,<seq>,<value>" lines needs ~140 kbit/s.
+#define SERIAL_BAUD 250000
+
+// Force sampling is driven by a Timer2 compare interrupt (Timer1 belongs to
+// the Servo library), so the rate does not depend on what loop() is doing.
+// The rate can be changed at run time with "RATE <hz>" (61 Hz to 10 kHz).
+// The Timer2 ISR only starts the first ADC conversion of a tick; ISR(ADC_vect)
+// collects each result and starts the next one, so interrupts are never held
+// off for a conversion (~104 us each) and the Servo library's pulse timing
+// and serial reception are not delayed. A tick whose conversions cannot start
+// because the previous tick's are still running is dropped (a sequence gap).
+#define FORCE_SAMPLE_RATE_HZ 1000
+#define SAMPLE_BLOCK 16  // Samples per buffer half
+
+// Sensor channels (sensor_channels in force_stream.py). Each channel is read
+// on every sequence number divisible by its divider, and its value follows
+// the sequence number in channel order: "F,<seq>,<force>[,<hand>][,<accel>]".
+// Only the tap force is enabled after reset; "CHANNELS <mask>" changes that.
+#define CHANNEL_COUNT 3
+#define CHANNEL_FORCE 0        // Tapped hand, A6/A7 difference
+#define CHANNEL_HAND_FORCE 1   // Moving hand, A4/A5 difference
+#define CHANNEL_CARRIAGE_ACCEL 2
+const byte channelDividers[CHANNEL_COUNT] = {1, 2, 4};  // 1000, 500 and 250 Hz at the default rate
+// ADC inputs of each channel; channels with two inputs report their absolute difference
+const byte channelInputs[CHANNEL_COUNT] = {2, 2, 1};
+const byte channelPins[CHANNEL_COUNT][2] = {
+  {sensorPinA - A0, sensorPinB - A0},
+  {handPinA - A0, handPinB - A0},
+  {accelPin - A0, accelPin - A0}
+};
+volatile byte channelMask = 1 << CHANNEL_FORCE;
+
+// Conversions of the running tick (filled by the Timer2 ISR, consumed by the ADC ISR)
+#define MAX_CONVERSIONS (2 * CHANNEL_COUNT)
+volatile byte conversionInputs[MAX_CONVERSIONS];
+volatile int conversionResults[MAX_CONVERSIONS];
+volatile byte conversionCount = 0;
+volatile byte conversionIndex = 0;
+volatile byte conversionMask = 0;     // Channels due at conversionSeq
+volatile unsigned long conversionSeq = 0;
+volatile boolean converting = false;
+
+// Double buffer: the ISR fills one half while loop() sends the other.
+// Every sample gets a sequence number; if both halves are full the sample
+// is dropped but its number is still used, so Python can see the gap.
+struct ForceSample {
+  unsigned long seq;
+  byte count;                  // Values taken at this sequence number
+  int values[CHANNEL_COUNT];
+};
+volatile ForceSample sampleBuffers[2][SAMPLE_BLOCK];
+volatile byte fillBuffer = 0;        // Half the ISR is writing into
+volatile byte fillCount = 0;         // Samples in the fill half
+volatile boolean bufferReady[2] = {false, false};
+volatile unsigned long sampleSeq = 0;
+byte sendBuffer = 0;                 // Half loop() is sending from
+byte sendIndex = 0;                  // Next sample to send in that half
+
+// Serial input is collected without blocking (see recvWithEndMarker)
+const byte numChars = 200;
+char receivedChars[numChars];
+boolean inputReceived = false;
+
+// Command queue: a whole trial timeline uploaded in one "QLOAD" line and
+// executed on "QRUN" with micros()-based deadlines (no host round-trips).
+// Entry format (separated by ';'):
+//   M,<steps>,<direction>,<step period us>  move the stepper at a constant rate
+//   P,<steps>,<direction>,<profile slot>     move the stepper along a motion profile
+//   W,<us>                                  wait
+//   S,<angle>                               move the servo to an angle
+//   U,<pulse us>                            move the servo to a pulse width
+//   N                                       return the servo to neutral
+//   C                                       wait for "continue" from Python
+// The legacy commands (MOVE_BACK, MOVE_FORWARD, 0..., T0...) are translated into
+// the same queue, so motion never blocks loop() and force sampling continues.
+#define QUEUE_SIZE 24
+struct QueueEntry {
+  char op;
+  long a;
+  long b;
+  long c;
+};
+QueueEntry commandQueue[QUEUE_SIZE];
+int queueLength = 0;
+
+// Queue execution state
+boolean queueRunning = false;
+boolean reportQueue = false;     // Send QDONE/QEND reports (QRUN only)
+boolean entryStarted = false;
+boolean continueReceived = false;
+int queueIndex = 0;
+unsigned long queueStartTime;
+unsigned long deadline;          // Absolute micros() time of the next action
+
+// Stepper state
+long stepsRemaining = 0;
+long stepsTotal = 0;
+boolean stepPinHigh = false;
+unsigned long stepHalfPeriod = 0;
+
+// Motion profiles computed by motion_profile.py: "PROFILE <slot> <cruise us>
+// <steps>x<us>,<steps>x<us>,...". The runs of step intervals are the
+// acceleration ramp; a 'P' move plays it forwards from the start, backwards
+// into the end, and cruises in between.
+#define PROFILE_SLOTS 4
+#define PROFILE_SEGMENTS 8
+struct ProfileSegment {
+  unsigned int steps;
+  unsigned int interval;
+};
+struct MotionProfile {
+  unsigned int cruise;
+  byte segmentCount;
+  ProfileSegment segments[PROFILE_SEGMENTS];
+};
+MotionProfile profiles[PROFILE_SLOTS];
+byte activeProfile = 0;
+
+// Fine intensities: "T<tap><condition><fixed><variable>" sends intensities as
+// three-digit codes in hundredths of a level. The servo pulse width of a code
+// is interpolated from a table computed by servo_intensity.py and uploaded as
+// "LUT <us>,<us>,..." (one entry every LUT_CODE_STEP codes from 0).
+// Without a table the pulse follows the legacy 10 degrees per level.
+#define LUT_SIZE 33
+#define LUT_CODE_STEP 25
+#define SERVO_MIN_PULSE 544   // Servo library defaults for 0 and 180 degrees
+#define SERVO_MAX_PULSE 2400
+unsigned int intensityLut[LUT_SIZE];
+byte lutLength = 0;
+
 void setup() {
   // Initialize the stepper motor control pins
   pinMode(EN_PIN, OUTPUT);
@@ -29,147 +163,580 @@ void setup() {
   servo.write(neutralPos); // Set servo to neutral position
 
   // Initialize serial communication
-  Serial.begin(57600);
+  Serial.begin(SERIAL_BAUD);
   Serial.println("Arduino is ready");
+
+  // Conversion-complete interrupt (the core has enabled the ADC with a /128 prescaler)
+  ADCSRA |= _BV(ADIE);
+
+  // Start fixed-rate force sampling
+  setSampleRate(FORCE_SAMPLE_RATE_HZ);
 }
 
-// Function to move the stepper motor for a specified number of steps at a given speed
-void moveStepper(int steps, int direction, float speed) {
-  digitalWrite(DIR_PIN, direction); // Set the direction
-  digitalWrite(EN_PIN, LOW);        // Activate the stepper driver
+// Configure Timer2 in CTC mode to interrupt at the given rate
+// Returns false if the rate cannot be reached
+boolean setSampleRate(long rateHz) {
+  // Timer2 prescalers and their clock-select bits
+  const int prescalers[] = {8, 32, 64, 128, 256, 1024};
+  const byte clockBits[] = {
+    _BV(CS21), _BV(CS21) | _BV(CS20), _BV(CS22), _BV(CS22) | _BV(CS20),
+    _BV(CS22) | _BV(CS21), _BV(CS22) | _BV(CS21) | _BV(CS20)
+  };
+  if (rateHz <= 0) {
+    return false;
+  }
+  for (int i = 0; i < 6; i++) {
+    long top = F_CPU / prescalers[i] / rateHz - 1;
+    if (top >= 1 && top <= 255) {
+      noInterrupts();
+      TCCR2A = _BV(WGM21);  // CTC mode
+      TCCR2B = clockBits[i];
+      OCR2A = top;
+      TCNT2 = 0;
+      TIMSK2 = _BV(OCIE2A);
+      interrupts();
+      return true;
+    }
+  }
+  return false;
+}
 
-  // Calculate delay based on the speed
-  float timePerStep = iterationStep / speed;   // Time for one step in seconds
-  int delayTime = timePerStep * 1000000;       // Convert to microseconds
+// Start a conversion of one ADC input without waiting for it
+void startConversion(byte input) {
+  ADMUX = _BV(REFS0) | (input & 0x07);  // AVcc reference, as analogRead()
+  ADCSRA |= _BV(ADSC);
+}
 
-  for (int i = 0; i < steps; i++) {
-    digitalWrite(STEP_PIN, HIGH);
-    delayMicroseconds(delayTime); // Use calculated delay based on speed
-    digitalWrite(STEP_PIN, LOW);
-    delayMicroseconds(delayTime); // Adjust delay based on speed
+// Timer2 compare interrupt: start the conversions of one sample at the fixed rate
+ISR(TIMER2_COMPA_vect) {
+  unsigned long seq = sampleSeq++;
+  if (converting || bufferReady[fillBuffer]) {
+    return;  // Conversions still running or both halves full: drop the sample, keep the sequence gap
+  }
+  conversionSeq = seq;
+  conversionMask = 0;
+  conversionCount = 0;
+  for (byte channel = 0; channel < CHANNEL_COUNT; channel++) {
+    if ((channelMask & (1 << channel)) && seq % channelDividers[channel] == 0) {
+      conversionMask |= 1 << channel;
+      for (byte i = 0; i < channelInputs[channel]; i++) {
+        conversionInputs[conversionCount++] = channelPins[channel][i];
+      }
+    }
+  }
+  conversionIndex = 0;
+  if (conversionCount == 0) {
+    storeSample();  // No channel due on this tick
+    return;
   }
-  digitalWrite(EN_PIN, HIGH); // Deactivate the stepper driver when done
+  converting = true;
+  startConversion(conversionInputs[0]);
 }
 
-// Function to control the intensity of the tap (servo motor)
-void moveServo(int intensity) {
-  int angle = neutralPos + (intensity * 10);  // Scale intensity to angle
-  Serial.print("Moving servo to angle: ");
-  Serial.println(angle);
-  servo.write(angle);  // Set the servo position based on intensity
-  delay(200);          // Hold the position for a brief moment
-  servo.write(neutralPos);  // Return to the neutral position (simulate the tap)
+// ADC conversion complete: keep the result and start the next conversion, or
+// store the finished sample
+ISR(ADC_vect) {
+  conversionResults[conversionIndex++] = ADC;
+  if (conversionIndex < conversionCount) {
+    startConversion(conversionInputs[conversionIndex]);
+    return;
+  }
+  converting = false;
+  storeSample();
 }
 
-// Function to read the force sensor difference
-int readForceSensor() {
-  int sensorValueA = analogRead(sensorPinA);  // Read value from sensor pin A
-  int sensorValueB = analogRead(sensorPinB);  // Read value from sensor pin B
-  int sensorDifference = abs(sensorValueA - sensorValueB); // Calculate absolute difference
-  Serial.print("Force sensor difference: ");
-  Serial.println(sensorDifference);  // Print the sensor difference
-  return sensorDifference;
+// Put the tick's channel values into the buffer half being filled (called from the ISRs)
+void storeSample() {
+  byte half = fillBuffer;
+  volatile ForceSample &sample = sampleBuffers[half][fillCount];
+  sample.seq = conversionSeq;
+  sample.count = 0;
+  byte result = 0;
+  for (byte channel = 0; channel < CHANNEL_COUNT; channel++) {
+    if (!(conversionMask & (1 << channel))) {
+      continue;
+    }
+    if (channelInputs[channel] == 2) {
+      sample.values[sample.count++] = abs(conversionResults[result] - conversionResults[result + 1]);
+    } else {
+      sample.values[sample.count++] = conversionResults[result];
+    }
+    result += channelInputs[channel];
+  }
+  fillCount++;
+  if (fillCount >= SAMPLE_BLOCK) {
+    bufferReady[half] = true;
+    fillBuffer = 1 - half;
+    fillCount = 0;
+  }
 }
 
-void loop() {
-  // Read and print force sensor data continuously
-  int forceValue = readForceSensor();
-
-  if (Serial.available() > 0) {
-    String command = Serial.readStringUntil('\n');
-    command.trim(); // Remove whitespace or newline characters
-
-    // Command format: "MOVE <distance> <speed>"
-    if (command.startsWith("MOVE_BACK")) {
-      int stepsToPerform = 3 / iterationStep;  // Move 3 cm back
-      float speed = 1.0;  // Always slow for condition 8
-      Serial.println("Moving stepper back 3 cm at slow speed.");
-      moveStepper(stepsToPerform, LOW, speed);
-    } 
-    else if (command.startsWith("MOVE_FORWARD")) {
-      int stepsToPerform = 3 / iterationStep;  // Move back to the wall
-      float speed = 1.0;  // Speed for returning to the wall
-      Serial.println("Returning to the wall.");
-      moveStepper(stepsToPerform, HIGH, speed);
-    }
-    // Command format: "0<condition><fixed_intensity><variable_intensity>"
-    else if (command.startsWith("0")) {
-      int condition = command.substring(1, 2).toInt();
-      int fixed_intensity = command.substring(2, 3).toInt();
-      int variable_intensity = command.substring(3, 4).toInt();
-
-      if (condition == 8) {
-        // Move back 3 cm, apply taps, and wait for space bar press
-        int stepsToPerform = 3 / iterationStep;
-        float speedForDrive = 1.0; // Slow speed
-        moveStepper(stepsToPerform, LOW, speedForDrive);
-        
-        // Apply the first tap (fixed intensity)
-        moveServo(fixed_intensity);
-        delay(1000);  // 1 second delay between taps
-
-        // Apply the second tap (variable intensity)
-        moveServo(variable_intensity);
-
-        // Wait for the "continue" signal from Python
-        Serial.println("Waiting for foot press...");
-        while (true) {
-          if (Serial.available() > 0) {
-            String nextCommand = Serial.readStringUntil('\n');
-            nextCommand.trim();
-            if (nextCommand == "continue") {
-              // Speed for returning to the wall is always fast for condition 8
-              moveStepper(stepsToPerform, HIGH, 2.0);  // Move forward to the wall at fast speed
-              Serial.println("Returning to the wall.");
-              break;
-            }
-          }
+// Send completed sample blocks as "F,<seq>,<value>[,<value>...]" lines without
+// blocking: only as many lines as fit into the serial transmit buffer are written
+void sendPendingSamples() {
+  while (bufferReady[sendBuffer] && Serial.availableForWrite() >= 32) {
+    volatile ForceSample &sample = sampleBuffers[sendBuffer][sendIndex];
+    Serial.print("F,");
+    Serial.print(sample.seq);
+    for (byte i = 0; i < sample.count; i++) {
+      Serial.print(",");
+      Serial.print(sample.values[i]);
+    }
+    Serial.println();
+    sendIndex++;
+    if (sendIndex >= SAMPLE_BLOCK) {
+      sendIndex = 0;
+      bufferReady[sendBuffer] = false;  // Hand the half back to the ISR
+      sendBuffer = 1 - sendBuffer;
+    }
+  }
+}
+
+// Report a motion state change: "STATE <name> <value> <micros>"
+void reportState(const char *name, long value) {
+  Serial.print("STATE ");
+  Serial.print(name);
+  Serial.print(" ");
+  Serial.print(value);
+  Serial.print(" ");
+  Serial.println(micros());
+}
+
+// Step period in microseconds for a speed in cm/s
+// (the STEP pin is held high and low for iterationStep / speed each)
+long stepPeriodFor(float speed) {
+  return 2 * (long)(iterationStep / speed * 1000000);
+}
+
+// Step interval in microseconds for step index of a profile move of stepsTotal steps
+unsigned long profileInterval(byte slot, long index) {
+  MotionProfile &profile = profiles[slot];
+  long fromEdge = min(index, stepsTotal - 1 - index);
+  for (byte i = 0; i < profile.segmentCount; i++) {
+    if (fromEdge < profile.segments[i].steps) {
+      return profile.segments[i].interval;
+    }
+    fromEdge -= profile.segments[i].steps;
+  }
+  return profile.cruise;
+}
+
+// Parse a "PROFILE <slot> <cruise us> <steps>x<us>,..." line into a profile slot
+// Returns the slot, or -1 if the line is malformed
+int loadProfile(char *command) {
+  char *fieldPtr;
+  char *field = strtok_r(command + 7, " ", &fieldPtr);
+  if (field == NULL) {
+    return -1;
+  }
+  int slot = atoi(field);
+  field = strtok_r(NULL, " ", &fieldPtr);
+  if (slot < 0 || slot >= PROFILE_SLOTS || field == NULL || queueRunning) {
+    return -1;
+  }
+  MotionProfile &profile = profiles[slot];
+  profile.cruise = atol(field);
+  profile.segmentCount = 0;
+  char *runs = strtok_r(NULL, " ", &fieldPtr);
+  char *runPtr;
+  char *run = runs == NULL ? NULL : strtok_r(runs, ",", &runPtr);
+  while (run != NULL) {
+    char *times = strchr(run, 'x');
+    if (times == NULL || profile.segmentCount >= PROFILE_SEGMENTS) {
+      profile.segmentCount = 0;
+      return -1;
+    }
+    ProfileSegment &segment = profile.segments[profile.segmentCount++];
+    segment.steps = atol(run);
+    segment.interval = atol(times + 1);
+    run = strtok_r(NULL, ",", &runPtr);
+  }
+  return profile.cruise > 0 ? slot : -1;
+}
+
+// Parse a "LUT <us>,<us>,..." line into the intensity table
+// Returns the number of entries, or -1 if the line is malformed
+int loadLut(char *command) {
+  if (queueRunning) {
+    return -1;
+  }
+  byte count = 0;
+  char *entryPtr;
+  char *entry = strtok_r(command + 3, " ,", &entryPtr);
+  while (entry != NULL) {
+    long pulse = atol(entry);
+    if (count >= LUT_SIZE || pulse < SERVO_MIN_PULSE || pulse > SERVO_MAX_PULSE) {
+      lutLength = 0;
+      return -1;
+    }
+    intensityLut[count++] = pulse;
+    entry = strtok_r(NULL, " ,", &entryPtr);
+  }
+  lutLength = count >= 2 ? count : 0;
+  return lutLength > 0 ? lutLength : -1;
+}
+
+// Servo pulse width (us) of an intensity code in hundredths of a level
+unsigned int pulseForCode(long code) {
+  if (lutLength == 0) {
+    long tenthDegrees = 10L * neutralPos + code;  // 10 degrees per level: a code is a tenth of a degree
+    return SERVO_MIN_PULSE + (tenthDegrees * (SERVO_MAX_PULSE - SERVO_MIN_PULSE)) / 1800;
+  }
+  long maxCode = (long)(lutLength - 1) * LUT_CODE_STEP;
+  code = constrain(code, 0, maxCode);
+  int index = min(code / LUT_CODE_STEP, (long)lutLength - 2);
+  long offset = code - (long)index * LUT_CODE_STEP;
+  long low = intensityLut[index];
+  long high = intensityLut[index + 1];
+  return low + ((high - low) * offset) / LUT_CODE_STEP;
+}
+
+// Append an entry to the command queue
+void enqueue(char op, long a, long b, long c) {
+  if (queueLength >= QUEUE_SIZE) {
+    return;
+  }
+  QueueEntry &e = commandQueue[queueLength];
+  e.op = op;
+  e.a = a;
+  e.b = b;
+  e.c = c;
+  queueLength++;
+}
+
+// Append a tap (servo out, hold 200 ms, back to neutral) to the command queue.
+// op is 'S' for a target angle or 'U' for a target pulse width.
+void enqueueTap(char op, long target) {
+  enqueue(op, target, 0, 0);
+  enqueue('W', 200000, 0, 0);
+  enqueue('N', 0, 0, 0);
+}
+
+// Parse a "QLOAD <entry>;<entry>;..." line into the command queue
+// Returns the number of entries loaded, or -1 if the line is malformed
+int loadQueue(char *command) {
+  if (queueRunning) {
+    return -1;
+  }
+  queueLength = 0;
+
+  char *entryPtr;
+  char *entry = strtok_r(command + 6, ";", &entryPtr);
+  while (entry != NULL) {
+    if (queueLength >= QUEUE_SIZE) {
+      queueLength = 0;
+      return -1;
+    }
+    QueueEntry &e = commandQueue[queueLength];
+    e.op = entry[0];
+    e.a = 0;
+    e.b = 0;
+    e.c = 0;
+    char *fieldPtr;
+    strtok_r(entry, ",", &fieldPtr);  // Skip the op code
+    char *field = strtok_r(NULL, ",", &fieldPtr);
+    if (field != NULL) { e.a = atol(field); field = strtok_r(NULL, ",", &fieldPtr); }
+    if (field != NULL) { e.b = atol(field); field = strtok_r(NULL, ",", &fieldPtr); }
+    if (field != NULL) { e.c = atol(field); }
+    if (e.op == 'P' && (e.c < 0 || e.c >= PROFILE_SLOTS || profiles[e.c].cruise == 0)) {
+      queueLength = 0;
+      return -1;
+    }
+    if (e.op != 'M' && e.op != 'P' && e.op != 'W' && e.op != 'S' && e.op != 'U' && e.op != 'N' && e.op != 'C') {
+      queueLength = 0;
+      return -1;
+    }
+    queueLength++;
+    entry = strtok_r(NULL, ";", &entryPtr);
+  }
+  return queueLength;
+}
+
+// Start executing the loaded queue
+void startQueue(boolean report) {
+  queueRunning = queueLength > 0;
+  reportQueue = report;
+  queueIndex = 0;
+  entryStarted = false;
+  continueReceived = false;
+  queueStartTime = micros();
+  deadline = queueStartTime;
+}
+
+// Advance the queue by at most one action; never blocks
+void updateQueue() {
+  if (!queueRunning) {
+    return;
+  }
+  QueueEntry &e = commandQueue[queueIndex];
+  unsigned long now = micros();
+  boolean done = false;
+
+  if (e.op == 'M' || e.op == 'P') {
+    if (!entryStarted) {
+      digitalWrite(DIR_PIN, e.b);
+      digitalWrite(EN_PIN, LOW);
+      stepsRemaining = e.a;
+      stepsTotal = e.a;
+      stepHalfPeriod = e.c / 2;
+      activeProfile = e.c;
+      stepPinHigh = false;
+      entryStarted = true;
+      reportState("MOVE_START", e.b);
+    }
+    if ((long)(now - deadline) >= 0) {
+      if (stepPinHigh) {
+        digitalWrite(STEP_PIN, LOW);
+        stepPinHigh = false;
+        stepsRemaining--;
+        deadline += stepHalfPeriod;
+      } else if (stepsRemaining > 0) {
+        if (e.op == 'P') {
+          stepHalfPeriod = profileInterval(activeProfile, stepsTotal - stepsRemaining) / 2;
         }
+        digitalWrite(STEP_PIN, HIGH);
+        stepPinHigh = true;
+        deadline += stepHalfPeriod;
       } else {
-        // Conditions 1 to 6: Move stepper and apply two taps
-        int stepsToPerform = 0;
-        float speedFor1stDrive = 0.5;  // Default slow speed
-        float speedFor2ndDrive = 1.0;  // Speed for returning (fast or slow depending on the condition)
-
-        if (condition == 1) {  // 0.5 cm, slow speed
-          stepsToPerform = 0.5 / iterationStep;
-          speedFor1stDrive = 1.0;
-          speedFor2ndDrive = 1.0;  // Return at same speed
-        } else if (condition == 2) {  // 0.5 cm, fast speed
-          stepsToPerform = 0.5 / iterationStep;
-          speedFor1stDrive = 2.0;
-          speedFor2ndDrive = 2.0;  // Return at same speed
-        } else if (condition == 3) {  // 1.5 cm, slow speed
-          stepsToPerform = 1.5 / iterationStep;
-          speedFor1stDrive = 1.0;
-          speedFor2ndDrive = 1.0;  // Return at same speed
-        } else if (condition == 4) {  // 1.5 cm, fast speed
-          stepsToPerform = 1.5 / iterationStep;
-          speedFor1stDrive = 2.0;
-          speedFor2ndDrive = 2.0;  // Return at same speed
-        } else if (condition == 5) {  // 3 cm, slow speed
-          stepsToPerform = 3 / iterationStep;
-          speedFor1stDrive = 1.0;
-          speedFor2ndDrive = 1.0;  // Return at same speed
-        } else if (condition == 6) {  // 3 cm, fast speed
-          stepsToPerform = 3 / iterationStep;
-          speedFor1stDrive = 2.0;
-          speedFor2ndDrive = 2.0;  // Return at same speed
-        }
+        digitalWrite(EN_PIN, HIGH); // Deactivate the stepper driver when done
+        reportState("MOVE_END", e.b);
+        done = true;
+      }
+    }
+  } else if (e.op == 'W') {
+    if (!entryStarted) {
+      deadline += e.a;
+      entryStarted = true;
+    }
+    done = (long)(now - deadline) >= 0;
+  } else if (e.op == 'S') {
+    Serial.print("Moving servo to angle: ");
+    Serial.println(e.a);
+    servo.write(e.a);
+    reportState("TAP_ON", e.a);
+    done = true;
+  } else if (e.op == 'U') {
+    Serial.print("Moving servo to pulse: ");
+    Serial.println(e.a);
+    servo.writeMicroseconds(e.a);
+    reportState("TAP_ON", e.a);
+    done = true;
+  } else if (e.op == 'N') {
+    servo.write(neutralPos);
+    reportState("TAP_OFF", neutralPos);
+    done = true;
+  } else if (e.op == 'C') {
+    if (!entryStarted) {
+      Serial.println("Waiting for foot press...");
+      reportState("WAIT_CONTINUE", 0);
+      entryStarted = true;
+    }
+    if (continueReceived) {
+      continueReceived = false;
+      deadline = micros();  // Timing restarts after the participant's response
+      done = true;
+    }
+  }
+
+  if (done) {
+    if (reportQueue) {
+      Serial.print("QDONE ");
+      Serial.print(queueIndex);
+      Serial.print(" ");
+      Serial.println(micros() - queueStartTime);
+    }
+    entryStarted = false;
+    queueIndex++;
+    if (queueIndex >= queueLength) {
+      queueRunning = false;
+      if (reportQueue) {
+        Serial.print("QEND ");
+        Serial.println(micros() - queueStartTime);
+      }
+    }
+  }
+}
+
+// Collect serial input up to a newline without blocking
+void recvWithEndMarker() {
+  static byte ndx = 0;
+  char endMarker = '\n';
+  char rc;
+
+  while (Serial.available() > 0 && !inputReceived) {
+    rc = Serial.read();
+
+    if (rc == '\r') {
+      continue;
+    }
+    if (rc != endMarker) {
+      receivedChars[ndx] = rc;
+      ndx++;
+
+      if (ndx >= numChars) {
+        ndx = numChars - 1;
+      }
+    } else {
+      receivedChars[ndx] = '\0'; // terminate the string
+      ndx = 0;
+      inputReceived = true;
+    }
+  }
+}
+
+// Translate a received command into queue entries
+void handleCommand(char *command) {
+  // "continue" is consumed by a running queue waiting on a 'C' entry
+  if (strcmp(command, "continue") == 0) {
+    continueReceived = true;
+    return;
+  }
+
+  // Sampling rate: "RATE <hz>"
+  if (strncmp(command, "RATE", 4) == 0) {
+    long rateHz = atol(command + 4);
+    Serial.print(setSampleRate(rateHz) ? "RATE " : "RATE invalid ");
+    Serial.println(rateHz);
+    return;
+  }
+
+  // Motion profile upload: "PROFILE <slot> <cruise us> <runs>"
+  if (strncmp(command, "PROFILE", 7) == 0) {
+    int slot = loadProfile(command);
+    if (slot >= 0) {
+      Serial.print("PACK ");
+      Serial.println(slot);
+    } else {
+      Serial.println("PACK invalid");
+    }
+    return;
+  }
+
+  // Intensity table: "LUT <us>,<us>,..."
+  if (strncmp(command, "LUT", 3) == 0) {
+    int loaded = loadLut(command);
+    Serial.print("LACK ");
+    Serial.println(loaded);
+    return;
+  }
 
-        // Move stepper forward with speedFor1stDrive
-        moveStepper(stepsToPerform, LOW, speedFor1stDrive);
+  // Sensor channels: "CHANNELS <mask>" (bit 0, the tap force, must stay on)
+  if (strncmp(command, "CHANNELS", 8) == 0) {
+    long mask = atol(command + 8);
+    if ((mask & (1 << CHANNEL_FORCE)) && mask < (1 << CHANNEL_COUNT)) {
+      channelMask = mask;
+      Serial.print("CHANNELS ");
+    } else {
+      Serial.print("CHANNELS invalid ");
+    }
+    Serial.println(mask);
+    return;
+  }
 
-        delay(1000);
+  // Command queue: "QLOAD <entries>" then "QRUN"
+  if (strncmp(command, "QLOAD", 5) == 0) {
+    int loaded = loadQueue(command);
+    Serial.print("QACK ");
+    Serial.println(loaded);
+    return;
+  }
+  if (strcmp(command, "QRUN") == 0) {
+    startQueue(true);
+    return;
+  }
 
-        // Move stepper back to original position with speedFor2ndDrive
-        moveStepper(stepsToPerform, HIGH, speedFor2ndDrive);
+  // Legacy commands replace whatever is queued and start immediately
+  if (queueRunning) {
+    Serial.println("Busy, command ignored.");
+    return;
+  }
 
-        // Perform two taps
-        moveServo(fixed_intensity);
-        delay(1000);
-        moveServo(variable_intensity);
+  // Command format: "MOVE <distance> <speed>"
+  if (strncmp(command, "MOVE_BACK", 9) == 0) {
+    int stepsToPerform = 3 / iterationStep;  // Move 3 cm back
+    float speed = 1.0;  // Always slow for condition 8
+    Serial.println("Moving stepper back 3 cm at slow speed.");
+    queueLength = 0;
+    enqueue('M', stepsToPerform, LOW, stepPeriodFor(speed));
+    startQueue(false);
+  }
+  else if (strncmp(command, "MOVE_FORWARD", 12) == 0) {
+    int stepsToPerform = 3 / iterationStep;  // Move back to the wall
+    float speed = 1.0;  // Speed for returning to the wall
+    Serial.println("Returning to the wall.");
+    queueLength = 0;
+    enqueue('M', stepsToPerform, HIGH, stepPeriodFor(speed));
+    startQueue(false);
+  }
+  // Command formats: "0<condition><fixed_intensity><variable_intensity>" (single digits)
+  // or "T0<condition><fixed code><variable code>" (three-digit fine intensity codes)
+  else if ((command[0] == '0' && strlen(command) >= 4) || (strncmp(command, "T0", 2) == 0 && strlen(command) == 9)) {
+    boolean fine = command[0] == 'T';
+    int condition = command[fine ? 2 : 1] - '0';
+    char tapOp = 'S';  // Servo angle
+    long fixedTap = neutralPos + (command[2] - '0') * 10;
+    long variableTap = neutralPos + (command[3] - '0') * 10;
+    if (fine) {
+      char fixedCode[4] = {command[3], command[4], command[5], '\0'};
+      tapOp = 'U';  // Servo pulse width
+      fixedTap = pulseForCode(atol(fixedCode));
+      variableTap = pulseForCode(atol(command + 6));
+    }
+    queueLength = 0;
+
+    if (condition == 8) {
+      // Move back 3 cm, apply taps, and wait for the "continue" signal
+      int stepsToPerform = 3 / iterationStep;
+      enqueue('M', stepsToPerform, LOW, stepPeriodFor(1.0));  // Slow speed
+      enqueueTap(tapOp, fixedTap);
+      enqueue('W', 1000000, 0, 0);  // 1 second delay between taps
+      enqueueTap(tapOp, variableTap);
+      enqueue('C', 0, 0, 0);
+      // Speed for returning to the wall is always fast for condition 8
+      enqueue('M', stepsToPerform, HIGH, stepPeriodFor(2.0));
+    } else {
+      // Conditions 1 to 6: Move stepper and apply two taps
+      int stepsToPerform = 0;
+      float speedFor1stDrive = 0.5;  // Default slow speed
+      float speedFor2ndDrive = 1.0;  // Speed for returning (fast or slow depending on the condition)
+
+      if (condition == 1 || condition == 2) {  // 0.5 cm
+        stepsToPerform = 0.5 / iterationStep;
+      } else if (condition == 3 || condition == 4) {  // 1.5 cm
+        stepsToPerform = 1.5 / iterationStep;
+      } else if (condition == 5 || condition == 6) {  // 3 cm
+        stepsToPerform = 3 / iterationStep;
+      }
+      if (condition >= 1 && condition <= 6) {
+        // Odd conditions are slow, even conditions fast; return at same speed
+        speedFor1stDrive = (condition % 2 == 1) ? 1.0 : 2.0;
+        speedFor2ndDrive = speedFor1stDrive;
+      }
+
+      if (stepsToPerform > 0) {
+        enqueue('M', stepsToPerform, LOW, stepPeriodFor(speedFor1stDrive));
+        enqueue('W', 1000000, 0, 0);
+        enqueue('M', stepsToPerform, HIGH, stepPeriodFor(speedFor2ndDrive));
       }
+
+      // Perform two taps
+      enqueueTap(tapOp, fixedTap);
+      enqueue('W', 1000000, 0, 0);
+      enqueueTap(tapOp, variableTap);
     }
+    startQueue(false);
+  }
+}
+
+void loop() {
+  // Force samples are taken by the Timer2 and ADC ISRs; loop() only forwards them
+  sendPendingSamples();
+
+  updateQueue();
+
+  recvWithEndMarker();
+  if (inputReceived) {
+    handleCommand(receivedChars);
+    inputReceived = false;
   }
 }